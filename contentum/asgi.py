@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+SSE-потоки событий генерации (core.generation_events) - асинхронные
+представления: под ASGI сервером (uvicorn contentum.asgi:application)
+ожидающие клиенты не занимают потоки и получают события из одного
+общего цикла чтения на процесс.
 """
 
 import os
@@ -138,4 +138,138 @@ SWAGGER_SETTINGS = {
 # Kandinsky settings
 KANDINSKY_API_KEY = os.getenv('KANDINSKY_API_KEY', '')
 KANDINSKY_SECRET_KEY = os.getenv('KANDINSKY_SECRET_KEY', '')
-KANDINSKY_BASE_URL = os.getenv('KANDINSKY_BASE_URL', 'https://api-key.fusionbrain.ai/')
\ No newline at end of file
+KANDINSKY_BASE_URL = os.getenv('KANDINSKY_BASE_URL', 'https://api-key.fusionbrain.ai/')
+KANDINSKY_STYLES_URL = os.getenv('KANDINSKY_STYLES_URL', 'https://cdn.fusionbrain.ai/static/styles/key')
+
+# Chat flow
+# Такой же ответ, пришедший в течение стольких секунд после предыдущего, считается
+# повторной отправкой (двойной клик без Idempotency-Key и flow_step) и отклоняется
+FLOW_DUPLICATE_ANSWER_WINDOW_SECONDS = float(os.getenv('FLOW_DUPLICATE_ANSWER_WINDOW_SECONDS', '5'))
+
+# Generation queue settings
+# Базовый URL для ссылок на изображения в сообщениях чата (воркер не знает Host запроса)
+CONTENTUM_PUBLIC_URL = os.getenv('CONTENTUM_PUBLIC_URL', 'http://localhost:8000')
+# Пауза воркера между проверками пустой очереди (секунды)
+GENERATION_WORKER_POLL_INTERVAL = float(os.getenv('GENERATION_WORKER_POLL_INTERVAL', '2'))
+# Через сколько секунд без heartbeat задача в RUNNING считается зависшей и возвращается в очередь
+GENERATION_TASK_STALE_SECONDS = int(os.getenv('GENERATION_TASK_STALE_SECONDS', '300'))
+# Сколько задач один воркер держит в работе одновременно
+GENERATION_WORKER_CONCURRENCY = int(os.getenv('GENERATION_WORKER_CONCURRENCY', '4'))
+# Как часто воркер обновляет updatedAt своих задач (секунды)
+GENERATION_WORKER_HEARTBEAT_SECONDS = int(os.getenv('GENERATION_WORKER_HEARTBEAT_SECONDS', '30'))
+# Сколько самых старых задач очереди учитывается при честном выборе по пользователям
+GENERATION_FAIR_CLAIM_WINDOW = int(os.getenv('GENERATION_FAIR_CLAIM_WINDOW', '50'))
+# Сколько кандидатов воркер запускает параллельно в одной попытке (1 - по одному, как раньше).
+# Кандидаты отличаются промптом, побеждает первый прошедший проверку качества
+GENERATION_SPECULATIVE_CANDIDATES = int(os.getenv('GENERATION_SPECULATIVE_CANDIDATES', '1'))
+# Сколько генераций пользователь может запустить за сутки, прежде чем воркер перестанет
+# добавлять ему параллельных кандидатов (обычные попытки не ограничиваются)
+GENERATION_USER_DAILY_GENERATIONS = int(os.getenv('GENERATION_USER_DAILY_GENERATIONS', '100'))
+
+# События генерации для SSE (/api/generation-tasks/<id>/events/, /api/chats/<id>/generation-events/)
+# Как часто ASGI-процесс читает новые события (один запрос на всех подписчиков), секунды
+GENERATION_EVENTS_POLL_INTERVAL = float(os.getenv('GENERATION_EVENTS_POLL_INTERVAL', '1'))
+# Максимальная длительность одного SSE-соединения и пауза между keepalive-комментариями
+GENERATION_EVENTS_STREAM_TIMEOUT = float(os.getenv('GENERATION_EVENTS_STREAM_TIMEOUT', '300'))
+GENERATION_EVENTS_KEEPALIVE = float(os.getenv('GENERATION_EVENTS_KEEPALIVE', '15'))
+# Сколько секунд хранить события (старые удаляет run_generation_worker)
+GENERATION_EVENTS_RETENTION_SECONDS = int(os.getenv('GENERATION_EVENTS_RETENTION_SECONDS', '86400'))
+# Срок действия одноразового токена потока (events-token), секунды
+GENERATION_EVENTS_TOKEN_TTL = int(os.getenv('GENERATION_EVENTS_TOKEN_TTL', '60'))
+
+# Kandinsky status poller settings
+# Максимум параллельных запросов статуса
+KANDINSKY_POLLER_CONCURRENCY = int(os.getenv('KANDINSKY_POLLER_CONCURRENCY', '8'))
+# Адаптивное расписание опроса: первая проверка - через перцентиль последних
+# KANDINSKY_LATENCY_WINDOW длительностей генерации этого разрешения
+# (или KANDINSKY_POLL_INITIAL_DELAY, пока замеров меньше KANDINSKY_LATENCY_MIN_SAMPLES),
+# дальше пауза растёт от BACKOFF_BASE в BACKOFF_FACTOR раз до MAX_DELAY с разбросом ±JITTER
+KANDINSKY_LATENCY_WINDOW = int(os.getenv('KANDINSKY_LATENCY_WINDOW', '50'))
+KANDINSKY_LATENCY_MIN_SAMPLES = int(os.getenv('KANDINSKY_LATENCY_MIN_SAMPLES', '5'))
+KANDINSKY_LATENCY_PERCENTILE = int(os.getenv('KANDINSKY_LATENCY_PERCENTILE', '50'))
+KANDINSKY_POLL_INITIAL_DELAY = float(os.getenv('KANDINSKY_POLL_INITIAL_DELAY', '10'))
+KANDINSKY_POLL_BACKOFF_BASE = float(os.getenv('KANDINSKY_POLL_BACKOFF_BASE', '2'))
+KANDINSKY_POLL_BACKOFF_FACTOR = float(os.getenv('KANDINSKY_POLL_BACKOFF_FACTOR', '1.5'))
+KANDINSKY_POLL_MAX_DELAY = float(os.getenv('KANDINSKY_POLL_MAX_DELAY', '15'))
+KANDINSKY_POLL_JITTER = float(os.getenv('KANDINSKY_POLL_JITTER', '0.2'))
+# Максимальное время ожидания одной генерации (секунды)
+KANDINSKY_POLL_TIMEOUT = int(os.getenv('KANDINSKY_POLL_TIMEOUT', '280'))
+
+# Kandinsky HTTP client settings
+# Размер пула keep-alive соединений к одному хосту (общий для всех потоков)
+KANDINSKY_POOL_SIZE = int(os.getenv('KANDINSKY_POOL_SIZE', '10'))
+# Повторы при ошибках соединения и ответах 429/5xx, пауза растёт как backoff * 2^n
+KANDINSKY_MAX_RETRIES = int(os.getenv('KANDINSKY_MAX_RETRIES', '3'))
+KANDINSKY_RETRY_BACKOFF = float(os.getenv('KANDINSKY_RETRY_BACKOFF', '0.5'))
+# Таймаут установки соединения и таймауты чтения по эндпоинтам (секунды)
+KANDINSKY_CONNECT_TIMEOUT = float(os.getenv('KANDINSKY_CONNECT_TIMEOUT', '5'))
+KANDINSKY_TIMEOUTS = {
+    'pipelines': float(os.getenv('KANDINSKY_PIPELINES_TIMEOUT', '10')),
+    'run': float(os.getenv('KANDINSKY_RUN_TIMEOUT', '60')),
+    'status': float(os.getenv('KANDINSKY_STATUS_TIMEOUT', '10')),
+    'styles': float(os.getenv('KANDINSKY_STYLES_TIMEOUT', '10')),
+}
+# Время жизни закешированного пайплайна и списка стилей (секунды); после TTL
+# ещё KANDINSKY_CACHE_STALE_TTL секунд отдаётся старое значение, пока оно обновляется в фоне
+KANDINSKY_PIPELINE_CACHE_TTL = int(os.getenv('KANDINSKY_PIPELINE_CACHE_TTL', '3600'))
+KANDINSKY_STYLES_CACHE_TTL = int(os.getenv('KANDINSKY_STYLES_CACHE_TTL', '86400'))
+KANDINSKY_CACHE_STALE_TTL = int(os.getenv('KANDINSKY_CACHE_STALE_TTL', '600'))
+
+# Kandinsky rate limit
+# Запусков генерации в минуту и допустимый всплеск (token bucket)
+KANDINSKY_RATE_LIMIT_PER_MINUTE = float(os.getenv('KANDINSKY_RATE_LIMIT_PER_MINUTE', '20'))
+KANDINSKY_RATE_LIMIT_BURST = int(os.getenv('KANDINSKY_RATE_LIMIT_BURST', '5'))
+# Общий лимит для всех процессов через БД (KandinskyRateLimitBucket)
+KANDINSKY_RATE_LIMIT_SHARED = os.getenv('KANDINSKY_RATE_LIMIT_SHARED', 'False') == 'True'
+# Сколько секунд синхронная генерация ждёт свободный токен
+KANDINSKY_RATE_LIMIT_WAIT = float(os.getenv('KANDINSKY_RATE_LIMIT_WAIT', '60'))
+
+# Kandinsky circuit breaker
+# Сколько ошибок подряд размыкают цепь, сколько секунд запросы отклоняются сразу
+# и сколько пробных запросов пропускается после паузы
+KANDINSKY_BREAKER_FAILURES = int(os.getenv('KANDINSKY_BREAKER_FAILURES', '5'))
+KANDINSKY_BREAKER_RESET_TIMEOUT = float(os.getenv('KANDINSKY_BREAKER_RESET_TIMEOUT', '30'))
+KANDINSKY_BREAKER_HALF_OPEN_CALLS = int(os.getenv('KANDINSKY_BREAKER_HALF_OPEN_CALLS', '1'))
+# Хранилище сгенерированных изображений
+# Ключ из STORAGES (по умолчанию MEDIA_ROOT) и префикс пути; файлы именуются по SHA-256
+GENERATED_IMAGES_STORAGE = os.getenv('GENERATED_IMAGES_STORAGE', 'default')
+GENERATED_IMAGES_PREFIX = os.getenv('GENERATED_IMAGES_PREFIX', 'generated')
+
+# Сервис проверки фото (manage.py run_detection_service)
+# Адрес host:port; пусто - YOLO модели загружаются и работают в текущем процессе
+DETECTION_SERVICE_ADDRESS = os.getenv('DETECTION_SERVICE_ADDRESS', '')
+# Ключ аутентификации клиентов сервиса (по умолчанию SECRET_KEY)
+DETECTION_SERVICE_AUTHKEY = os.getenv('DETECTION_SERVICE_AUTHKEY', '')
+# Число процессов инференса, размер очереди ожидания и сколько секунд запрос ждет места в ней
+DETECTION_SERVICE_PROCESSES = int(os.getenv('DETECTION_SERVICE_PROCESSES', '2'))
+DETECTION_SERVICE_MAX_PENDING = int(os.getenv('DETECTION_SERVICE_MAX_PENDING', '16'))
+DETECTION_SERVICE_QUEUE_TIMEOUT = float(os.getenv('DETECTION_SERVICE_QUEUE_TIMEOUT', '5'))
+# Сколько секунд клиент ждет результат проверки
+DETECTION_SERVICE_TIMEOUT = float(os.getenv('DETECTION_SERVICE_TIMEOUT', '60'))
+# Загружать YOLO модели при старте run_generation_worker, а не при первой проверке.
+# Веб-процессы и management команды модели не загружают, пока не понадобится проверка фото
+DETECTION_PRELOAD_MODELS = os.getenv('DETECTION_PRELOAD_MODELS', 'False') == 'True'
+
+# Кэш результатов проверки фото по SHA-256 изображения и версии детектора
+# Версию нужно менять при замене весов YOLO моделей
+DETECTION_MODEL_VERSION = os.getenv('DETECTION_MODEL_VERSION', 'yolo11l-pose+best')
+PHOTO_CHECK_CACHE_SIZE = int(os.getenv('PHOTO_CHECK_CACHE_SIZE', '512'))
+# Сохранять результаты в PhotoCheckResult (общие для всех процессов)
+PHOTO_CHECK_CACHE_PERSISTENT = os.getenv('PHOTO_CHECK_CACHE_PERSISTENT', 'False') == 'True'
+
+# Сколько изображений передается в YOLO модель за один вызов (evaluate_pose_batch)
+DETECTION_BATCH_SIZE = int(os.getenv('DETECTION_BATCH_SIZE', '8'))
+# Размер входа моделей (imgsz YOLO): большие изображения уменьшаются до него до инференса
+DETECTION_INPUT_SIZE = int(os.getenv('DETECTION_INPUT_SIZE', '640'))
+# Оценка изображений с несколькими людьми: first (только первый найденный), worst,
+# largest или area_weighted
+DETECTION_PERSON_POLICY = os.getenv('DETECTION_PERSON_POLICY', 'first')
+# Люди с рамкой меньше этой доли от самой крупной не оцениваются
+DETECTION_MIN_PERSON_AREA = float(os.getenv('DETECTION_MIN_PERSON_AREA', '0.1'))
+# Формат YOLO моделей: pytorch, onnx или onnx-int8 (manage.py export_detection_models)
+DETECTION_RUNTIME = os.getenv('DETECTION_RUNTIME', 'pytorch')
+# Порядок запуска моделей: crops (hands модель только на рамках найденных людей),
+# gated (hands модель на всем кадре, если люди есть) или full (обе модели всегда)
+DETECTION_STAGE_PLAN = os.getenv('DETECTION_STAGE_PLAN', 'crops')
+# Запас вокруг рамки человека при вырезании для hands модели
+DETECTION_CROP_MARGIN = float(os.getenv('DETECTION_CROP_MARGIN', '0.15'))
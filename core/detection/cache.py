@@ -0,0 +1,159 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# Версия предобработки и подсчета оценки в detection.py:
+# увеличивается при изменении логики проверок, чтобы старые результаты не использовались
+PIPELINE_VERSION = "3"
+
+NO_PERSON_REASON = "на изображении нет человека"
+
+
+# Настройки, от которых зависит результат проверки: все они входят в версию
+# детектора, поэтому при изменении любой из них старые результаты не используются.
+# DETECTION_BATCH_SIZE на результат не влияет и в версию не входит
+RESULT_SETTINGS = (
+    ("DETECTION_MODEL_VERSION", "yolo11l-pose+best"),
+    ("DETECTION_RUNTIME", "pytorch"),
+    ("DETECTION_INPUT_SIZE", 640),
+    ("DETECTION_PERSON_POLICY", "first"),
+    ("DETECTION_MIN_PERSON_AREA", 0.1),
+    ("DETECTION_STAGE_PLAN", "crops"),
+    ("DETECTION_CROP_MARGIN", 0.15),
+)
+
+
+def detector_version():
+    values = [str(getattr(settings, name, default)) for name, default in RESULT_SETTINGS]
+    return ":".join([PIPELINE_VERSION, *values])
+
+
+def is_cacheable(evaluation):
+    """Кэшируем только состоявшиеся проверки - ошибки инференса должны повторяться"""
+    return "checks" in evaluation or evaluation.get("reason") == NO_PERSON_REASON
+
+
+def _plain(value):
+    """numpy bool/float -> значения, которые можно сохранить в JSONField"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class PhotoCheckCache:
+    """
+    Кэш результатов evaluate_pose по SHA-256 байтов изображения и версии детектора.
+    В памяти процесса - LRU на PHOTO_CHECK_CACHE_SIZE записей, с
+    PHOTO_CHECK_CACHE_PERSISTENT результаты также сохраняются в PhotoCheckResult
+    и доступны всем процессам и после перезапуска.
+    """
+
+    def __init__(self, max_size=None, persistent=None):
+        self._max_size = max_size
+        self._persistent = persistent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'PHOTO_CHECK_CACHE_SIZE', 512)
+
+    @property
+    def persistent(self):
+        if self._persistent is not None:
+            return self._persistent
+        return getattr(settings, 'PHOTO_CHECK_CACHE_PERSISTENT', False)
+
+    def key(self, image_bytes):
+        return f"{hashlib.sha256(image_bytes).hexdigest()}:{detector_version()}"
+
+    def get(self, key):
+        with self._lock:
+            evaluation = self._entries.get(key)
+            if evaluation is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return evaluation
+
+        if self.persistent:
+            evaluation = self._load(key)
+            if evaluation is not None:
+                self._remember(key, evaluation)
+                with self._lock:
+                    self.hits += 1
+                return evaluation
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, evaluation):
+        """
+        Запоминает результат и возвращает его в том виде, в каком его отдаст кэш
+        (numpy значения checks -> bool/float). Вызывающий код использует
+        возвращенное значение, поэтому свежая проверка, память и БД дают одинаковые
+        checks. Оценка считается до приведения типов и не пересчитывается.
+        """
+        evaluation = _plain(evaluation)
+        if not is_cacheable(evaluation):
+            return evaluation
+        self._remember(key, evaluation)
+        if self.persistent:
+            self._store(key, evaluation)
+        return evaluation
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, evaluation):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = evaluation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _load(self, key):
+        from ..models import PhotoCheckResult
+        try:
+            stored = PhotoCheckResult.objects.filter(key=key).only("score", "checks", "reason").first()
+        except Exception as e:
+            print(f"❌ PHOTO CHECK CACHE ERROR: {str(e)}")
+            return None
+        if stored is None:
+            return None
+        evaluation = {"score": stored.score, "reason": stored.reason}
+        if stored.reason != NO_PERSON_REASON:
+            evaluation["checks"] = stored.checks
+        return evaluation
+
+    def _store(self, key, evaluation):
+        from ..models import PhotoCheckResult
+        image_sha256, _, version = key.partition(":")
+        try:
+            PhotoCheckResult.objects.update_or_create(
+                key=key,
+                defaults={
+                    "image_sha256": image_sha256,
+                    "detector_version": version,
+                    "score": int(evaluation.get("score", -99)),
+                    "checks": _plain(evaluation.get("checks", {})),
+                    "reason": evaluation.get("reason", ""),
+                }
+            )
+        except Exception as e:
+            # Кэш не должен ломать проверку
+            print(f"❌ PHOTO CHECK CACHE ERROR: {str(e)}")
+
+
+# Синглтон на процесс
+photo_check_cache = PhotoCheckCache()
@@ -1,7 +1,9 @@
 import numpy as np
 import cv2
-from ultralytics import YOLO
 import os
+import threading
+import time
+from django.conf import settings
 
 # Определяем базовый путь к моделям
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -11,126 +13,207 @@ MODELS_DIR = os.path.join(BASE_DIR, 'models')
 POSE_MODEL_PATH = os.path.join(MODELS_DIR, 'yolo11l-pose.pt')
 HANDS_MODEL_PATH = os.path.join(MODELS_DIR, 'best.pt')
 
+# Настройки детекции читаются из django settings (DETECTION_*) при каждом вызове,
+# как и в cache.detector_version - один источник и для проверки, и для ключа кэша
 
-# Проверяем существование файлов моделей
-if not os.path.exists(POSE_MODEL_PATH):
-    print(f"❌ ERROR: Pose model not found at {POSE_MODEL_PATH}")
-    raise FileNotFoundError(f"Pose model not found at {POSE_MODEL_PATH}")
+# Как оценивать изображение с несколькими людьми:
+# first - только первый найденный человек, worst - худший из людей,
+# largest - самый крупный (главный объект), area_weighted - оценка, взвешенная по площади рамок
+PERSON_POLICIES = ("first", "worst", "largest", "area_weighted")
 
-if not os.path.exists(HANDS_MODEL_PATH):
-    print(f"❌ ERROR: Hands model not found at {HANDS_MODEL_PATH}")
-    raise FileNotFoundError(f"Hands model not found at {HANDS_MODEL_PATH}")
+# Формат моделей: pytorch (.pt) или экспортированные для CPU onnx / onnx-int8
+# (файлы рядом с .pt готовит manage.py export_detection_models)
+RUNTIMES = {"pytorch": ".pt", "onnx": ".onnx", "onnx-int8": ".int8.onnx"}
 
-# Загружаем модели
-try:
-    pose_model = YOLO(POSE_MODEL_PATH)
-    hands_model = YOLO(HANDS_MODEL_PATH)
-except Exception as e:
-    raise
+# Порядок запуска моделей: сначала дешевая pose модель, hands - только если нашлись люди.
+# crops - hands модель получает вырезанные рамки людей, gated - кадр целиком,
+# full - обе модели на каждом изображении (как раньше, для сравнения)
+STAGE_PLANS = ("crops", "gated", "full")
 
-def dist(a, b):
-    """Расстояние между двумя точками."""
-    return np.linalg.norm(a - b)
 
-def angle(a, b, c):
-    """
-    Возвращает угол ABC в градусах.
-    a, b, c — точки в формате (x, y), b — вершина угла.
-    """
-    ba = a - b
-    bc = c - b
-    cosang = np.dot(ba, bc) / (np.linalg.norm(ba)*np.linalg.norm(bc) + 1e-6)
-    return np.degrees(np.arccos(np.clip(cosang, -1, 1)))
+def default_batch_size():
+    """Сколько изображений передается в модель за один вызов в evaluate_pose_batch"""
+    return getattr(settings, 'DETECTION_BATCH_SIZE', 8)
 
 
-def extract_pose(path):
-    """
-    Запускает YOLO11L-pose, возвращает список людей.
-    Каждый человек → { "kps": (17, 2), "conf": (17,) }.
-    """
-    result = pose_model(path)[0]
+def input_size():
+    """Размер входа моделей (imgsz YOLO): большие изображения уменьшаются до него заранее"""
+    return getattr(settings, 'DETECTION_INPUT_SIZE', 640)
 
-    persons = []
-    for det in result:
-        if det.keypoints is None:
-            continue
 
-        kps = det.keypoints.xy.cpu().numpy()[0]
-        conf = det.keypoints.conf.cpu().numpy()[0]
-        persons.append({"kps": kps, "conf": conf})
+def person_policy():
+    return getattr(settings, 'DETECTION_PERSON_POLICY', 'first')
 
-    return persons
 
+def min_person_area():
+    """Люди с рамкой меньше этой доли от самой крупной не оцениваются (толпа на заднем плане)"""
+    return getattr(settings, 'DETECTION_MIN_PERSON_AREA', 0.1)
 
-def extract_hands(path):
-    """
-    Запускает YOLO11L-hand-pose, возвращает список рук.
-    Каждая рука → { "kps": (21, 2), "conf": (21,) }.
-    """
-    result = hands_model(path)[0]
 
-    hands = []
-    for det in result:
-        if det.keypoints is None:
-            continue
+def current_runtime():
+    return getattr(settings, 'DETECTION_RUNTIME', 'pytorch')
 
-        kps = det.keypoints.xy.cpu().numpy()[0]
-        conf = det.keypoints.conf.cpu().numpy()[0]
-        hands.append({"kps": kps, "conf": conf})
 
-    return hands
+def stage_plan():
+    return getattr(settings, 'DETECTION_STAGE_PLAN', 'crops')
 
 
-def has_all_limbs(person):
+def crop_margin():
+    """Насколько расширять рамку человека при вырезании для hands модели (доля размера рамки)"""
+    return getattr(settings, 'DETECTION_CROP_MARGIN', 0.15)
+
+
+# Суммарное время этапов проверки в процессе: {этап: {"calls", "images", "seconds"}}
+stage_stats = {}
+_stats_lock = threading.Lock()
+
+# Модели загружаются лениво при первой проверке (или в warm_up):
+# импорт модуля не тянет ultralytics/torch и не читает веса
+pose_model = None
+hands_model = None
+_models_lock = threading.Lock()
+
+
+def model_paths(runtime=None):
+    """Пути (pose, hands) к файлам моделей для формата runtime"""
+    runtime = runtime or current_runtime()
+    if runtime not in RUNTIMES:
+        raise ValueError(f"неизвестный формат моделей: {runtime}")
+    suffix = RUNTIMES[runtime]
+    return (
+        os.path.splitext(POSE_MODEL_PATH)[0] + suffix,
+        os.path.splitext(HANDS_MODEL_PATH)[0] + suffix,
+    )
+
+
+def load_model_pair(runtime=None):
+    """Создает новую пару (pose_model, hands_model) для формата runtime"""
+    pose_path, hands_path = model_paths(runtime)
+
+    # Проверяем существование файлов моделей
+    if not os.path.exists(pose_path):
+        print(f"❌ ERROR: Pose model not found at {pose_path}")
+        raise FileNotFoundError(f"Pose model not found at {pose_path}")
+
+    if not os.path.exists(hands_path):
+        print(f"❌ ERROR: Hands model not found at {hands_path}")
+        raise FileNotFoundError(f"Hands model not found at {hands_path}")
+
+    from ultralytics import YOLO
+    print(f"🔍 DETECTION DEBUG: Loading YOLO models ({runtime or current_runtime()})")
+    # Экспортированные модели не хранят задачу - обе модели keypoint (pose)
+    return YOLO(pose_path, task="pose"), YOLO(hands_path, task="pose")
+
+
+def load_models():
+    """Загружает обе YOLO модели один раз на процесс и возвращает (pose_model, hands_model)"""
+    global pose_model, hands_model
+    if pose_model is not None and hands_model is not None:
+        return pose_model, hands_model
+
+    with _models_lock:
+        if pose_model is None or hands_model is None:
+            pose_model, hands_model = load_model_pair()
+
+    return pose_model, hands_model
+
+
+def warm_up():
     """
-    Проверка наличия важных keypoints:
-    локти + запястья обеих рук (5,6,7,8,9,10 COCO).
-    Но только если они вообще должны быть видны!
+    Загружает модели и прогоняет пустое изображение, чтобы первая настоящая
+    проверка не платила за загрузку весов и инициализацию torch.
     """
-    if person is None or "conf" not in person:
-        return True  # Не можем проверить - считаем что ок
-    
-    # Проверяем уверенность в том, что человек вообще в кадре
-    # (ключевые точки носа, глаз и т.д.)
-    face_keypoints_conf = [person["conf"][i] for i in [0, 1, 2, 3, 4] if i < len(person["conf"])]
-    if face_keypoints_conf and max(face_keypoints_conf) > 0.5:
-        # Лицо видно хорошо - значит человек в кадре и конечности должны быть
-        required = [5, 6, 7, 8, 9, 10]
-        return all(person["conf"][i] > 0.3 for i in required)
-    else:
-        # Лицо не видно - может быть крупный план или что-то еще
-        return True  # Не требуем наличия всех конечностей
+    pose, hands = load_models()
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    pose(blank)
+    hands(blank)
+    print("🔍 DETECTION DEBUG: Models warmed up")
 
 
-def limb_length_check(kps):
+def load_image(image):
     """
-    Проверка пропорций длин сегментов руки:
-    плечо → локоть и локоть → кисть.
-    Отношение должно быть в разумных пределах.
+    Приводит изображение к BGR-массиву, который принимают обе модели:
+    массив возвращается как есть, байты декодируются в памяти, путь читается с диска.
+    Изображение декодируется один раз и затем передается и в pose, и в hands модель.
     """
-    up_l = dist(kps[5], kps[7])
-    low_l = dist(kps[7], kps[9])
+    if isinstance(image, np.ndarray):
+        return image
 
-    up_r = dist(kps[6], kps[8])
-    low_r = dist(kps[8], kps[10])
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        array = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        array = cv2.imread(image)
 
-    def ok(upper, lower):
-        if lower == 0:
-            return False
-        r = upper / lower
-        return 0.4 < r < 2.5
+    if array is None:
+        raise ValueError("не удалось декодировать изображение")
+    return array
 
-    return ok(up_l, low_l) and ok(up_r, low_r)
 
+def prepare_image(image, size=None):
+    """
+    Уменьшает изображение так, чтобы длинная сторона равнялась входу модели.
+    YOLO все равно масштабирует кадр до imgsz, но делает это для каждой модели
+    отдельно и после полного декодирования - здесь это происходит один раз.
+    Возвращает (массив, (scale_x, scale_y)) - множители для возврата координат.
+    """
+    size = size or input_size()
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if longest <= size:
+        return image, (1.0, 1.0)
+
+    ratio = size / longest
+    new_width, new_height = max(1, round(width * ratio)), max(1, round(height * ratio))
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    return resized, (width / new_width, height / new_height)
+
+
+def rescale_keypoints(items, scale):
+    """Переводит keypoints из координат уменьшенного изображения в координаты исходного"""
+    if scale == (1.0, 1.0):
+        return items
+    factor = np.array(scale, dtype=np.float32)
+    box_factor = np.tile(factor, 2)
+    return [
+        {**item, "kps": item["kps"] * factor, "box": None if item.get("box") is None else item["box"] * box_factor}
+        for item in items
+    ]
+
+
+def describe_image(image):
+    if isinstance(image, np.ndarray):
+        return f"array {image.shape[1]}x{image.shape[0]}"
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return f"{len(image)} bytes"
+    return image
+
+
+def parse_keypoints(result):
+    """Результат YOLO для одного изображения → список { "kps": (N, 2), "conf": (N,), "box": (4,) }"""
+    items = []
+    for det in result:
+        if det.keypoints is None:
+            continue
 
-def elbow_angle_ok(kps):
+        kps = det.keypoints.xy.cpu().numpy()[0]
+        conf = det.keypoints.conf.cpu().numpy()[0]
+        box = det.boxes.xyxy.cpu().numpy()[0] if det.boxes is not None else None
+        items.append({"kps": kps, "conf": conf, "box": box})
+
+    return items
+
+
+def extract_pose_batch(images):
     """
-    Проверка углов в локтях.
-    Диапазон 20–170 градусов — естественный изгиб.
+    Запускает pose модель одним батчем, для каждого массива - список людей
+    { "kps": (17, 2), "conf": (17,), "box" }.
     """
-    left = angle(kps[5], kps[7], kps[9])
-    right = angle(kps[6], kps[8], kps[10])
-    return (20 < left < 170) and (20 < right < 170)
+    return [parse_keypoints(result) for result in load_models()[0](list(images))]
+
+
+def extract_hands_batch(images):
+    """Запускает hands модель одним батчем, для каждого массива - список рук { "kps": (21, 2), "conf": (21,) }"""
+    return [parse_keypoints(result) for result in load_models()[1](list(images))]
 
 
 def not_self_intersect(kps):
@@ -148,185 +231,502 @@ def not_self_intersect(kps):
     return True
 
 
-def symmetry_check(kps):
+# Проверки поз и рук: все люди/руки изображения или целого батча
+# проверяются операциями над массивами (N, K, 2) вместо циклов по точкам.
+
+def _dist_v(a, b):
+    return np.linalg.norm(a - b, axis=-1)
+
+
+def _angle_v(a, b, c):
+    ba = a - b
+    bc = c - b
+    cosang = np.sum(ba * bc, axis=-1) / (np.linalg.norm(ba, axis=-1) * np.linalg.norm(bc, axis=-1) + 1e-6)
+    return np.degrees(np.arccos(np.clip(cosang, -1, 1)))
+
+
+def _ratio_in_range(a, b, low, high):
+    """a / b в интервале (low, high); возвращает (в норме, знаменатель нулевой)"""
+    zero = b == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = a / np.where(zero, 1, b)
+    return ~zero & (low < r) & (r < high), zero
+
+
+def _all_clauses(clauses):
     """
-    Проверка симметрии рук и ног:
-    — длины правой/левой руки должны быть похожи,
-    — длины правой/левой ноги тоже должны быть похожи.
-    Это выявляет "левую ногу 2 метра, правую 30 см".
+    `c1 and c2 and ...` для массивов условий (в норме, знаменатель нулевой).
+    Маска degenerate отмечает строки, где первое не выполненное условие -
+    сегмент нулевой длины: в checks они записываются питоновским False
+    (учитывается в оценке как провал), остальные вердикты - np.bool_.
     """
+    ok = np.ones(clauses[0][0].shape, dtype=bool)
+    degenerate = np.zeros_like(ok)
+    for clause_ok, zero in clauses:
+        degenerate |= ok & zero
+        ok &= clause_ok
+    return ok, degenerate
 
-    # Руки: плечо→локоть, локоть→кисть
-    left_upper = dist(kps[5], kps[7])
-    right_upper = dist(kps[6], kps[8])
 
-    left_fore = dist(kps[7], kps[9])
-    right_fore = dist(kps[8], kps[10])
+def has_all_limbs_batch(conf):
+    """
+    Наличие локтей и запястий обеих рук (5-10 COCO) для уверенностей (N, 17).
+    Требуется, только если хорошо видно лицо: иначе это может быть крупный план.
+    """
+    face_visible = conf[:, 0:5].max(axis=1) > 0.5
+    limbs_visible = (conf[:, 5:11] > 0.3).all(axis=1)
+    return ~face_visible | limbs_visible
 
-    # Ноги: бедро→колено→стопа
-    left_leg = dist(kps[11], kps[13]) + dist(kps[13], kps[15])
-    right_leg = dist(kps[12], kps[14]) + dist(kps[14], kps[16])
 
-    def similar(a, b, tol=0.6):
-        """Проверка близости двух значений с допуском ±60%."""
-        if b == 0:
-            return False
-        r = a / b
-        return (1 - tol) < r < (1 + tol)
+def limb_length_check_batch(kps):
+    """
+    Пропорции сегментов рук (N, 17, 2): плечо→локоть / локоть→кисть в (0.4, 2.5).
+    Возвращает (в норме, вырожденный сегмент).
+    """
+    return _all_clauses([
+        _ratio_in_range(_dist_v(kps[:, 5], kps[:, 7]), _dist_v(kps[:, 7], kps[:, 9]), 0.4, 2.5),
+        _ratio_in_range(_dist_v(kps[:, 6], kps[:, 8]), _dist_v(kps[:, 8], kps[:, 10]), 0.4, 2.5),
+    ])
 
-    return (
-        similar(left_upper, right_upper) and
-        similar(left_fore, right_fore) and
-        similar(left_leg, right_leg)
-    )
+
+def elbow_angle_ok_batch(kps):
+    """Углы в локтях (N, 17, 2): естественный изгиб - 20-170 градусов"""
+    left = _angle_v(kps[:, 5], kps[:, 7], kps[:, 9])
+    right = _angle_v(kps[:, 6], kps[:, 8], kps[:, 10])
+    return (20 < left) & (left < 170) & (20 < right) & (right < 170)
+
+
+def symmetry_check_batch(kps, tol=0.6):
+    """
+    Симметрия (N, 17, 2): длины левых и правых сегментов рук и ног отличаются
+    не больше чем на tol ("левая нога 2 метра, правая 30 см").
+    Возвращает (в норме, вырожденный сегмент).
+    """
+    left_leg = _dist_v(kps[:, 11], kps[:, 13]) + _dist_v(kps[:, 13], kps[:, 15])
+    right_leg = _dist_v(kps[:, 12], kps[:, 14]) + _dist_v(kps[:, 14], kps[:, 16])
+    return _all_clauses([
+        _ratio_in_range(_dist_v(kps[:, 5], kps[:, 7]), _dist_v(kps[:, 6], kps[:, 8]), 1 - tol, 1 + tol),
+        _ratio_in_range(_dist_v(kps[:, 7], kps[:, 9]), _dist_v(kps[:, 8], kps[:, 10]), 1 - tol, 1 + tol),
+        _ratio_in_range(left_leg, right_leg, 1 - tol, 1 + tol),
+    ])
 
 
-def hand_deformation(hands):
+def hands_ok_batch(kps, conf):
     """
-    Проверка деформации пальцев, "слипания" пальцев,
-    нереалистичных углов в суставах.
-    ТОЛЬКО ЕСЛИ РУКИ ОБНАРУЖЕНЫ!
+    Деформация рук (N, 21, 2): слипшиеся кончики пальцев (ближе 5 px) или
+    сломанные суставы (угол меньше 10 градусов). True - рука в норме или
+    пропущена из-за низкой уверенности детекции (средняя меньше 0.2).
     """
-    # Если рук нет - это не ошибка, просто нет рук
-    if len(hands) == 0:
-        return True  # нет рук — это нормально
+    confident = conf.mean(axis=1) >= 0.2
+    fingers = kps[:, 1:21].reshape(-1, 5, 4, 2)
+    tips = fingers[:, :, 3]
+    fused = (_dist_v(tips[:, :-1], tips[:, 1:]) < 5).any(axis=1)
+    first_joint = _angle_v(fingers[:, :, 0], fingers[:, :, 1], fingers[:, :, 2])
+    second_joint = _angle_v(fingers[:, :, 1], fingers[:, :, 2], fingers[:, :, 3])
+    broken = ((first_joint < 10) | (second_joint < 10)).any(axis=1)
+    return ~confident | ~(fused | broken)
+
+
+def person_box(person):
+    """Рамка человека (x1, y1, x2, y2): из детекции, а если ее нет - по найденным keypoints"""
+    if person.get("box") is not None:
+        return person["box"]
+    visible = person["kps"][person["conf"] > 0.3]
+    points = visible if len(visible) else person["kps"]
+    return np.concatenate([points.min(axis=0), points.max(axis=0)])
+
+
+def person_area(person):
+    x1, y1, x2, y2 = person_box(person)
+    return float(max(0.0, x2 - x1) * max(0.0, y2 - y1))
+
+
+def match_hands(people, hands):
+    """
+    Сопоставляет руки людям по близости к запястьям: запястье руки (точка 0)
+    привязывается к ближайшему найденному запястью человека (COCO 9, 10),
+    а если запястий у человека не видно - к центру его рамки.
+    Возвращает для каждого человека список индексов его рук.
+    """
+    matched = [[] for _ in people]
+    if not people or not hands:
+        return matched
+
+    anchors, owners = [], []
+    for p_idx, person in enumerate(people):
+        wrists = [person["kps"][i] for i in (9, 10) if person["conf"][i] > 0.3]
+        if not wrists:
+            x1, y1, x2, y2 = person_box(person)
+            wrists = [np.array([(x1 + x2) / 2, (y1 + y2) / 2], dtype=np.float32)]
+        anchors.extend(wrists)
+        owners.extend([p_idx] * len(wrists))
+
+    hand_wrists = np.stack([hand["kps"][0] for hand in hands])
+    distances = _dist_v(hand_wrists[:, None, :], np.stack(anchors)[None, :, :])
+    for h_idx, anchor_idx in enumerate(distances.argmin(axis=1)):
+        matched[owners[anchor_idx]].append(h_idx)
+    return matched
+
+
+def people_to_score(people, policy):
+    """Индексы оцениваемых людей: при first - только первый, иначе все, кроме совсем мелких"""
+    if policy == "first":
+        return [0]
+    areas = [person_area(person) for person in people]
+    largest = max(areas)
+    if largest <= 0:
+        return list(range(len(people)))
+    return [idx for idx, area in enumerate(areas) if area >= min_person_area() * largest]
+
+
+def _score_checks(checks):
+    # Подсчет очков: +1 за успех, 0 за пропущенную проверку, -1 за провал
+    score = 0
+    for check_name, result in checks.items():
+        if result is True:
+            score += 1
+        elif result is False:
+            score -= 1
+        # Если None или что-то еще - не влияет на счет
     
-    print(f"🔍 DETECTION DEBUG: Checking {len(hands)} hands for deformations")
+    print(f"🔍 DETECTION DEBUG: Checks: {checks}, final score: {score}")
     
-    try:
-        for h_idx, h in enumerate(hands):
-            kps = h["kps"]
-            conf = h["conf"]
-            
-            # Проверяем уверенность детекции
-            avg_conf = np.mean(conf)
-            if avg_conf < 0.2:  # Слишком низкая уверенность
-                print(f"🔍 DETECTION DEBUG: Hand {h_idx} has low confidence {avg_conf:.2f}")
-                continue  # Пропускаем эту руку
-            
-            print(f"🔍 DETECTION DEBUG: Hand {h_idx} detected with confidence {avg_conf:.2f}")
-            
-            # Пальцы (каждый по 4 точки): 
-            fingers = [
-                kps[1:5],    # большой
-                kps[5:9],    # указательный
-                kps[9:13],   # средний
-                kps[13:17],  # безымянный
-                kps[17:21]   # мизинец
-            ]
-
-            # Проверка "слипания" кончиков пальцев
-            tips = np.array([f[-1] for f in fingers])
-            for i in range(len(tips) - 1):
-                if dist(tips[i], tips[i+1]) < 5:
-                    # два пальца почти в одной точке — артефакт
-                    print(f"❌ DETECTION DEBUG: Fingers {i} and {i+1} are fused")
-                    return False
-
-            # Проверка углов суставов пальцев
-            for f_idx, f in enumerate(fingers):
-                p0, p1, p2, p3 = f
-                a1 = angle(p0, p1, p2)
-                a2 = angle(p1, p2, p3)
-                if a1 < 10 or a2 < 10:   # палец сломан или слипся
-                    print(f"❌ DETECTION DEBUG: Finger {f_idx} has broken joints: angles {a1:.1f}, {a2:.1f}")
-                    return False
-        
-        return True
-    except Exception as e:
-        print(f"❌ ERROR in hand_deformation: {str(e)}")
-        return True  # При ошибке считаем, что руки нормальные
+    # Определяем причину если есть проблемы
+    reason = ""
+    failed_checks = [name for name, result in checks.items() if result is False]
+    if failed_checks:
+        reason = f"провалены проверки: {', '.join(failed_checks)}"
+    
+    return {
+        "score": score,
+        "checks": checks,
+        "reason": reason if reason else "все проверки пройдены"
+    }
+
 
+def aggregate_people(persons, people, policy):
+    """Сводит оценки людей одного изображения в одну по политике policy"""
+    if policy == "first":
+        return _score_checks(persons[0][1])
+
+    scored = [(p_idx, _score_checks(checks), person_area(people[p_idx])) for p_idx, checks in persons]
+    if policy == "largest":
+        p_idx, result, _ = max(scored, key=lambda item: item[2])
+    else:
+        # worst и area_weighted показывают проверки худшего человека
+        p_idx, result, _ = min(scored, key=lambda item: item[1]["score"])
+        if policy == "area_weighted":
+            total_area = sum(area for _, _, area in scored)
+            if total_area > 0:
+                weighted = sum(r["score"] * area for _, r, area in scored) / total_area
+            else:
+                weighted = sum(r["score"] for _, r, _ in scored) / len(scored)
+            result = {**result, "score": round(weighted)}
 
-def evaluate_pose(image_path):
+    print(f"🔍 DETECTION DEBUG: {policy} over {len(scored)} people -> person {p_idx}, score {result['score']}")
+    return {**result, "person": p_idx, "people_scored": len(scored)}
+
+
+def score_detections_batch(people_batch, hands_batch, policy=None):
     """
-    Полная проверка:
-    — наличие конечностей (если человек есть)
-    — пропорции (если конечности есть)
-    — углы (если локти обнаружены)
-    — симметрия (если обе стороны есть)
-    — пересечения (если торс и запястья есть)
-    — корректность рук (ТОЛЬКО ЕСЛИ РУКИ ОБНАРУЖЕНЫ)
+    Оценка по найденным людям и рукам для нескольких изображений (без запуска моделей).
+    Геометрические проверки всех оцениваемых людей всех изображений считаются
+    одним набором операций над массивами. Общая часть для evaluate_pose и evaluate_pose_batch.
+    При policy first оценивается первый человек и все руки изображения,
+    иначе - каждый человек со своими руками (match_hands), затем aggregate_people.
     """
-    print(f"🔍 DETECTION DEBUG: Evaluating pose for {image_path}")
-    
-    try:
-        if not os.path.exists(image_path):
-            return {"score": -99, "reason": f"файл не найден: {image_path}"}
-        
-        people = extract_pose(image_path)
-        hands = extract_hands(image_path)
-        
-        print(f"🔍 DETECTION DEBUG: Found {len(people)} people, {len(hands)} hands")
+    policy = policy or person_policy()
+    if policy not in PERSON_POLICIES:
+        raise ValueError(f"неизвестная политика оценки людей: {policy}")
 
+    results = [None] * len(people_batch)
+    rows = []
+    for idx, (people, hands) in enumerate(zip(people_batch, hands_batch)):
+        print(f"🔍 DETECTION DEBUG: Found {len(people)} people, {len(hands)} hands")
         if len(people) == 0:
-            return {"score": -99, "reason": "на изображении нет человека"}
-
-        person = people[0]
-        kps = person["kps"]
-        conf = person["conf"]
-        
-        print(f"🔍 DETECTION DEBUG: Keypoints confidence: {np.mean(conf):.2f}")
-        
-        # Проверяем, какие ключевые точки вообще обнаружены
-        detected_keypoints = [i for i, c in enumerate(conf) if c > 0.3]
-        print(f"🔍 DETECTION DEBUG: Detected keypoints: {detected_keypoints}")
-        
-        # Проверки с учетом того, какие части тела обнаружены
+            results[idx] = {"score": -99, "reason": "на изображении нет человека"}
+        else:
+            rows.extend((idx, p_idx) for p_idx in people_to_score(people, policy))
+    
+    if not rows:
+        return results
+    
+    kps = np.stack([people_batch[idx][p_idx]["kps"] for idx, p_idx in rows])
+    conf = np.stack([people_batch[idx][p_idx]["conf"] for idx, p_idx in rows])
+    detected = conf > 0.3
+    
+    limbs_ok = has_all_limbs_batch(conf)
+    proportions_ok, proportions_degenerate = limb_length_check_batch(kps)
+    angles_ok = elbow_angle_ok_batch(kps)
+    symmetry_ok, symmetry_degenerate = symmetry_check_batch(kps)
+
+    # Все руки всех изображений проверяются одним вызовом
+    images = sorted({idx for idx, _ in rows})
+    hand_keys = [(idx, h_idx) for idx in images for h_idx in range(len(hands_batch[idx]))]
+    hands_ok = {}
+    if hand_keys:
+        hand_kps = np.stack([hands_batch[idx][h_idx]["kps"] for idx, h_idx in hand_keys])
+        hand_conf = np.stack([hands_batch[idx][h_idx]["conf"] for idx, h_idx in hand_keys])
+        hands_ok = dict(zip(hand_keys, hands_ok_batch(hand_kps, hand_conf)))
+
+    person_hands = {}
+    for idx in images:
+        if policy == "first":
+            person_hands[(idx, 0)] = list(range(len(hands_batch[idx])))
+        else:
+            for p_idx, hand_ids in enumerate(match_hands(people_batch[idx], hands_batch[idx])):
+                person_hands[(idx, p_idx)] = hand_ids
+    
+    persons_by_image = {}
+    for row, (idx, p_idx) in enumerate(rows):
+        visible = detected[row]
+        arms_visible = visible[[5, 6, 7, 8, 9, 10]].all()
         checks = {}
         
-        # 1. Проверка наличия конечностей - ТОЛЬКО если они должны быть в кадре
-        # (если человек в полный рост, то конечности должны быть)
-        checks["наличие_конечностей"] = has_all_limbs(person) if len(detected_keypoints) > 10 else True
+        # 1. Наличие конечностей - ТОЛЬКО если человек в кадре почти целиком
+        checks["наличие_конечностей"] = bool(limbs_ok[row]) if visible.sum() > 10 else True
         
-        # 2. Проверка пропорций - ТОЛЬКО если есть соответствующие ключевые точки
-        required_for_proportions = all(i in detected_keypoints for i in [5, 6, 7, 8, 9, 10])
-        checks["пропорции"] = limb_length_check(kps) if required_for_proportions else True
+        # 2. Пропорции и 3. углы - ТОЛЬКО если есть плечи, локти и запястья
+        if arms_visible:
+            checks["пропорции"] = False if proportions_degenerate[row] else proportions_ok[row]
+            checks["углы"] = angles_ok[row]
+        else:
+            checks["пропорции"] = True
+            checks["углы"] = True
         
-        # 3. Проверка углов - ТОЛЬКО если есть локти
-        required_for_angles = all(i in detected_keypoints for i in [5, 6, 7, 8, 9, 10])
-        checks["углы"] = elbow_angle_ok(kps) if required_for_angles else True
+        # 4. Пересечения - ТОЛЬКО если есть торс и запястья
+        required_for_intersect = visible[[5, 6, 9, 10, 11, 12]].all()
+        checks["без_пересечений"] = not_self_intersect(kps[row]) if required_for_intersect else True
         
-        # 4. Проверка пересечений - ТОЛЬКО если есть торс и запястья
-        required_for_intersect = all(i in detected_keypoints for i in [5, 6, 9, 10, 11, 12])
-        checks["без_пересечений"] = not_self_intersect(kps) if required_for_intersect else True
+        # 5. Симметрия - ТОЛЬКО если есть обе стороны
+        if visible[[5, 7, 9, 11, 13, 15]].any() and visible[[6, 8, 10, 12, 14, 16]].any():
+            checks["симметрия"] = False if symmetry_degenerate[row] else symmetry_ok[row]
+        else:
+            checks["симметрия"] = True
         
-        # 5. Проверка симметрии - ТОЛЬКО если есть обе стороны
-        has_left_side = any(i in detected_keypoints for i in [5, 7, 9, 11, 13, 15])
-        has_right_side = any(i in detected_keypoints for i in [6, 8, 10, 12, 14, 16])
-        checks["симметрия"] = symmetry_check(kps) if (has_left_side and has_right_side) else True
+        # 6. Руки - ТОЛЬКО ЕСЛИ РУКИ ОБНАРУЖЕНЫ (если рук нет - это нормально)
+        hand_ids = person_hands.get((idx, p_idx), [])
+        checks["руки_нормальные"] = bool(all(hands_ok[(idx, h_idx)] for h_idx in hand_ids)) if hand_ids else True
         
-        # 6. Проверка рук - ТОЛЬКО ЕСЛИ РУКИ ОБНАРУЖЕНЫ
-        # Если рук нет вообще - это нормально
-        checks["руки_нормальные"] = hand_deformation(hands) if len(hands) > 0 else True
-        
-        print(f"🔍 DETECTION DEBUG: Checks: {checks}")
-        
-        # Подсчет очков: +1 за успех, 0 за пропущенную проверку, -1 за провал
-        score = 0
-        for check_name, result in checks.items():
-            if result is True:
-                score += 1
-            elif result is False:
-                score -= 1
-            # Если None или что-то еще - не влияет на счет
-        
-        print(f"🔍 DETECTION DEBUG: Final score: {score}")
+        persons_by_image.setdefault(idx, []).append((p_idx, checks))
+    
+    for idx, persons in persons_by_image.items():
+        results[idx] = aggregate_people(persons, people_batch[idx], policy)
+    
+    return results
+
+
+def score_detections(people, hands, policy=None):
+    """Оценка одного изображения по найденным людям и рукам"""
+    return score_detections_batch([people], [hands], policy)[0]
+
+
+def record_stage(timings, stage, started, images=1):
+    """Добавляет время этапа в timings и в stage_stats процесса, возвращает новую отметку времени"""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - started
+    with _stats_lock:
+        stats = stage_stats.setdefault(stage, {"calls": 0, "images": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats["images"] += images
+        stats["seconds"] += now - started
+    return now
+
+
+def person_crops(image, people, margin=None):
+    """Вырезает из изображения рамки людей с запасом margin -> список (crop, (x0, y0))"""
+    margin = crop_margin() if margin is None else margin
+    height, width = image.shape[:2]
+    crops = []
+    for person in people:
+        x1, y1, x2, y2 = person_box(person)
+        pad_x, pad_y = (x2 - x1) * margin, (y2 - y1) * margin
+        x0, y0 = max(0, round(float(x1 - pad_x))), max(0, round(float(y1 - pad_y)))
+        x3, y3 = min(width, round(float(x2 + pad_x))), min(height, round(float(y2 + pad_y)))
+        if x3 - x0 < 2 or y3 - y0 < 2:
+            continue
+        crops.append((np.ascontiguousarray(image[y0:y3, x0:x3]), (x0, y0)))
+    return crops
+
+
+def offset_keypoints(items, offset):
+    """Переводит keypoints из координат вырезанной рамки в координаты изображения"""
+    shift = np.array(offset, dtype=np.float32)
+    return [
+        {**item, "kps": item["kps"] + shift, "box": None if item.get("box") is None else item["box"] + np.tile(shift, 2)}
+        for item in items
+    ]
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def dedupe_hands(hands, threshold=0.5):
+    """Рамки соседних людей перекрываются: одна и та же рука, найденная дважды, учитывается один раз"""
+    kept = []
+    for hand in hands:
+        box = person_box(hand)
+        if all(box_iou(box, person_box(other)) < threshold for other in kept):
+            kept.append(hand)
+    return kept
+
+
+def run_stages(images, plan=None, originals=None):
+    """
+    Запускает модели по плану этапов для списка подготовленных массивов.
+    Pose модель идет первой; изображения без людей сразу получают пустой список рук
+    и в hands модель не попадают. При crops hands модель видит только рамки людей,
+    вырезанные из originals - исходных изображений до prepare_image, чтобы руки
+    искались в полном разрешении.
+    Возвращает (people_batch, hands_batch, timings) в координатах originals
+    (без originals - в координатах переданных массивов).
+    """
+    plan = plan or stage_plan()
+    if plan not in STAGE_PLANS:
+        raise ValueError(f"неизвестный план этапов детекции: {plan}")
+
+    originals = images if originals is None else originals
+    scales = [
+        (original.shape[1] / image.shape[1], original.shape[0] / image.shape[0])
+        for original, image in zip(originals, images)
+    ]
+
+    timings = {}
+    started = time.perf_counter()
+    people_batch = [
+        rescale_keypoints(people, scale) for people, scale in zip(extract_pose_batch(images), scales)
+    ]
+    started = record_stage(timings, "pose", started, len(images))
+
+    if plan == "full":
+        hands_batch = [
+            rescale_keypoints(hands, scale) for hands, scale in zip(extract_hands_batch(images), scales)
+        ]
+        record_stage(timings, "hands", started, len(images))
+        return people_batch, hands_batch, timings
+
+    hands_batch = [[] for _ in images]
+    with_people = [idx for idx, people in enumerate(people_batch) if people]
+    if not with_people:
+        print(f"🔍 DETECTION DEBUG: No people in {len(images)} images, hands model skipped")
+        return people_batch, hands_batch, timings
+
+    if plan == "gated":
+        for idx, hands in zip(with_people, extract_hands_batch([images[idx] for idx in with_people])):
+            hands_batch[idx] = rescale_keypoints(hands, scales[idx])
+    else:
+        crops, owners = [], []
+        for idx in with_people:
+            for crop, offset in person_crops(originals[idx], people_batch[idx]):
+                crops.append(crop)
+                owners.append((idx, offset))
+        if crops:
+            for (idx, offset), hands in zip(owners, extract_hands_batch(crops)):
+                hands_batch[idx].extend(offset_keypoints(hands, offset))
+            hands_batch = [dedupe_hands(hands) for hands in hands_batch]
+    record_stage(timings, "hands", started, len(with_people))
+    return people_batch, hands_batch, timings
+
+
+def evaluate_pose(image, policy=None, plan=None):
+    """
+    Полная проверка изображения (путь, байты или декодированный массив):
+    — наличие конечностей (если человек есть)
+    — пропорции (если конечности есть)
+    — углы (если локти обнаружены)
+    — симметрия (если обе стороны есть)
+    — пересечения (если торс и запястья есть)
+    — корректность рук (ТОЛЬКО ЕСЛИ РУКИ ОБНАРУЖЕНЫ)
+    policy - как оценивать нескольких людей (PERSON_POLICIES, по умолчанию DETECTION_PERSON_POLICY)
+    plan - порядок запуска моделей (STAGE_PLANS, по умолчанию DETECTION_STAGE_PLAN)
+    В результате timings - время этапов в секундах.
+    """
+    print(f"🔍 DETECTION DEBUG: Evaluating pose for {describe_image(image)}")
+    
+    try:
+        if isinstance(image, str) and not os.path.exists(image):
+            return {"score": -99, "reason": f"файл не найден: {image}"}
         
-        # Определяем причину если есть проблемы
-        reason = ""
-        failed_checks = [name for name, result in checks.items() if result is False]
-        if failed_checks:
-            reason = f"провалены проверки: {', '.join(failed_checks)}"
+        # Декодируем и уменьшаем один раз, а проверки видят keypoints в координатах исходного изображения
+        timings = {}
+        started = time.perf_counter()
+        original = load_image(image)
+        image, _ = prepare_image(original)
+        started = record_stage(timings, "decode", started)
+        people_batch, hands_batch, stage_timings = run_stages([image], plan, [original])
+        timings.update(stage_timings)
         
-        return {
-            "score": score,
-            "checks": checks,
-            "reason": reason if reason else "все проверки пройдены"
-        }
+        started = time.perf_counter()
+        result = score_detections(people_batch[0], hands_batch[0], policy)
+        record_stage(timings, "score", started)
+        print(f"🔍 DETECTION DEBUG: Stage timings: {format_timings(timings)}")
+        return {**result, "timings": timings}
         
     except Exception as e:
         print(f"❌ ERROR in evaluate_pose: {str(e)}")
         import traceback
         traceback.print_exc()
         return {"score": -99, "reason": f"ошибка при проверке: {str(e)}"}
+
+
+def evaluate_pose_batch(images, batch_size=None, policy=None, plan=None):
+    """
+    evaluate_pose для нескольких изображений: каждая модель запускается
+    одним батчем на batch_size изображений вместо отдельного вызова на каждое.
+    На CPU это основной способ поднять пропускную способность проверки.
+    Возвращает список результатов в том же порядке, что и images;
+    timings каждого результата - доля времени этапов батча на одно изображение.
+    """
+    batch_size = batch_size or default_batch_size()
+    print(f"🔍 DETECTION DEBUG: Evaluating batch of {len(images)} images")
+    results = [None] * len(images)
+
+    # Изображение, которое не удалось прочитать, не должно ронять весь батч
+    decoded = []
+    started = time.perf_counter()
+    for idx, image in enumerate(images):
+        try:
+            original = load_image(image)
+            decoded.append((idx, original, prepare_image(original)[0]))
+        except Exception as e:
+            print(f"❌ ERROR in evaluate_pose_batch: image {idx}: {str(e)}")
+            results[idx] = {"score": -99, "reason": f"ошибка при проверке: {str(e)}"}
+    decode_timings = {}
+    record_stage(decode_timings, "decode", started, len(images))
+
+    for start in range(0, len(decoded), batch_size):
+        chunk = decoded[start:start + batch_size]
+        try:
+            people_batch, hands_batch, timings = run_stages(
+                [array for _, _, array in chunk], plan, [original for _, original, _ in chunk]
+            )
+        except Exception as e:
+            print(f"❌ ERROR in evaluate_pose_batch: {str(e)}")
+            for idx, _, _ in chunk:
+                results[idx] = {"score": -99, "reason": f"ошибка при проверке: {str(e)}"}
+            continue
+
+        try:
+            started = time.perf_counter()
+            scores = score_detections_batch(people_batch, hands_batch, policy)
+            record_stage(timings, "score", started, len(chunk))
+        except Exception as e:
+            print(f"❌ ERROR in evaluate_pose_batch: {str(e)}")
+            scores = [{"score": -99, "reason": f"ошибка при проверке: {str(e)}"}] * len(chunk)
+
+        print(f"🔍 DETECTION DEBUG: Stage timings for {len(chunk)} images: {format_timings(timings)}")
+        per_image = {"decode": decode_timings["decode"] / len(images)}
+        per_image.update({stage: seconds / len(chunk) for stage, seconds in timings.items()})
+        for (idx, _, _), result in zip(chunk, scores):
+            results[idx] = {**result, "timings": per_image}
+
+    return results
+
+
+def format_timings(timings):
+    return ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items())
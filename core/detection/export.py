@@ -0,0 +1,102 @@
+import os
+import numpy as np
+from .detection import (
+    HANDS_MODEL_PATH, POSE_MODEL_PATH, input_size, load_image, load_model_pair, model_paths,
+    parse_keypoints, person_box, prepare_image, rescale_keypoints, score_detections,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def export_models(runtime="onnx", imgsz=None):
+    """
+    Экспортирует обе модели из PyTorch в ONNX (упрощенный граф, динамический
+    размер батча для evaluate_pose_batch). Для onnx-int8 веса дополнительно
+    квантуются в int8 через onnxruntime. Файлы кладутся рядом с .pt моделями.
+    Возвращает пути к готовым файлам.
+    """
+    imgsz = imgsz or input_size()
+    from ultralytics import YOLO
+
+    targets = dict(zip((POSE_MODEL_PATH, HANDS_MODEL_PATH), model_paths(runtime)))
+    exported = []
+    for source, target in targets.items():
+        onnx_path = YOLO(source).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if runtime == "onnx-int8":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(onnx_path, target, weight_type=QuantType.QUInt8)
+        elif os.path.abspath(onnx_path) != os.path.abspath(target):
+            os.replace(onnx_path, target)
+        exported.append(target)
+    return exported
+
+
+def fixture_images(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def keypoint_errors(baseline, candidate):
+    """
+    Сопоставляет объекты (людей или руки) по ближайшему центру рамки и
+    возвращает среднюю ошибку keypoints (px) для каждой пары. Учитываются точки,
+    уверенно найденные обеими моделями.
+    """
+    errors = []
+    unused = list(range(len(candidate)))
+    for item in baseline:
+        if not unused:
+            break
+        center = person_box(item).reshape(2, 2).mean(axis=0)
+        distances = [np.linalg.norm(person_box(candidate[idx]).reshape(2, 2).mean(axis=0) - center) for idx in unused]
+        match = candidate[unused.pop(int(np.argmin(distances)))]
+        visible = (item["conf"] > 0.3) & (match["conf"] > 0.3)
+        if visible.any():
+            errors.append(float(np.linalg.norm(item["kps"][visible] - match["kps"][visible], axis=1).mean()))
+    return errors
+
+
+def compare_outputs(report, baseline, candidate, policy=None):
+    """Добавляет в report сравнение (people, hands) двух моделей на одном изображении"""
+    report["images"] += 1
+    for base_items, candidate_items in zip(baseline, candidate):
+        if len(base_items) != len(candidate_items):
+            report["count_mismatches"] += 1
+        report["keypoint_errors"].extend(keypoint_errors(base_items, candidate_items))
+    if score_detections(*baseline, policy)["score"] != score_detections(*candidate, policy)["score"]:
+        report["score_mismatches"] += 1
+    return report
+
+
+def new_report():
+    return {"images": 0, "count_mismatches": 0, "score_mismatches": 0, "keypoint_errors": []}
+
+
+def parity_check(image_paths, candidate="onnx", baseline="pytorch", policy=None):
+    """Прогоняет набор изображений через обе версии моделей и сравнивает результаты"""
+    base_models = load_model_pair(baseline)
+    candidate_models = load_model_pair(candidate)
+    report = new_report()
+
+    for path in image_paths:
+        image, scale = prepare_image(load_image(path))
+        outputs = [
+            [rescale_keypoints(parse_keypoints(model(image)[0]), scale) for model in models]
+            for models in (base_models, candidate_models)
+        ]
+        compare_outputs(report, *outputs, policy=policy)
+    return report
+
+
+def parity_passed(report, tolerance=3.0, max_score_mismatches=0):
+    """Кандидат принимается, если число объектов и оценки совпадают, а keypoints отличаются меньше tolerance px"""
+    errors = report["keypoint_errors"]
+    mean_error = float(np.mean(errors)) if errors else 0.0
+    return (
+        report["images"] > 0
+        and report["count_mismatches"] == 0
+        and report["score_mismatches"] <= max_score_mismatches
+        and mean_error <= tolerance
+    )
@@ -1,65 +1,137 @@
-import os
-import tempfile
 import base64
 from PIL import Image
 import io
-from .detection import evaluate_pose
+from django.conf import settings
+from .cache import photo_check_cache
 
 class PhotoChecker:
+    """
+    Проверка сгенерированных фото. Если задан DETECTION_SERVICE_ADDRESS,
+    изображения проверяет отдельный сервис детекции (manage.py run_detection_service),
+    и этот процесс не импортирует torch и не загружает YOLO модели.
+    Иначе инференс выполняется в текущем процессе.
+    """
     def __init__(self, min_score_threshold=0):
         self.min_score_threshold = min_score_threshold
     
-    def check_photo(self, base64_image_data):
-        try:
-            # Декодируем base64
-            if 'base64,' in base64_image_data:
-                image_data = base64_image_data.split('base64,')[1]
-            else:
-                image_data = base64_image_data
-            
-            image_binary = base64.b64decode(image_data)
-            
-            # Сохраняем временный файл для анализа
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-                tmp_file.write(image_binary)
-                tmp_path = tmp_file.name
-            
-            # Проверяем фото
-            result = evaluate_pose(tmp_path)
-            
-            if result.get("reason") == "на изображении нет человека":
-                print("🔍 PHOTO CHECKER DEBUG: No people detected - this is acceptable")
-                # Проверяем промпт - если он явно не требует людей, то ок
-                # (это можно сделать сложнее, но для простоты скажем что ок)
-                return {
-                    "success": True,
-                    "score": 0,  # Нейтральный score
-                    "checks": {},
-                    "reason": "no people detected (acceptable)",
-                    "passed": True  # ⬅️ ВСЕГДА ПРИНИМАЕМ ФОТО БЕЗ ЛЮДЕЙ
-                }
-            
-            passed = result.get("score", -99) >= self.min_score_threshold
-            print(f"🔍 PHOTO CHECKER DEBUG: Passed: {passed} (threshold: {self.min_score_threshold})")
-            
-            # Очищаем временный файл
-            os.unlink(tmp_path)
-
+    @property
+    def service_address(self):
+        return getattr(settings, 'DETECTION_SERVICE_ADDRESS', '')
+    
+    def warm_up(self):
+        """Заранее загружает модели в этом процессе (при внешнем сервисе детекции ничего не делает)"""
+        if self.service_address:
+            print(f"🔍 PHOTO CHECKER DEBUG: Using detection service at {self.service_address}, nothing to warm up")
+            return
+        from .detection import warm_up
+        warm_up()
+    
+    def decode_bytes(self, base64_image_data):
+        """Base64 (возможно, с префиксом data:...;base64,) → байты изображения"""
+        if 'base64,' in base64_image_data:
+            image_data = base64_image_data.split('base64,')[1]
+        else:
+            image_data = base64_image_data
+        return base64.b64decode(image_data)
+    
+    def decode_image(self, base64_image_data):
+        """Base64 → декодированный массив изображения (в памяти, без временного файла)"""
+        from .detection import load_image
+        return load_image(self.decode_bytes(base64_image_data))
+    
+    def build_result(self, result):
+        """Результат evaluate_pose → ответ проверки с признаком passed"""
+        if result.get("reason") == "на изображении нет человека":
+            print("🔍 PHOTO CHECKER DEBUG: No people detected - this is acceptable")
+            # Проверяем промпт - если он явно не требует людей, то ок
+            # (это можно сделать сложнее, но для простоты скажем что ок)
             return {
                 "success": True,
-                "score": result.get("score", -99),
-                "checks": result.get("checks", {}),
-                "reason": result.get("reason", ""),
-                "passed": passed
+                "score": 0,  # Нейтральный score
+                "checks": {},
+                "reason": "no people detected (acceptable)",
+                "passed": True  # ⬅️ ВСЕГДА ПРИНИМАЕМ ФОТО БЕЗ ЛЮДЕЙ
             }
-            
+        
+        passed = result.get("score", -99) >= self.min_score_threshold
+        print(f"🔍 PHOTO CHECKER DEBUG: Passed: {passed} (threshold: {self.min_score_threshold})")
+
+        return {
+            "success": True,
+            "score": result.get("score", -99),
+            "checks": result.get("checks", {}),
+            "reason": result.get("reason", ""),
+            "passed": passed
+        }
+    
+    def error_result(self, error):
+        print(f"❌ PHOTO CHECKER ERROR: {str(error)}")
+        return {
+            "success": False,
+            "error": str(error),
+            "passed": False
+        }
+    
+    def check_photo(self, base64_image_data):
+        try:
+            image_bytes = self.decode_bytes(base64_image_data)
+            key = photo_check_cache.key(image_bytes)
+            evaluation = photo_check_cache.get(key)
+            if evaluation is not None:
+                print(f"🔍 PHOTO CHECKER DEBUG: Cache hit {key[:12]}")
+            elif self.service_address:
+                from .service import DetectionClient
+                evaluation = photo_check_cache.set(key, DetectionClient().evaluate([image_bytes])[0])
+            else:
+                from .detection import evaluate_pose, load_image
+                evaluation = photo_check_cache.set(key, evaluate_pose(load_image(image_bytes)))
+            return self.build_result(evaluation)
         except Exception as e:
-            print(f"❌ PHOTO CHECKER ERROR: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e),
-                "passed": False
-            }
+            return self.error_result(e)
+    
+    def check_photos(self, base64_images):
+        """
+        Проверка нескольких изображений за один проход моделей (батчем).
+        Уже проверенные изображения берутся из кэша и в батч не попадают.
+        Возвращает результаты в том же порядке, что и base64_images.
+        """
+        remote = bool(self.service_address)
+        results = [None] * len(base64_images)
+        pending = []
+        for idx, base64_image_data in enumerate(base64_images):
+            try:
+                image_bytes = self.decode_bytes(base64_image_data)
+                key = photo_check_cache.key(image_bytes)
+                evaluation = photo_check_cache.get(key)
+                if evaluation is not None:
+                    results[idx] = self.build_result(evaluation)
+                    continue
+                if not remote:
+                    from .detection import load_image
+                    image_bytes = load_image(image_bytes)
+                pending.append((idx, key, image_bytes))
+            except Exception as e:
+                results[idx] = self.error_result(e)
+        
+        if not pending:
+            return results
+        
+        try:
+            if remote:
+                from .service import DetectionClient
+                evaluations = DetectionClient().evaluate([image for _, _, image in pending])
+            else:
+                from .detection import evaluate_pose_batch
+                evaluations = evaluate_pose_batch([image for _, _, image in pending])
+        except Exception as e:
+            evaluations = [None] * len(pending)
+            for idx, _, _ in pending:
+                results[idx] = self.error_result(e)
+        
+        for (idx, key, _), evaluation in zip(pending, evaluations):
+            if evaluation is not None:
+                results[idx] = self.build_result(photo_check_cache.set(key, evaluation))
+        return results
     
     def generate_fix_prompt(self, original_prompt, check_results, max_retries=3):
         """
@@ -96,8 +168,25 @@ class PhotoChecker:
             fix_prompt = fix_prompt[:750] + "..."
         
         problems_text = ", ".join(problems) if problems else "незначительные проблемы"
-        
+
         return fix_prompt, problems_text
 
+    # Проблемы, которые заранее учитываются в вариантах промпта для параллельных кандидатов
+    VARIANT_PROBLEMS = (
+        {"руки_нормальные": False},
+        {"без_пересечений": False},
+        {"руки_нормальные": False, "без_пересечений": False},
+    )
+
+    def prompt_variants(self, original_prompt, count):
+        """
+        Промпты для count параллельных кандидатов одной попытки: исходный промпт
+        и его варианты с исправлениями generate_fix_prompt для частых проблем.
+        Если кандидатов больше, чем вариантов, варианты повторяются
+        (Kandinsky все равно выдает разные изображения).
+        """
+        fixes = [self.generate_fix_prompt(original_prompt, {"checks": checks})[0] for checks in self.VARIANT_PROBLEMS]
+        return [original_prompt] + [fixes[i % len(fixes)] for i in range(max(0, count - 1))]
+
 # Синглтон инстанс
 photo_checker = PhotoChecker(min_score_threshold=1)
\ No newline at end of file
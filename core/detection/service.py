@@ -0,0 +1,174 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from django.conf import settings
+
+
+class DetectionServiceError(Exception):
+    """Сервис детекции недоступен или не ответил вовремя"""
+
+
+class DetectionServiceBusy(DetectionServiceError):
+    """Очередь сервиса детекции заполнена - запрос отклонен без ожидания инференса"""
+
+
+def parse_address(address):
+    """'127.0.0.1:8200' -> ('127.0.0.1', 8200)"""
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def get_authkey():
+    key = getattr(settings, 'DETECTION_SERVICE_AUTHKEY', '') or settings.SECRET_KEY or ''
+    return key.encode()
+
+
+def _load_models():
+    """Инициализатор процесса инференса: модели загружаются один раз на процесс"""
+    from .detection import warm_up
+    warm_up()
+
+
+def _evaluate(images):
+    from .detection import evaluate_pose_batch
+    return evaluate_pose_batch(images)
+
+
+class DetectionServer:
+    """
+    Сервис проверки фото: единственный владелец YOLO моделей.
+    Веб-процессы и воркеры генерации отправляют ему байты изображений через
+    локальный сокет (multiprocessing.connection с authkey) и ждут результат,
+    поэтому torch и веса моделей загружены только в процессах инференса.
+
+    processes - число процессов инференса (0 - инференс в потоке сервера, для отладки).
+    max_pending - сколько запросов может ждать инференса; сверх этого клиент
+    сразу получает отказ "busy" (backpressure вместо бесконечной очереди).
+    """
+
+    def __init__(self, address=None, processes=None, max_pending=None, queue_timeout=None, authkey=None):
+        address = address or getattr(settings, 'DETECTION_SERVICE_ADDRESS', '') or '127.0.0.1:8200'
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.processes = processes if processes is not None else getattr(settings, 'DETECTION_SERVICE_PROCESSES', 2)
+        self.max_pending = max_pending or getattr(settings, 'DETECTION_SERVICE_MAX_PENDING', 16)
+        self.queue_timeout = queue_timeout if queue_timeout is not None else getattr(
+            settings, 'DETECTION_SERVICE_QUEUE_TIMEOUT', 5
+        )
+        self.authkey = authkey or get_authkey()
+        self.stats = {"requests": 0, "images": 0, "busy": 0, "errors": 0}
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.listener = None
+        self.executor = None
+        self._thread = None
+
+    def start(self):
+        """Запуск в фоновом потоке (для тестов и встраивания)"""
+        self.bind()
+        self._thread = threading.Thread(target=self._accept_loop, name="detection-service", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.bind()
+        self._accept_loop()
+
+    def stop(self):
+        self._stopping.set()
+        if self.listener is not None:
+            # Будим accept() пустым подключением, чтобы цикл увидел остановку
+            try:
+                Client(self.listener.address, authkey=self.authkey).close()
+            except Exception:
+                pass
+            self.listener.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def bind(self):
+        """Открывает сокет и пул инференса (повторный вызов ничего не делает)"""
+        if self.listener is not None:
+            return
+        if self.processes > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_load_models)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, initializer=_load_models)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.address = self.listener.address
+
+    def _accept_loop(self):
+        while not self._stopping.is_set():
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                if self._stopping.is_set():
+                    break
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while not self._stopping.is_set():
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                conn.send(self._handle(request))
+
+    def _handle(self, request):
+        images = request.get("images", [])
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["images"] += len(images)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.stats["busy"] += 1
+            print(f"⏳ DETECTION SERVICE DEBUG: Busy, rejected request with {len(images)} images")
+            return {"error": "busy"}
+
+        try:
+            started = time.monotonic()
+            results = self.executor.submit(_evaluate, images).result()
+            print(f"🔍 DETECTION SERVICE DEBUG: Checked {len(images)} images in {time.monotonic() - started:.2f}s")
+            return {"results": results}
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            print(f"❌ DETECTION SERVICE ERROR: {str(e)}")
+            return {"error": str(e)}
+        finally:
+            self._slots.release()
+
+
+class DetectionClient:
+    """Клиент сервиса детекции: отправляет байты изображений и ждет результаты evaluate_pose"""
+
+    def __init__(self, address=None, timeout=None, authkey=None):
+        address = address or getattr(settings, 'DETECTION_SERVICE_ADDRESS', '')
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.timeout = timeout or getattr(settings, 'DETECTION_SERVICE_TIMEOUT', 60)
+        self.authkey = authkey or get_authkey()
+
+    def evaluate(self, images):
+        """Список байтов изображений -> список результатов evaluate_pose в том же порядке"""
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except OSError as e:
+            raise DetectionServiceError(f"сервис детекции недоступен: {str(e)}")
+
+        with conn:
+            conn.send({"images": [bytes(image) for image in images]})
+            if not conn.poll(self.timeout):
+                raise DetectionServiceError(f"сервис детекции не ответил за {self.timeout} сек")
+            response = conn.recv()
+
+        if response.get("error") == "busy":
+            raise DetectionServiceBusy("сервис детекции перегружен")
+        if "error" in response:
+            raise DetectionServiceError(response["error"])
+        return response["results"]
@@ -223,13 +223,18 @@ chat_list_schema = swagger_auto_schema(
 - Сортировка по дате создания, обновления, названию
 
 **Поля ответа:**
-- Основная информация о чате + `messages`, `messageCount`, `lastMessage`
+- Основная информация о чате + `messageCount`, `lastMessage`
 - `flow_step` - текущий шаг в опросе (0-9)
+- `messages` (все сообщения чата) - только с `?include=messages`,
+  детальный запрос `/api/chats/{id}/` возвращает их всегда
 
 **Response:**
 - 200: ✅ Список чатов с пагинацией
 - 401: ❌ Требуется аутентификация
 """,
+    manual_parameters=[
+        openapi.Parameter('include', openapi.IN_QUERY, description="'messages' - добавить все сообщения каждого чата", type=openapi.TYPE_STRING, enum=['messages'])
+    ],
     responses={
         status.HTTP_200_OK: openapi.Response('✅ Успешно', success_response_schema),
         status.HTTP_401_UNAUTHORIZED: openapi.Response('❌ Требуется аутентификация', error_response_schema)
@@ -362,10 +367,11 @@ chat_generation_status_schema = swagger_auto_schema(
 - Информирует о наличии готового изображения
 
 **Возможные статусы:**
-- `PENDING` - задача создана, ожидает обработки
-- `RUNNING` - генерация выполняется
+- `PENDING` - задача в очереди, ожидает воркера
+- `RUNNING` - воркер выполняет генерацию
 - `SUCCESS` - успешно завершено, изображение готово
 - `FAILED` - ошибка генерации
+- `DEFERRED` - Kandinsky API недоступен, задача вернется в очередь автоматически
 
 **Поля ответа:**
 - `generation_status` - текущий статус
@@ -440,8 +446,10 @@ message_create_schema = swagger_auto_schema(
 **📝 Процесс завершения flow:**
 1. Собираются все ответы в PromptParameters
 2. Создается оптимизированный промпт для Kandinsky
-3. Запускается задача генерации изображения с проверкой качества
-4. Возвращаются IDs созданных объектов + ссылки на изображение
+3. Задача генерации изображения с проверкой качества ставится в очередь
+4. Сразу возвращаются IDs созданных объектов + `generation_task_id`
+5. Когда воркер закончит генерацию, в чат добавляется IMAGE сообщение
+   (статус можно отслеживать через `/api/chats/{id}/generation_status/`)
 
 **🔄 Автоматическая перегенерация:**
 - Если сгенерированное фото не проходит проверку качества
@@ -495,11 +503,21 @@ message_create_schema = swagger_auto_schema(
     }
     ```
 
-
+**🔁 Повторная отправка:**
+- Заголовок `Idempotency-Key` (уникальный для каждого ответа, например UUID)
+- Повтор запроса с тем же ключом не создает второе сообщение, не продвигает flow
+  и не запускает вторую генерацию, а возвращает уже принятое сообщение (200)
+- Необязательное поле `flow_step` - шаг, на который отвечает клиент: если вопрос
+  уже отвечен, запрос получает 409 и текущий `flow_step`
+- Без ключа и `flow_step` тот же ответ, повторенный сразу после предыдущего
+  (`FLOW_DUPLICATE_ANSWER_WINDOW_SECONDS`), тоже отклоняется с 409
+- Ответы после завершения flow сохраняются, но генерацию повторно не запускают
 
 **Response:**
 - 201: ✅ Сообщение принято + следующий SYSTEM вопрос
-- 201: ✅ Flow завершён + запущена генерация + данные промптов
+- 201: ✅ Flow завершён + генерация поставлена в очередь + данные промптов
+- 200: 🔁 Повтор запроса с тем же Idempotency-Key (`duplicate: true`)
+- 409: ❌ Ответ на уже отвеченный вопрос (повторная отправка)
 - 400: ❌ Ошибка валидации
 """,
     request_body=openapi.Schema(
@@ -509,8 +527,12 @@ message_create_schema = swagger_auto_schema(
             'chat': openapi.Schema(type=openapi.TYPE_STRING, description='UUID чата', example='123e4567-e89b-12d3-a456-426614174000'),
             'content': openapi.Schema(type=openapi.TYPE_STRING, description='Текст сообщения', example='Фото для Instagram'),
             'messageType': openapi.Schema(type=openapi.TYPE_STRING, description='USER or SYSTEM (по умолчанию USER)', example='USER', enum=['USER', 'SYSTEM']),
+            'flow_step': openapi.Schema(type=openapi.TYPE_INTEGER, description='Шаг flow, на который отвечает клиент (необязательно)', example=0),
         }
     ),
+    manual_parameters=[
+        openapi.Parameter('Idempotency-Key', openapi.IN_HEADER, description="Ключ повторной отправки: дубль запроса вернет уже принятое сообщение", type=openapi.TYPE_STRING, required=False)
+    ],
     responses={
         status.HTTP_201_CREATED: openapi.Response('✅ Сообщение принято, возможно возвращён system_message', openapi.Schema(
             type=openapi.TYPE_OBJECT,
@@ -812,9 +834,9 @@ form_generation_schema = swagger_auto_schema(
 - Принимает все 9 параметров контента сразу через форму
 - Обогащает короткие тексты через GigaChat
 - Собирает промпт и оптимизирует его для Kandinsky
-- Генерирует изображение с проверкой качества
-- При необходимости автоматически перегенерирует
-- Возвращает готовое изображение или статус
+- Ставит генерацию изображения с проверкой качества в очередь
+- Воркер при необходимости автоматически перегенерирует
+- Сразу возвращает ID задачи и ссылки, по которым изображение станет доступно
 
 **🔄 Процесс генерации:**
 1. ✅ Валидация и обогащение параметров
@@ -822,7 +844,10 @@ form_generation_schema = swagger_auto_schema(
 3. 🎨 Генерация через Kandinsky API
 4. 👁️ Проверка качества (руки, лица, анатомия) если включено
 5. 🔁 При неудаче - исправление промпта и повтор (до max_regeneration_attempts раз)
-6. 📦 Возврат результата
+6. 📦 Результат сохраняется в задаче (статус SUCCESS/FAILED)
+
+Шаги 3-6 выполняет фоновый воркер (`python manage.py run_generation_worker`),
+статус задачи доступен по `/api/generation-tasks/{task_id}/`.
 
 **📊 Пример времени:**
 - Без проверки: ~30-45 секунд
@@ -834,7 +859,7 @@ form_generation_schema = swagger_auto_schema(
 - `aspect_ratio` - доступные форматы: 9:16, 16:9, 1:1, 4:5, 2:3
 
 **Response:**
-- 201: ✅ Генерация запущена + данные задачи
+- 201: ✅ Генерация поставлена в очередь + данные задачи
 - 400: ❌ Ошибка валидации параметров
 """,
     request_body=openapi.Schema(
@@ -855,7 +880,7 @@ form_generation_schema = swagger_auto_schema(
         }
     ),
     responses={
-        status.HTTP_201_CREATED: openapi.Response('✅ Генерация запущена', openapi.Schema(
+        status.HTTP_201_CREATED: openapi.Response('✅ Генерация поставлена в очередь', openapi.Schema(
             type=openapi.TYPE_OBJECT,
             properties={
                 'status': openapi.Schema(type=openapi.TYPE_STRING),
@@ -864,7 +889,7 @@ form_generation_schema = swagger_auto_schema(
                     type=openapi.TYPE_OBJECT,
                     properties={
                         'task_id': openapi.Schema(type=openapi.TYPE_STRING, description='ID задачи генерации'),
-                        'status': openapi.Schema(type=openapi.TYPE_STRING, description='Текущий статус (PENDING/RUNNING/SUCCESS/FAILED)'),
+                        'status': openapi.Schema(type=openapi.TYPE_STRING, description='Текущий статус (PENDING/RUNNING/SUCCESS/FAILED/DEFERRED)'),
                         'assembled_prompt': openapi.Schema(type=openapi.TYPE_STRING, description='Собранный промпт'),
                         'image_url': openapi.Schema(type=openapi.TYPE_STRING, description='URL для просмотра изображения (если готово)'),
                         'download_url': openapi.Schema(type=openapi.TYPE_STRING, description='URL для скачивания (если готово)'),
@@ -996,6 +1021,30 @@ generation_task_image_file_schema = swagger_auto_schema(
     }
 )
 
+generation_events_token_schema = swagger_auto_schema(
+    operation_description="""
+# 🎫 Токен для SSE-потока событий генерации
+
+**Роль:** AUTHENTICATED (владелец задачи или чата, ADMIN)
+
+**Что делает этот запрос:**
+- Выдает одноразовый токен для потока `/api/generation-tasks/{id}/events/`
+  (или `/api/chats/{id}/generation-events/` для чата)
+- EventSource не умеет передавать заголовки, поэтому токен передается в URL:
+  `?token=...` - вместо JWT access токена, который не должен попадать в логи и историю
+- Токен открывает только этот поток, один раз и действует `expires_in` секунд
+- Для переподключения (например, с `Last-Event-ID`) запросите новый токен
+
+**Response:**
+- 200: ✅ `token`, `expires_in`
+- 404: ❌ Задача или чат не найдены
+""",
+    responses={
+        status.HTTP_200_OK: openapi.Response('✅ Токен потока', success_response_schema),
+        status.HTTP_404_NOT_FOUND: openapi.Response('❌ Задача или чат не найдены', error_response_schema)
+    }
+)
+
 #=============================================================================
 #EXPORT ALL SCHEMAS
 #=============================================================================
@@ -1026,6 +1075,7 @@ all = [
     'generation_task_image_schema',
     'generation_task_image_file_schema',
     'generation_task_download_schema',
+    'generation_events_token_schema',
 
     # Form generation schemas (NEW)
     'form_generation_schema',
@@ -0,0 +1,213 @@
+import io
+import json
+import uuid
+import base64
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+FAKE_PIPELINE_ID = "fake-kandinsky-pipeline"
+
+FAKE_STYLES = [
+    {"name": "DEFAULT", "title": "Свой стиль", "titleEn": "No style", "image": ""},
+    {"name": "KANDINSKY", "title": "Кандинский", "titleEn": "Kandinsky", "image": ""},
+    {"name": "UHD", "title": "Детальное фото", "titleEn": "Detailed photo", "image": ""},
+    {"name": "ANIME", "title": "Аниме", "titleEn": "Anime", "image": ""},
+]
+
+
+class LatencyDistribution:
+    """
+    Распределение длительности генерации:
+    fixed:<сек>, uniform:<мин>:<макс> или lognormal:<медиана>:<sigma>
+    """
+
+    def __init__(self, spec="lognormal:12:0.35"):
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample(self, rng=random):
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return rng.lognormvariate(0, sigma) * median
+
+    def __str__(self):
+        return ":".join([self.kind] + [f"{param:g}" for param in self.params])
+
+
+class FakeKandinskyServer:
+    """
+    Локальная замена FusionBrain API для нагрузочных тестов и CI.
+    Реализует /key/api/v1/pipelines, /key/api/v1/pipeline/run,
+    /key/api/v1/pipeline/status/<uuid> и /static/styles/key.
+
+    Каждая генерация получает длительность из latency, завершается FAIL
+    с вероятностью failure_rate и флагом censored с вероятностью censor_rate;
+    run отвечает 503 с вероятностью error_rate. Изображения - синтетические
+    PNG запрошенного размера.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8100, latency="lognormal:12:0.35",
+                 failure_rate=0.0, censor_rate=0.0, error_rate=0.0, seed=None):
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution(latency)
+        self.failure_rate = failure_rate
+        self.censor_rate = censor_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.stats = {"pipelines": 0, "run": 0, "status": 0, "styles": 0}
+        self._lock = threading.Lock()
+        self._images = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def styles_url(self):
+        return self.base_url + "static/styles/key"
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-kandinsky", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, params):
+        with self._lock:
+            self.stats["run"] += 1
+            job_uuid = str(uuid.uuid4())
+            latency = self.latency.sample(self.random)
+            self.jobs[job_uuid] = {
+                "width": int(params.get("width", 1024)),
+                "height": int(params.get("height", 1024)),
+                "latency": latency,
+                "ready_at": time.monotonic() + latency,
+                "failed": self.random.random() < self.failure_rate,
+                "censored": self.random.random() < self.censor_rate,
+            }
+        return job_uuid
+
+    def status(self, job_uuid):
+        with self._lock:
+            self.stats["status"] += 1
+            job = self.jobs.get(job_uuid)
+        if job is None:
+            return None
+        if time.monotonic() < job["ready_at"]:
+            return {"uuid": job_uuid, "status": "PROCESSING", "status_time": 0}
+        if job["failed"]:
+            return {"uuid": job_uuid, "status": "FAIL", "errorDescription": "Fake generation failure"}
+        return {
+            "uuid": job_uuid,
+            "status": "DONE",
+            "result": {
+                "files": [self.image_base64(job["width"], job["height"])],
+                "censored": job["censored"],
+            },
+            "generationTime": round(job["latency"], 2),
+        }
+
+    def image_base64(self, width, height):
+        """Синтетический PNG (градиент), кешируется по размеру"""
+        key = (width, height)
+        if key not in self._images:
+            image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+            draw = ImageDraw.Draw(image)
+            draw.rectangle([width // 4, height // 4, width * 3 // 4, height * 3 // 4], outline=(255, 64, 64), width=8)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            self._images[key] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return self._images[key]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/key/api/v1/pipelines":
+                    server.stats["pipelines"] += 1
+                    return self._json(200, [{
+                        "id": FAKE_PIPELINE_ID,
+                        "name": "Kandinsky",
+                        "version": 3.1,
+                        "type": "TEXT2IMAGE",
+                        "status": "ACTIVE",
+                    }])
+                if self.path.startswith("/key/api/v1/pipeline/status/"):
+                    data = server.status(self.path.rsplit("/", 1)[-1])
+                    if data is None:
+                        return self._json(404, {"error": "Task not found"})
+                    return self._json(200, data)
+                if self.path.rstrip("/") == "/static/styles/key":
+                    server.stats["styles"] += 1
+                    return self._json(200, FAKE_STYLES)
+                return self._json(404, {"error": "Not found"})
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/key/api/v1/pipeline/run":
+                    return self._json(404, {"error": "Not found"})
+
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fields = self._parse_multipart(body)
+                if fields.get("pipeline_id") != FAKE_PIPELINE_ID:
+                    return self._json(404, {"error": "Pipeline not found"})
+                if server.random.random() < server.error_rate:
+                    return self._json(503, {"error": "Service temporarily unavailable"})
+
+                try:
+                    params = json.loads(fields.get("params", "{}"))
+                except ValueError:
+                    return self._json(400, {"error": "Invalid params"})
+                return self._json(201, {"uuid": server.submit(params), "status": "INITIAL", "status_time": 0})
+
+            def _parse_multipart(self, body):
+                content_type = self.headers.get("Content-Type", "")
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode() + body
+                )
+                fields = {}
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    if name:
+                        fields[name] = part.get_payload(decode=True).decode("utf-8")
+                return fields
+
+            def _json(self, status_code, data):
+                payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import json
+import secrets
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import GenerationEvent, GenerationStreamToken, MediaGenerationTask
+
+# Поля события, которые читает хаб и отдают SSE-эндпоинты
+EVENT_FIELDS = ("id", "task_id", "task__chat_id", "event", "data", "createdAt")
+
+# После этих событий задача больше не меняется - поток задачи закрывается
+FINAL_EVENTS = (GenerationEvent.Event.DONE, GenerationEvent.Event.FAILED)
+
+
+def publish(task, event, **data):
+    """
+    Записывает событие задачи генерации после коммита текущей транзакции
+    (вне транзакции - сразу). Хаб читает события по возрастанию id: событие,
+    записанное внутри долгой транзакции, получило бы id меньше уже прочитанных
+    и было бы пропущено. События только информируют клиентов,
+    поэтому ошибка записи не должна прерывать генерацию.
+    """
+    publish_many([(task.id, event, data)])
+
+
+def publish_many(events):
+    """Записывает пачку событий [(task_id, event, data), ...] одним INSERT после коммита транзакции"""
+    if not events:
+        return
+    transaction.on_commit(lambda: _write_events(events))
+
+
+def _write_events(events):
+    try:
+        GenerationEvent.objects.bulk_create([
+            GenerationEvent(task_id=task_id, event=event, data=data) for task_id, event, data in events
+        ])
+    except Exception as e:
+        print(f"❌ GENERATION EVENTS ERROR: {str(e)}")
+
+
+def prune_events(retention_seconds=None):
+    """Удаляет события старше GENERATION_EVENTS_RETENTION_SECONDS"""
+    if retention_seconds is None:
+        retention_seconds = getattr(settings, 'GENERATION_EVENTS_RETENTION_SECONDS', 86400)
+    cutoff = timezone.now() - timedelta(seconds=retention_seconds)
+    deleted, _ = GenerationEvent.objects.filter(createdAt__lt=cutoff).delete()
+    return deleted
+
+
+def _token_hash(raw_token):
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+def issue_stream_token(user, key):
+    """
+    Выдает одноразовый токен потока key (task:<id> или chat:<id>) на
+    GENERATION_EVENTS_TOKEN_TTL секунд -> (токен, срок действия в секундах).
+    В БД хранится только SHA-256 токена.
+    """
+    ttl = getattr(settings, 'GENERATION_EVENTS_TOKEN_TTL', 60)
+    now = timezone.now()
+    GenerationStreamToken.objects.filter(expiresAt__lte=now).delete()
+    raw_token = secrets.token_urlsafe(32)
+    GenerationStreamToken.objects.create(
+        key=_token_hash(raw_token), user=user, stream=key, expiresAt=now + timedelta(seconds=ttl)
+    )
+    return raw_token, ttl
+
+
+def consume_stream_token(raw_token, key):
+    """Пользователь действующего токена потока key или None. Токен удаляется при первом использовании"""
+    token = (
+        GenerationStreamToken.objects
+        .filter(key=_token_hash(raw_token), stream=key, expiresAt__gt=timezone.now())
+        .select_related("user")
+        .first()
+    )
+    if token is None:
+        return None
+    # Тот же токен мог одновременно предъявить другой запрос - поток откроет только один
+    deleted, _ = GenerationStreamToken.objects.filter(id=token.id).delete()
+    return token.user if deleted else None
+
+
+def stream_keys(event):
+    keys = [f"task:{event['task_id']}"]
+    if event["task__chat_id"]:
+        keys.append(f"chat:{event['task__chat_id']}")
+    return keys
+
+
+def format_event(event):
+    """Событие → кадр Server-Sent Events (id позволяет продолжить поток через Last-Event-ID)"""
+    payload = {
+        "task_id": str(event["task_id"]),
+        "event": event["event"],
+        "created_at": event["createdAt"].isoformat(),
+        **event["data"],
+    }
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def latest_event_id():
+    return GenerationEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def events_after(last_id, limit=500, **filters):
+    return list(
+        GenerationEvent.objects.filter(id__gt=last_id, **filters).order_by("id").values(*EVENT_FIELDS)[:limit]
+    )
+
+
+def replay_events(key, last_id):
+    """
+    События потока, уже записанные к моменту подключения. Без Last-Event-ID
+    поток задачи начинается с её первого события, поток чата - с событий
+    последней задачи чата.
+    """
+    kind, _, object_id = key.partition(":")
+    if kind == "task":
+        return events_after(last_id, task_id=object_id)
+    if last_id:
+        return events_after(last_id, task__chat_id=object_id)
+    latest = MediaGenerationTask.objects.filter(chat_id=object_id).order_by("-createdAt").values_list("id", flat=True).first()
+    return events_after(0, task_id=latest) if latest else []
+
+
+class GenerationEventHub:
+    """
+    Pub/sub событий генерации внутри ASGI-процесса.
+    Один фоновый цикл раз в GENERATION_EVENTS_POLL_INTERVAL секунд читает
+    новые события одним запросом и раздает их всем подписчикам задачи или чата,
+    поэтому число запросов к БД не зависит от числа ждущих клиентов.
+    Цикл работает, только пока есть подписчики.
+    """
+
+    def __init__(self, interval=None):
+        self._interval = interval
+        self._subscribers = {}
+        self._last_id = None
+        self._runner = None
+        self._started = None
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, 'GENERATION_EVENTS_POLL_INTERVAL', 1.0)
+
+    def subscribers(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def subscribe(self, key):
+        """Подписка на поток task:<id> или chat:<id>; события приходят в возвращенную asyncio.Queue"""
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done() or self._runner.get_loop() is not loop:
+            self._started = asyncio.Event()
+            self._runner = loop.create_task(self._run(self._started))
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(key, set()).add(queue)
+        # Все, что записано до запуска цикла хаба, клиент получит через replay_events
+        await self._started.wait()
+        return queue
+
+    def unsubscribe(self, key, queue):
+        queues = self._subscribers.get(key)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[key]
+
+    def dispatch(self, event):
+        for key in stream_keys(event):
+            for queue in self._subscribers.get(key, ()):
+                queue.put_nowait(event)
+
+    async def poll_once(self):
+        events = await sync_to_async(events_after)(self._last_id)
+        for event in events:
+            self._last_id = event["id"]
+            self.dispatch(event)
+        return len(events)
+
+    async def _run(self, started):
+        try:
+            self._last_id = await sync_to_async(latest_event_id)()
+        finally:
+            started.set()
+        while self._subscribers:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"❌ GENERATION EVENTS ERROR: {str(e)}")
+
+
+# Синглтон на процесс
+event_hub = GenerationEventHub()
+
+
+async def stream_events(key, last_id=0, close_on_final=False, hub=None):
+    """
+    Тело SSE-ответа: сначала уже записанные события потока (replay_events),
+    затем новые из хаба. Поток задачи закрывается после done/failed, любой поток -
+    через GENERATION_EVENTS_STREAM_TIMEOUT секунд (EventSource переподключится
+    с Last-Event-ID). Пока событий нет, раз в GENERATION_EVENTS_KEEPALIVE секунд
+    отправляется комментарий, чтобы прокси не закрыли соединение.
+    """
+    hub = hub or event_hub
+    timeout = getattr(settings, 'GENERATION_EVENTS_STREAM_TIMEOUT', 300)
+    keepalive = getattr(settings, 'GENERATION_EVENTS_KEEPALIVE', 15)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    queue = await hub.subscribe(key)
+    try:
+        yield "retry: 3000\n\n"
+        for event in await sync_to_async(replay_events)(key, last_id):
+            last_id = event["id"]
+            yield format_event(event)
+            if close_on_final and event["event"] in FINAL_EVENTS:
+                return
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            # Событие могло уже попасть в replay
+            if event["id"] <= last_id:
+                continue
+            last_id = event["id"]
+            yield format_event(event)
+            if close_on_final and event["event"] in FINAL_EVENTS:
+                return
+    finally:
+        hub.unsubscribe(key, queue)
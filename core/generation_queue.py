@@ -0,0 +1,675 @@
+import json
+import os
+import time
+import queue
+import socket
+import logging
+from collections import OrderedDict, deque
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import MediaGenerationTask, Message, MessageType, PromptHistory
+from .kandinsky_service import kandinsky_service
+from .kandinsky_poller import KandinskyPoller
+from .detection.photo_checker import photo_checker
+from .generation_events import publish, publish_many
+
+logger = logging.getLogger(__name__)
+
+# Negative prompt для генерации с проверкой качества и без неё
+CHECKED_NEGATIVE_PROMPT = "низкое качество, размытое, watermark, deformed, distorted, bad anatomy, extra fingers, missing fingers"
+UNCHECKED_NEGATIVE_PROMPT = "низкое качество, размытое, watermark"
+
+
+def default_worker_id():
+    """Идентификатор воркера по умолчанию: хост + PID"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def build_task_urls(task, base_url=None):
+    """Ссылки на просмотр и скачивание изображения задачи"""
+    base_url = (base_url or getattr(settings, 'CONTENTUM_PUBLIC_URL', 'http://localhost:8000')).rstrip('/')
+    return {
+        "image_url": f"{base_url}/api/generation-tasks/{task.id}/image-file/",
+        "download_url": f"{base_url}/api/generation-tasks/{task.id}/download/",
+    }
+
+
+def enqueue_generation_task(user, prompt_history, prompt_text, chat=None, width=1024, height=1024,
+                            check_quality=True, max_attempts=3):
+    """
+    Ставит задачу генерации в очередь (статус PENDING).
+    Саму генерацию выполняет воркер (manage.py run_generation_worker),
+    поэтому HTTP-запрос возвращается сразу с ID задачи.
+    """
+    task = MediaGenerationTask.objects.create(
+        user=user,
+        chat=chat,
+        prompt_history=prompt_history,
+        prompt_text=prompt_text,
+        status=MediaGenerationTask.Status.PENDING,
+        width=width,
+        height=height,
+        check_quality=check_quality,
+        max_attempts=max_attempts
+    )
+    print(f"📥 QUEUE DEBUG: Task {task.id} queued ({width}x{height}, check={check_quality})")
+    publish(task, "queued", width=width, height=height)
+    return task
+
+
+def claim_next_task(worker_id=None, task_id=None):
+    """
+    Забирает задачу из очереди (или конкретную, если передан task_id)
+    и переводит её в RUNNING.
+    Очередь честная по пользователям: среди самых старых задач первой берётся
+    задача пользователя, у которого меньше всего задач уже выполняется, так что
+    один пользователь с пачкой генераций не блокирует остальных.
+    SELECT ... FOR UPDATE SKIP LOCKED гарантирует, что несколько воркеров
+    не возьмут одну и ту же задачу и не ждут друг друга.
+    """
+    worker_id = worker_id or default_worker_id()
+    pending = MediaGenerationTask.objects.filter(status=MediaGenerationTask.Status.PENDING)
+    if task_id is not None:
+        pending = pending.filter(id=task_id)
+
+    window = getattr(settings, 'GENERATION_FAIR_CLAIM_WINDOW', 50)
+    candidates = list(pending.order_by("createdAt").values_list("id", "user_id")[:window])
+    if not candidates:
+        return None
+
+    running = dict(
+        MediaGenerationTask.objects
+        .filter(status=MediaGenerationTask.Status.RUNNING, user_id__in={user_id for _, user_id in candidates})
+        .values("user_id")
+        .annotate(count=Count("id"))
+        .values_list("user_id", "count")
+    )
+    candidates = sorted(enumerate(candidates), key=lambda item: (running.get(item[1][1], 0), item[0]))
+
+    for _, (candidate_id, _) in candidates:
+        with transaction.atomic():
+            task = (
+                MediaGenerationTask.objects
+                .filter(id=candidate_id, status=MediaGenerationTask.Status.PENDING)
+                .select_for_update(skip_locked=True)
+                .first()
+            )
+            if task is None:
+                # Задачу уже забрал другой воркер
+                continue
+
+            task.status = MediaGenerationTask.Status.RUNNING
+            task.worker_id = worker_id
+            task.startedAt = timezone.now()
+            task.save(update_fields=["status", "worker_id", "startedAt", "updatedAt"])
+            return task
+
+    return None
+
+
+def requeue_stale_tasks(stale_seconds=None):
+    """
+    Возвращает в очередь задачи, зависшие в RUNNING (например, воркер упал).
+    Живой воркер регулярно обновляет updatedAt своих задач (heartbeat),
+    поэтому зависшими считаются задачи без обновлений дольше stale_seconds.
+    Уже сделанные попытки и kandinsky_uuid сохраняются - новый воркер
+    продолжит опрос уже запущенной генерации.
+    """
+    if stale_seconds is None:
+        stale_seconds = getattr(settings, 'GENERATION_TASK_STALE_SECONDS', 300)
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+
+    count = MediaGenerationTask.objects.filter(
+        status=MediaGenerationTask.Status.RUNNING,
+        updatedAt__lt=cutoff
+    ).update(
+        status=MediaGenerationTask.Status.PENDING,
+        worker_id="",
+        updatedAt=timezone.now()
+    )
+    if count:
+        logger.warning(f"Requeued {count} stale generation tasks")
+    return count
+
+
+def negative_prompt_for(task):
+    return CHECKED_NEGATIVE_PROMPT if task.check_quality else UNCHECKED_NEGATIVE_PROMPT
+
+
+def begin_attempt(task):
+    """Учитывает новую попытку генерации задачи"""
+    task.attempts += 1
+    task.generations += 1
+    task.kandinsky_uuid = ""
+    task.kandinsky_status = ""
+    task.save(update_fields=["attempts", "generations", "kandinsky_uuid", "kandinsky_status", "updatedAt"])
+    print(f"🎨 QUEUE DEBUG: Task {task.id} attempt {task.attempts}/{task.max_attempts}")
+    publish(task, "submitted", attempt=task.attempts, max_attempts=task.max_attempts)
+
+
+def generations_today(user_id):
+    """Сколько генераций Kandinsky запущено для задач пользователя за последние сутки"""
+    since = timezone.now() - timedelta(days=1)
+    used = MediaGenerationTask.objects.filter(user_id=user_id, createdAt__gte=since).aggregate(
+        total=Sum("generations")
+    )["total"]
+    return used or 0
+
+
+def speculative_candidates(task):
+    """
+    Сколько кандидатов запускать параллельно в следующей попытке задачи.
+    Лишние кандидаты - это лишние генерации, поэтому они запускаются только
+    с проверкой качества и только пока пользователь не исчерпал дневной
+    лимит GENERATION_USER_DAILY_GENERATIONS. Основной кандидат запускается всегда.
+    """
+    count = getattr(settings, 'GENERATION_SPECULATIVE_CANDIDATES', 1)
+    if count <= 1 or not task.check_quality:
+        return 1
+    limit = getattr(settings, 'GENERATION_USER_DAILY_GENERATIONS', 100)
+    remaining = limit - generations_today(task.user_id)
+    return 1 + max(0, min(count - 1, remaining))
+
+
+def passing_image(task, generation_result):
+    """Изображение кандидата, если генерация удалась и прошла проверку качества, иначе None"""
+    if not generation_result.get("success"):
+        return None
+    images_data = generation_result.get("images_data") or []
+    if not images_data:
+        return None
+    if task.check_quality:
+        publish(task, "checking", attempt=task.attempts)
+        if not photo_checker.check_photo(images_data[0])["passed"]:
+            return None
+    return images_data[0]
+
+
+def switch_prompt(task, prompt_text):
+    """Переключает задачу на новый промпт и записывает его в историю промптов"""
+    task.prompt_history = PromptHistory.objects.create(
+        user=task.user,
+        prompt_template=task.prompt_history.prompt_template,
+        parameters=task.prompt_history.parameters,
+        assembled_prompt=prompt_text
+    )
+    task.prompt_text = prompt_text
+
+
+def handle_attempt_result(task, generation_result):
+    """
+    Обрабатывает результат одной попытки генерации: проверяет качество
+    и при необходимости готовит исправленный промпт для следующей попытки.
+    Возвращает задачу, если она завершена (SUCCESS/FAILED), иначе None -
+    значит нужна ещё одна попытка.
+    """
+    if not generation_result["success"]:
+        task.last_error = generation_result.get("error", "Неизвестная ошибка")
+        task.save(update_fields=["last_error", "updatedAt"])
+        return _retry_or_fail(task)
+
+    images_data = generation_result.get("images_data", [])
+    if not images_data:
+        task.last_error = "Нет данных изображения"
+        task.save(update_fields=["last_error", "updatedAt"])
+        return _retry_or_fail(task)
+
+    image_base64 = images_data[0]
+
+    if not task.check_quality:
+        return complete_task(task, image_base64)
+
+    publish(task, "checking", attempt=task.attempts)
+    check_result = photo_checker.check_photo(image_base64)
+    if check_result["passed"]:
+        return complete_task(task, image_base64)
+
+    # Фото не прошло проверку - исправляем промпт и пробуем снова
+    reason = check_result.get('reason', 'проверка не пройдена')
+    fix_prompt, problems_text = photo_checker.generate_fix_prompt(task.prompt_text, check_result)
+
+    task.problems = list(task.problems or []) + [f"попытка {task.attempts}: {problems_text}"]
+    task.last_error = f"Проверка не пройдена: {reason}"
+    switch_prompt(task, fix_prompt)
+    task.save(update_fields=["problems", "last_error", "prompt_history", "prompt_text", "updatedAt"])
+    return _retry_or_fail(task)
+
+
+def _retry_or_fail(task):
+    if task.attempts < task.max_attempts:
+        # Результат этой генерации обработан - после перезапуска её не нужно опрашивать снова
+        task.kandinsky_uuid = ""
+        task.save(update_fields=["kandinsky_uuid", "updatedAt"])
+        publish(task, "regenerating", attempt=task.attempts, reason=task.last_error or "")
+        return None
+    return fail_task(task, task.last_error or "Превышено количество попыток перегенерации")
+
+
+def run_generation_task(task):
+    """
+    Выполняет задачу генерации синхронно: генерирует изображение, проверяет
+    качество и при необходимости перегенерирует с исправленным промптом.
+    Все попытки учитываются в одной задаче.
+    Воркер использует неблокирующий вариант - GenerationWorker.
+    """
+    while True:
+        if task.kandinsky_uuid:
+            # Генерация уже запущена (задачу отложили или перезапустили) - опрашиваем её,
+            # а не запускаем новую
+            print(f"🔄 QUEUE DEBUG: Task {task.id} resumes polling {task.kandinsky_uuid}")
+        else:
+            if task.attempts >= task.max_attempts:
+                return fail_task(task, task.last_error or "Превышено количество попыток перегенерации")
+
+            submitted = kandinsky_service.submit_generation(
+                prompt=task.prompt_text,
+                width=task.width,
+                height=task.height,
+                style="DEFAULT",
+                negative_prompt=negative_prompt_for(task)
+            )
+            if submitted.get("circuit_open"):
+                # Запрос не дошел до Kandinsky - попытка не считается
+                return defer_task(task, submitted["error"])
+
+            begin_attempt(task)
+            if not submitted["success"]:
+                finished = handle_attempt_result(task, submitted)
+                if finished is not None:
+                    return finished
+                continue
+
+            task.kandinsky_uuid = submitted["uuid"]
+            task.save(update_fields=["kandinsky_uuid", "updatedAt"])
+
+        generation_result = kandinsky_service.wait_for_generation(task.kandinsky_uuid, task.width, task.height)
+        if generation_result.get("circuit_open"):
+            # Генерация уже идет на стороне Kandinsky: попытка засчитана, uuid
+            # сохраняется, и после возобновления задача продолжит её опрос
+            return defer_task(task, generation_result["error"])
+
+        finished = handle_attempt_result(task, generation_result)
+        if finished is not None:
+            return finished
+
+
+def complete_task(task, image_base64):
+    """Сохраняет результат задачи и уведомляет чат"""
+    task.status = MediaGenerationTask.Status.SUCCESS
+    task.set_image(image_base64)
+    task.finishedAt = timezone.now()
+    task.save(update_fields=[
+        "status", "image_key", "image_size", "image_sha256", "image_mime", "finishedAt", "updatedAt"
+    ])
+    print(f"✅ QUEUE DEBUG: Task {task.id} completed in {task.attempts} attempt(s)")
+    publish(task, "done", attempts=task.attempts, **build_task_urls(task))
+
+    if task.chat_id:
+        post_chat_result_messages(task)
+    return task
+
+
+def fail_task(task, error):
+    """Помечает задачу как FAILED и уведомляет чат"""
+    task.status = MediaGenerationTask.Status.FAILED
+    task.last_error = error
+    task.finishedAt = timezone.now()
+    task.save(update_fields=["status", "last_error", "finishedAt", "updatedAt"])
+    print(f"❌ QUEUE DEBUG: Task {task.id} failed: {error}")
+    publish(task, "failed", error=error)
+
+    if task.chat_id:
+        Message.objects.create(
+            chat_id=task.chat_id,
+            content=json.dumps({
+                "type": "text",
+                "info": f"❌ Не удалось сгенерировать изображение: {error}"
+            }, ensure_ascii=False),
+            messageType=MessageType.SYSTEM
+        )
+    return task
+
+
+def defer_task(task, error):
+    """
+    Откладывает задачу, пока Kandinsky API недоступен (circuit breaker разомкнут).
+    Сделанные попытки и kandinsky_uuid уже запущенной генерации сохраняются:
+    задачу вернет в очередь resume_deferred_tasks, и воркер продолжит опрос.
+    """
+    task.status = MediaGenerationTask.Status.DEFERRED
+    task.worker_id = ""
+    task.last_error = error
+    task.save(update_fields=["status", "worker_id", "last_error", "updatedAt"])
+    print(f"⏸️ QUEUE DEBUG: Task {task.id} deferred: {error}")
+    publish(task, "deferred", error=error)
+    return task
+
+
+def resume_deferred_tasks():
+    """
+    Возвращает отложенные задачи в очередь, когда Kandinsky API снова доступен.
+    В состоянии HALF_OPEN сначала выполняется пробный запрос.
+    """
+    deferred = MediaGenerationTask.objects.filter(status=MediaGenerationTask.Status.DEFERRED)
+    if not deferred.exists():
+        return 0
+
+    breaker = kandinsky_service.breaker
+    state = breaker.state
+    if state == breaker.OPEN:
+        return 0
+    if state == breaker.HALF_OPEN and not kandinsky_service.probe():
+        return 0
+
+    task_ids = list(deferred.values_list("id", flat=True))
+    count = MediaGenerationTask.objects.filter(
+        id__in=task_ids, status=MediaGenerationTask.Status.DEFERRED
+    ).update(status=MediaGenerationTask.Status.PENDING, updatedAt=timezone.now())
+    if count:
+        print(f"▶️ QUEUE DEBUG: Kandinsky API available, resumed {count} deferred task(s)")
+        publish_many([(task_id, "queued", {"resumed": True}) for task_id in task_ids])
+    return count
+
+
+def post_chat_result_messages(task):
+    """Создает в чате сообщение со ссылками и IMAGE сообщение с готовым изображением"""
+    urls = build_task_urls(task)
+    regeneration_attempts = max(0, task.attempts - 1)
+
+    attempts_info = ""
+    if regeneration_attempts > 0:
+        attempts_info = f" (перегенераций: {regeneration_attempts})"
+
+    preview_msg = f"✅ Генерация завершена{attempts_info}!\n\n"
+    preview_msg += f"📥 Скачайте фото по ссылке:\n{urls['download_url']}\n\n"
+    preview_msg += f"👀 Или просмотрите:\n{urls['image_url']}"
+
+    Message.objects.create(
+        chat_id=task.chat_id,
+        content=json.dumps({
+            "type": "text",
+            "info": preview_msg
+        }, ensure_ascii=False),
+        messageType=MessageType.SYSTEM
+    )
+
+    Message.objects.create(
+        chat_id=task.chat_id,
+        content=json.dumps({
+            "type": "image",
+            "info": {
+                "task_id": str(task.id),
+                "prompt": task.prompt_text,
+                "image_url": urls["image_url"],
+                "download_url": urls["download_url"],
+                "regeneration_attempts": regeneration_attempts,
+                "total_attempts": task.attempts
+            }
+        }, ensure_ascii=False),
+        messageType=MessageType.SYSTEM
+    )
+
+
+def process_next_task(worker_id=None):
+    """Забирает и синхронно выполняет одну задачу. Возвращает задачу или None, если очередь пуста"""
+    task = claim_next_task(worker_id)
+    if task is None:
+        return None
+
+    try:
+        return run_generation_task(task)
+    except Exception as e:
+        logger.exception(f"Generation task {task.id} crashed")
+        return fail_task(task, f"Внутренняя ошибка воркера: {str(e)}")
+
+
+class GenerationWorker:
+    """
+    Воркер, держащий одновременно несколько задач в работе.
+    Задачи отправляются в Kandinsky без ожидания, статусы всех генераций
+    опрашивает один KandinskyPoller, а завершённые генерации возвращаются
+    в основной поток воркера через очередь - проверка качества и запись
+    результата выполняются здесь, а не в потоке поллера.
+    Попытки, ожидающие отправки, стоят в очереди по пользователям и
+    отправляются по кругу, пока kandinsky_limiter выдаёт токены.
+    С GENERATION_SPECULATIVE_CANDIDATES > 1 попытка запускает сразу несколько
+    кандидатов с вариантами промпта: каждый проверяется по мере готовности,
+    первый прошедший проверку завершает задачу, остальные отбрасываются.
+    """
+
+    # Пауза перед следующей отправкой, если упёрлись в лимит запросов (секунды)
+    RATE_LIMIT_BACKOFF = 1.0
+
+    def __init__(self, worker_id=None, concurrency=None, poller=None):
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency or getattr(settings, 'GENERATION_WORKER_CONCURRENCY', 4)
+        self.poller = poller or KandinskyPoller()
+        self.active = {}
+        self.ready = OrderedDict()
+        # Параллельные кандидаты текущей попытки: task_id -> {kandinsky_uuid: prompt_text}
+        self.candidates = {}
+        self._results = queue.Queue()
+        self._finished = []
+        self._dispatch_after = 0.0
+        self._last_heartbeat = 0.0
+
+    def start(self):
+        self.poller.start()
+
+    def stop(self):
+        self.poller.stop()
+
+    def _on_generation_finished(self, kandinsky_uuid, result, task_id):
+        # Вызывается из потока поллера - только передаём результат
+        self._results.put((task_id, kandinsky_uuid, result))
+
+    def _done(self, task):
+        self.active.pop(task.id, None)
+        self._discard_candidates(task)
+        self._finished.append(task)
+
+    def _discard_candidates(self, task):
+        """Перестаёт опрашивать оставшихся кандидатов задачи (Kandinsky не умеет отменять генерацию)"""
+        for kandinsky_uuid in self.candidates.pop(task.id, {}):
+            self.poller.untrack(kandinsky_uuid)
+
+    def _guard(self, task, action):
+        try:
+            action()
+        except Exception as e:
+            logger.exception(f"Generation task {task.id} crashed")
+            self._done(fail_task(task, f"Внутренняя ошибка воркера: {str(e)}"))
+
+    def start_attempt(self, task, resume=False):
+        """
+        Ставит новую попытку в очередь отправки. С resume=True продолжает опрос
+        генерации, запущенной до перезапуска воркера (если она была отправлена).
+        """
+        self.active[task.id] = task
+        if resume and task.kandinsky_uuid:
+            print(f"🔄 QUEUE DEBUG: Task {task.id} resumes polling {task.kandinsky_uuid}")
+            self.poller.track(
+                task.kandinsky_uuid, task.id, self._on_generation_finished,
+                width=task.width, height=task.height, resumed=True
+            )
+            return
+
+        if task.attempts >= task.max_attempts:
+            self._done(fail_task(task, task.last_error or "Превышено количество попыток перегенерации"))
+            return
+
+        self.ready.setdefault(task.user_id, deque()).append(task)
+
+    def _handle_candidate(self, task, kandinsky_uuid, result):
+        """
+        Результат одного из кандидатов попытки. Прошедший проверку кандидат
+        завершает задачу; непрошедший отбрасывается, пока другие кандидаты ещё
+        генерируются, а последний обрабатывается как обычная попытка
+        (исправленный промпт и повтор).
+        """
+        candidates = self.candidates.get(task.id)
+        if not candidates or kandinsky_uuid not in candidates:
+            return self._handle_result(task, result)
+
+        prompt_text = candidates.pop(kandinsky_uuid)
+        image_base64 = passing_image(task, result)
+        if image_base64 is not None:
+            print(f"🏁 QUEUE DEBUG: Task {task.id} candidate {kandinsky_uuid} passed, {len(candidates)} discarded")
+            if prompt_text != task.prompt_text:
+                switch_prompt(task, prompt_text)
+                task.save(update_fields=["prompt_history", "prompt_text", "updatedAt"])
+            self._done(complete_task(task, image_base64))
+            return
+
+        if candidates:
+            print(f"🎲 QUEUE DEBUG: Task {task.id} candidate {kandinsky_uuid} rejected, {len(candidates)} still running")
+            return
+
+        del self.candidates[task.id]
+        self._handle_result(task, result)
+
+    def _handle_result(self, task, result):
+        finished = handle_attempt_result(task, result)
+        if finished is not None:
+            self._done(finished)
+        else:
+            self.start_attempt(task)
+
+    def _submit(self, task):
+        """Отправляет попытку в Kandinsky. Возвращает False, если упёрлись в лимит запросов"""
+        submitted = kandinsky_service.submit_generation(
+            prompt=task.prompt_text,
+            width=task.width,
+            height=task.height,
+            style="DEFAULT",
+            negative_prompt=negative_prompt_for(task),
+            wait=0
+        )
+        if submitted.get("rate_limited"):
+            return False
+        if submitted.get("circuit_open"):
+            self._done(defer_task(task, submitted["error"]))
+            return True
+
+        begin_attempt(task)
+        if not submitted["success"]:
+            self._handle_result(task, submitted)
+            return True
+
+        task.kandinsky_uuid = submitted["uuid"]
+        task.save(update_fields=["kandinsky_uuid", "updatedAt"])
+        self.poller.track(
+            task.kandinsky_uuid, task.id, self._on_generation_finished,
+            width=task.width, height=task.height
+        )
+        self._speculate(task)
+        return True
+
+    def _speculate(self, task):
+        """
+        Запускает дополнительных кандидатов попытки с вариантами промпта.
+        Кандидаты - best effort: при лимите запросов или ошибке API их просто меньше.
+        Дополнительные кандидаты не переживают перезапуск воркера - после него
+        опрашивается только основной (task.kandinsky_uuid).
+        """
+        count = speculative_candidates(task)
+        if count <= 1:
+            return
+
+        candidates = {task.kandinsky_uuid: task.prompt_text}
+        for prompt_text in photo_checker.prompt_variants(task.prompt_text, count)[1:]:
+            submitted = kandinsky_service.submit_generation(
+                prompt=prompt_text,
+                width=task.width,
+                height=task.height,
+                style="DEFAULT",
+                negative_prompt=negative_prompt_for(task),
+                wait=0
+            )
+            if not submitted["success"]:
+                break
+            candidates[submitted["uuid"]] = prompt_text
+            self.poller.track(
+                submitted["uuid"], task.id, self._on_generation_finished,
+                width=task.width, height=task.height
+            )
+
+        if len(candidates) > 1:
+            self.candidates[task.id] = candidates
+            task.generations += len(candidates) - 1
+            task.save(update_fields=["generations", "updatedAt"])
+            print(f"🎲 QUEUE DEBUG: Task {task.id} attempt {task.attempts} runs {len(candidates)} candidates")
+
+    def dispatch(self):
+        """
+        Отправляет ожидающие попытки по кругу между пользователями:
+        по одной задаче от каждого, чтобы один пользователь с большим
+        числом генераций не занимал весь лимит запросов.
+        """
+        while self.ready and time.monotonic() >= self._dispatch_after:
+            user_id, tasks = next(iter(self.ready.items()))
+            task = tasks.popleft()
+            if tasks:
+                self.ready.move_to_end(user_id)
+            else:
+                del self.ready[user_id]
+
+            sent = True
+
+            def submit():
+                nonlocal sent
+                sent = self._submit(task)
+
+            self._guard(task, submit)
+            if not sent:
+                # Возвращаем задачу в начало очереди её пользователя
+                self.ready.setdefault(user_id, deque()).appendleft(task)
+                self.ready.move_to_end(user_id, last=False)
+                self._dispatch_after = time.monotonic() + self.RATE_LIMIT_BACKOFF
+                waiting = sum(len(tasks) for tasks in self.ready.values())
+                print(f"⏳ QUEUE DEBUG: Kandinsky rate limit reached, {waiting} task(s) waiting")
+                break
+
+    def heartbeat(self):
+        """Обновляет updatedAt задач в работе, чтобы их не сочли зависшими"""
+        interval = getattr(settings, 'GENERATION_WORKER_HEARTBEAT_SECONDS', 30)
+        if not self.active or time.monotonic() - self._last_heartbeat < interval:
+            return
+        MediaGenerationTask.objects.filter(id__in=list(self.active)).update(updatedAt=timezone.now())
+        self._last_heartbeat = time.monotonic()
+
+    def run_once(self, wait=0):
+        """
+        Обрабатывает завершённые генерации, добирает новые задачи до лимита
+        concurrency и отправляет ожидающие попытки.
+        Возвращает список задач, завершённых за этот шаг.
+        """
+        self._finished = []
+
+        try:
+            results = [self._results.get(timeout=wait)] if wait else []
+        except queue.Empty:
+            results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+
+        for task_id, kandinsky_uuid, result in results:
+            task = self.active.get(task_id)
+            if task is not None:
+                self._guard(task, lambda: self._handle_candidate(task, kandinsky_uuid, result))
+
+        while len(self.active) < self.concurrency:
+            task = claim_next_task(self.worker_id)
+            if task is None:
+                break
+            self._guard(task, lambda: self.start_attempt(task, resume=True))
+
+        self.dispatch()
+        self.heartbeat()
+        return self._finished
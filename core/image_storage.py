@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import logging
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+logger = logging.getLogger(__name__)
+
+# Сигнатуры форматов: (префикс файла, MIME, расширение)
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF87a", "image/gif", "gif"),
+    (b"GIF89a", "image/gif", "gif"),
+]
+
+MIME_EXTENSIONS = {mime: ext for _, mime, ext in IMAGE_SIGNATURES}
+MIME_EXTENSIONS["image/webp"] = "webp"
+
+
+def get_image_storage():
+    """Хранилище изображений - любой backend из STORAGES (по умолчанию MEDIA_ROOT)"""
+    return storages[getattr(settings, 'GENERATED_IMAGES_STORAGE', 'default')]
+
+
+def decode_image_payload(image_base64):
+    """Base64 от Kandinsky (возможно, с префиксом data:...;base64,) -> байты"""
+    if 'base64,' in image_base64:
+        image_base64 = image_base64.split('base64,', 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def detect_mime(data):
+    for signature, mime, _ in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def image_extension(mime):
+    return MIME_EXTENSIONS.get(mime, "bin")
+
+
+def store_image(data):
+    """
+    Сохраняет байты изображения в content-addressed хранилище: ключ файла -
+    SHA-256 содержимого, поэтому одинаковые изображения хранятся один раз,
+    а повторная запись того же файла ничего не делает.
+    Возвращает поля для MediaGenerationTask: image_key, image_size, image_sha256, image_mime.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    mime = detect_mime(data)
+    prefix = getattr(settings, 'GENERATED_IMAGES_PREFIX', 'generated')
+    key = f"{prefix}/{sha256[:2]}/{sha256}.{image_extension(mime)}"
+
+    storage = get_image_storage()
+    if not storage.exists(key):
+        saved_key = storage.save(key, ContentFile(data))
+        if saved_key != key:
+            # Тот же файл параллельно записал другой процесс - копия не нужна
+            storage.delete(saved_key)
+
+    return {
+        "image_key": key,
+        "image_size": len(data),
+        "image_sha256": sha256,
+        "image_mime": mime,
+    }
+
+
+def open_image(key):
+    """Открывает сохранённое изображение как файл для потоковой отдачи"""
+    return get_image_storage().open(key, "rb")
+
+
+def read_image(key):
+    with open_image(key) as image_file:
+        return image_file.read()
@@ -0,0 +1,109 @@
+import random
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from .models import KandinskyLatencyProfile
+
+logger = logging.getLogger(__name__)
+
+
+def resolution_key(width, height):
+    """Ключ профиля - разрешение из calculate_dimensions, например 1024x1024"""
+    return f"{width}x{height}"
+
+
+class PollSchedule:
+    """
+    Расписание опроса одной генерации: первая проверка - через ожидаемое
+    время генерации, дальше экспоненциальная пауза со случайным разбросом,
+    чтобы одновременно запущенные генерации не опрашивались синхронно.
+    """
+
+    def __init__(self, initial_delay, backoff_base, backoff_factor, max_delay, jitter):
+        self.initial_delay = initial_delay
+        self.backoff_base = backoff_base
+        self.backoff_factor = backoff_factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.polls = 0
+
+    def next_delay(self):
+        if self.polls == 0:
+            delay = self.initial_delay
+        else:
+            delay = min(self.max_delay, self.backoff_base * self.backoff_factor ** (self.polls - 1))
+        self.polls += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class LatencyTracker:
+    """
+    Скользящее окно длительностей генерации по разрешениям.
+    Начальная задержка опроса - перцентиль окна: при медиане примерно половина
+    генераций готова к первой же проверке. Окна хранятся в KandinskyLatencyProfile
+    и переживают перезапуск воркера.
+    """
+
+    def __init__(self, window=None, min_samples=None, percentile=None):
+        self.window = window or getattr(settings, 'KANDINSKY_LATENCY_WINDOW', 50)
+        self.min_samples = min_samples or getattr(settings, 'KANDINSKY_LATENCY_MIN_SAMPLES', 5)
+        self.percentile = percentile or getattr(settings, 'KANDINSKY_LATENCY_PERCENTILE', 50)
+        self._samples = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _window_for(self, key):
+        samples = self._samples.get(key)
+        if samples is None:
+            stored = []
+            try:
+                profile = KandinskyLatencyProfile.objects.filter(resolution=key).first()
+                if profile:
+                    stored = profile.samples
+            except Exception as e:
+                logger.error(f"Latency profile load error: {str(e)}")
+            samples = deque(stored, maxlen=self.window)
+            self._samples[key] = samples
+        return samples
+
+    def record(self, width, height, seconds):
+        """Добавляет замер длительности генерации"""
+        key = resolution_key(width, height)
+        with self._lock:
+            self._window_for(key).append(round(seconds, 2))
+            self._dirty.add(key)
+
+    def initial_delay(self, width, height):
+        """Ожидаемое время генерации для разрешения (перцентиль окна)"""
+        key = resolution_key(width, height)
+        with self._lock:
+            samples = sorted(self._window_for(key))
+        if len(samples) < self.min_samples:
+            return getattr(settings, 'KANDINSKY_POLL_INITIAL_DELAY', 10)
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index]
+
+    def schedule(self, width, height):
+        return PollSchedule(
+            initial_delay=self.initial_delay(width, height),
+            backoff_base=getattr(settings, 'KANDINSKY_POLL_BACKOFF_BASE', 2),
+            backoff_factor=getattr(settings, 'KANDINSKY_POLL_BACKOFF_FACTOR', 1.5),
+            max_delay=getattr(settings, 'KANDINSKY_POLL_MAX_DELAY', 15),
+            jitter=getattr(settings, 'KANDINSKY_POLL_JITTER', 0.2)
+        )
+
+    def flush(self):
+        """Сохраняет изменившиеся окна в БД"""
+        with self._lock:
+            dirty = {key: list(self._samples[key]) for key in self._dirty}
+            self._dirty.clear()
+        for key, samples in dirty.items():
+            try:
+                KandinskyLatencyProfile.objects.update_or_create(resolution=key, defaults={"samples": samples})
+            except Exception as e:
+                logger.error(f"Latency profile save error: {str(e)}")
+
+
+# Синглтон на процесс
+latency_tracker = LatencyTracker()
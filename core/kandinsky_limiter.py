@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import KandinskyRateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket в памяти процесса: rate токенов в секунду, не больше capacity.
+    Один запуск генерации (pipeline/run) расходует один токен.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Забирает токен; если токена нет - возвращает время до его появления (сек)"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class DatabaseTokenBucket:
+    """
+    Тот же token bucket, но состояние хранится в KandinskyRateLimitBucket,
+    поэтому лимит общий для всех воркеров и веб-процессов.
+    Строка блокируется SELECT ... FOR UPDATE на время пополнения и списания.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+    def try_acquire(self):
+        with transaction.atomic():
+            bucket, _ = KandinskyRateLimitBucket.objects.select_for_update().get_or_create(
+                name=self.name,
+                defaults={"tokens": float(self.capacity)}
+            )
+            now = timezone.now()
+            elapsed = max(0.0, (now - bucket.updatedAt).total_seconds())
+            tokens = min(self.capacity, bucket.tokens + elapsed * self.rate)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            bucket.tokens = tokens
+            bucket.updatedAt = now
+            bucket.save(update_fields=["tokens", "updatedAt"])
+        return wait
+
+
+class KandinskyRateLimiter:
+    """
+    Ограничение частоты запусков генерации, чтобы держаться чуть ниже квоты
+    FusionBrain, а не упираться в неё ошибками и повторами.
+    С KANDINSKY_RATE_LIMIT_SHARED лимит считается через БД для всех процессов.
+    """
+
+    def __init__(self, per_minute=None, burst=None, shared=None):
+        per_minute = per_minute or getattr(settings, 'KANDINSKY_RATE_LIMIT_PER_MINUTE', 20)
+        burst = burst or getattr(settings, 'KANDINSKY_RATE_LIMIT_BURST', 5)
+        if shared is None:
+            shared = getattr(settings, 'KANDINSKY_RATE_LIMIT_SHARED', False)
+
+        if shared:
+            self.bucket = DatabaseTokenBucket("pipeline_run", per_minute / 60.0, burst)
+        else:
+            self.bucket = TokenBucket(per_minute / 60.0, burst)
+
+    def try_acquire(self):
+        """Неблокирующая попытка: 0 - токен получен, иначе сколько секунд ждать"""
+        try:
+            return self.bucket.try_acquire()
+        except Exception as e:
+            # Ошибка БД не должна останавливать генерацию
+            logger.error(f"Rate limiter error: {str(e)}")
+            return 0.0
+
+    def acquire(self, timeout):
+        """Ждёт токен не дольше timeout секунд. Возвращает True, если токен получен"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(wait, remaining))
+
+
+# Синглтон на процесс
+kandinsky_limiter = KandinskyRateLimiter()
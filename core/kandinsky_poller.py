@@ -0,0 +1,214 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+from .models import MediaGenerationTask
+from .kandinsky_service import kandinsky_service
+from .kandinsky_latency import latency_tracker
+from .generation_events import publish_many
+
+logger = logging.getLogger(__name__)
+
+
+class _PollEntry:
+    """Отслеживаемая генерация Kandinsky"""
+
+    def __init__(self, kandinsky_uuid, task_id, callback, timeout, schedule=None, resolution=None):
+        self.kandinsky_uuid = kandinsky_uuid
+        self.task_id = task_id
+        self.callback = callback
+        self.schedule = schedule
+        self.resolution = resolution
+        self.submitted_at = time.monotonic()
+        self.last_poll_at = self.submitted_at
+        self.next_poll_at = self.submitted_at + (schedule.next_delay() if schedule else 0)
+        self.deadline = self.submitted_at + timeout
+        self.polls = 0
+        self.last_status = None
+
+
+class KandinskyPoller:
+    """
+    Опрашивает статусы всех генераций Kandinsky в одном фоновом потоке.
+    Вместо отдельного блокирующего цикла time.sleep() на каждую задачу
+    поллер за один проход проверяет все генерации, у которых подошло время,
+    с ограниченным числом параллельных HTTP-запросов, одним UPDATE пишет
+    изменившиеся статусы в MediaGenerationTask и вызывает callback
+    по завершении генерации.
+    Время проверок каждой генерации задаёт адаптивное расписание из
+    LatencyTracker; interval включает фиксированный интервал опроса.
+    """
+
+    # Пауза потока, когда отслеживаемых генераций нет (track() будит его сразу)
+    IDLE_WAIT = 5
+
+    def __init__(self, service=None, max_concurrency=None, interval=None, timeout=None, tracker=None):
+        self.service = service or kandinsky_service
+        self.max_concurrency = max_concurrency or getattr(settings, 'KANDINSKY_POLLER_CONCURRENCY', 8)
+        self.interval = interval
+        self.tracker = tracker or latency_tracker
+        self.timeout = timeout if timeout is not None else getattr(settings, 'KANDINSKY_POLL_TIMEOUT', 280)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def track(self, kandinsky_uuid, task_id=None, callback=None, width=None, height=None, resumed=False):
+        """
+        Добавляет генерацию в опрос. callback(kandinsky_uuid, result, task_id)
+        вызывается один раз с результатом в формате check_generation_status.
+        Для генерации, отправленной до перезапуска (resumed), первая проверка
+        выполняется сразу, а её длительность не попадает в профиль задержки.
+        """
+        schedule = None
+        resolution = None
+        if self.interval is None and width and height:
+            schedule = self.tracker.schedule(width, height)
+            if resumed:
+                schedule.initial_delay = 0
+            else:
+                resolution = (width, height)
+
+        with self._lock:
+            self._entries[kandinsky_uuid] = _PollEntry(
+                kandinsky_uuid, task_id, callback, self.timeout, schedule, resolution
+            )
+        self._wakeup.set()
+
+    def untrack(self, kandinsky_uuid):
+        with self._lock:
+            self._entries.pop(kandinsky_uuid, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._entries)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="kandinsky-poll")
+        self._thread = threading.Thread(target=self._run, name="kandinsky-poller", daemon=True)
+        self._thread.start()
+        print(f"🔄 POLLER DEBUG: Started (concurrency={self.max_concurrency}, interval={self.interval or 'adaptive'})")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
+        self._executor = None
+        print("🔄 POLLER DEBUG: Stopped")
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.poll_once()
+                except Exception:
+                    logger.exception("Kandinsky poller iteration failed")
+                self._wakeup.wait(self._seconds_until_next_poll())
+                self._wakeup.clear()
+        finally:
+            # Поток держит своё соединение с БД - закрываем его при остановке
+            connection.close()
+
+    def _seconds_until_next_poll(self):
+        with self._lock:
+            if not self._entries:
+                return self.IDLE_WAIT
+            next_poll_at = min(entry.next_poll_at for entry in self._entries.values())
+        return max(0.0, next_poll_at - time.monotonic())
+
+    def poll_once(self):
+        """Один проход: опрашивает все генерации, у которых подошло время проверки"""
+        now = time.monotonic()
+        with self._lock:
+            due = [entry for entry in self._entries.values() if entry.next_poll_at <= now]
+        if not due:
+            return 0
+
+        if self._executor is not None:
+            statuses = list(self._executor.map(self._fetch, due))
+        else:
+            statuses = [self._fetch(entry) for entry in due]
+
+        finished = []
+        status_updates = {}
+        for entry, status_info in zip(due, statuses):
+            entry.polls += 1
+            status = status_info.get("status")
+            if status and status != entry.last_status and entry.task_id is not None:
+                status_updates[entry.task_id] = status
+            entry.last_status = status or entry.last_status
+
+            if status_info["state"] == "done":
+                result = status_info["result"]
+                if result["success"] and entry.resolution:
+                    # Генерация закончилась между двумя проверками - берём середину интервала
+                    finished_at = (entry.last_poll_at + time.monotonic()) / 2
+                    self.tracker.record(*entry.resolution, finished_at - entry.submitted_at)
+                finished.append((entry, result))
+            elif status_info.get("circuit_open"):
+                # API недоступен, но генерация на стороне Kandinsky идёт - ждём без учёта таймаута
+                delay = self.interval or self.IDLE_WAIT
+                entry.deadline += delay
+                entry.next_poll_at = time.monotonic() + delay
+            elif time.monotonic() >= entry.deadline:
+                print(f"🔄 POLLER DEBUG: {entry.kandinsky_uuid} timed out after {entry.polls} polls")
+                finished.append((entry, {
+                    "success": False,
+                    "error": f"Превышено время ожидания генерации ({self.timeout} секунд)"
+                }))
+            elif entry.schedule is not None:
+                entry.last_poll_at = time.monotonic()
+                entry.next_poll_at = time.monotonic() + entry.schedule.next_delay()
+            else:
+                entry.last_poll_at = time.monotonic()
+                entry.next_poll_at = time.monotonic() + (self.interval or self.IDLE_WAIT)
+
+        self._flush_status_updates(status_updates)
+        if finished:
+            self.tracker.flush()
+
+        for entry, result in finished:
+            self.untrack(entry.kandinsky_uuid)
+            if entry.callback is None:
+                continue
+            try:
+                entry.callback(entry.kandinsky_uuid, result, entry.task_id)
+            except Exception:
+                logger.exception(f"Kandinsky poller callback failed for {entry.kandinsky_uuid}")
+
+        return len(due)
+
+    def _fetch(self, entry):
+        try:
+            return self.service.fetch_generation_status(entry.kandinsky_uuid)
+        except Exception as e:
+            return {"state": "error", "status": None, "error": str(e)}
+
+    def _flush_status_updates(self, status_updates):
+        """Записывает изменившиеся статусы Kandinsky всех задач одним UPDATE"""
+        if not status_updates:
+            return
+        MediaGenerationTask.objects.filter(id__in=list(status_updates)).update(
+            kandinsky_status=Case(
+                *[When(id=task_id, then=Value(status)) for task_id, status in status_updates.items()],
+                output_field=CharField()
+            ),
+            updatedAt=timezone.now()
+        )
+        publish_many([
+            (task_id, "kandinsky_status", {"kandinsky_status": status})
+            for task_id, status in status_updates.items()
+        ])
@@ -2,27 +2,284 @@ import requests
 import json
 import time
 import logging
+import threading
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .kandinsky_limiter import kandinsky_limiter
 
 logger = logging.getLogger(__name__)
 
+# Таймауты чтения по эндпоинтам (секунды), переопределяются KANDINSKY_TIMEOUTS
+DEFAULT_TIMEOUTS = {
+    "pipelines": 10,
+    "run": 60,  # Увеличенный таймаут для качественной генерации
+    "status": 10,
+    "styles": 10,
+}
+
+class CachedValue:
+    """
+    Значение в памяти процесса с TTL и stale-while-revalidate:
+    свежее значение отдаётся сразу, устаревшее (не старше ttl + stale_ttl)
+    тоже отдаётся сразу, но обновляется в фоновом потоке. Без значения
+    загрузка выполняется синхронно одним потоком. Неудачная загрузка
+    (loader вернул None) не кешируется.
+    """
+
+    def __init__(self, name, ttl, stale_ttl):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._value = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self, loader):
+        age = time.monotonic() - self._loaded_at
+        value = self._value
+        if value is not None and age < self.ttl:
+            return value
+        if value is not None and age < self.ttl + self.stale_ttl:
+            self._refresh_in_background(loader)
+            return value
+
+        with self._lock:
+            # Пока ждали блокировку, значение мог загрузить другой поток
+            if self._value is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._value
+            return self._load(loader) or value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._loaded_at = 0.0
+
+    def _load(self, loader):
+        value = loader()
+        if value is not None:
+            self._value = value
+            self._loaded_at = time.monotonic()
+            print(f"🎨 KANDINSKY DEBUG: {self.name} cache refreshed")
+        return value
+
+    def _refresh_in_background(self, loader):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                with self._lock:
+                    self._load(loader)
+            except Exception as e:
+                logger.error(f"{self.name} cache refresh error: {str(e)}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name=f"kandinsky-{self.name}-refresh", daemon=True).start()
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: circuit breaker Kandinsky API разомкнут"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для Kandinsky API.
+    CLOSED - запросы идут как обычно; после failure_threshold ошибок подряд
+    (ошибки соединения, таймауты, ответы 5xx) переходит в OPEN и reset_timeout
+    секунд отклоняет запросы сразу, не дожидаясь таймаутов. Затем HALF_OPEN:
+    пропускает до half_open_max_calls пробных запросов - успех замыкает цепь,
+    ошибка снова размыкает.
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            print("🔌 KANDINSKY DEBUG: Circuit breaker half-open, probing API")
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def retry_after(self):
+        """Сколько секунд осталось до пробных запросов"""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self):
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                print("🔌 KANDINSKY DEBUG: Circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._current_state() == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Kandinsky circuit breaker opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
 class KandinskyService:
     def __init__(self):
-        self.base_url = "https://api-key.fusionbrain.ai/"
+        self.base_url = getattr(settings, 'KANDINSKY_BASE_URL', 'https://api-key.fusionbrain.ai/').rstrip('/') + '/'
+        self.styles_url = getattr(settings, 'KANDINSKY_STYLES_URL', 'https://cdn.fusionbrain.ai/static/styles/key')
         self.api_key = getattr(settings, 'KANDINSKY_API_KEY', '')
         self.secret_key = getattr(settings, 'KANDINSKY_SECRET_KEY', '')
         self.auth_headers = {
             'X-Key': f'Key {self.api_key}',
             'X-Secret': f'Secret {self.secret_key}',
         }
+        self.connect_timeout = getattr(settings, 'KANDINSKY_CONNECT_TIMEOUT', 5)
+        self.timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, 'KANDINSKY_TIMEOUTS', {})}
+        self.session = self._build_session()
+        self.limiter = kandinsky_limiter
+        self.breaker = CircuitBreaker(
+            failure_threshold=getattr(settings, 'KANDINSKY_BREAKER_FAILURES', 5),
+            reset_timeout=getattr(settings, 'KANDINSKY_BREAKER_RESET_TIMEOUT', 30),
+            half_open_max_calls=getattr(settings, 'KANDINSKY_BREAKER_HALF_OPEN_CALLS', 1)
+        )
+
+        stale_ttl = getattr(settings, 'KANDINSKY_CACHE_STALE_TTL', 600)
+        self._pipeline_cache = CachedValue(
+            "pipeline", getattr(settings, 'KANDINSKY_PIPELINE_CACHE_TTL', 3600), stale_ttl
+        )
+        self._styles_cache = CachedValue(
+            "styles", getattr(settings, 'KANDINSKY_STYLES_CACHE_TTL', 86400), stale_ttl
+        )
+
+    def _build_session(self):
+        """
+        Общая для всех потоков HTTP-сессия с пулом keep-alive соединений.
+        Повторяет запрос при ошибках соединения и ответах 429/5xx с экспоненциальной
+        паузой; POST /run повторяется только если запрос не дошёл до сервера,
+        чтобы не запустить одну генерацию дважды.
+        """
+        pool_size = getattr(settings, 'KANDINSKY_POOL_SIZE', 10)
+        retry = Retry(
+            total=getattr(settings, 'KANDINSKY_MAX_RETRIES', 3),
+            backoff_factor=getattr(settings, 'KANDINSKY_RETRY_BACKOFF', 0.5),
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _request(self, method, endpoint, url, **kwargs):
+        """
+        Запрос через общую сессию с таймаутом эндпоинта.
+        Запросы к API (кроме CDN стилей) проходят через circuit breaker.
+        """
+        kwargs.setdefault("timeout", (self.connect_timeout, self.timeouts[endpoint]))
+        if endpoint == "styles":
+            return self.session.request(method, url, **kwargs)
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Kandinsky API недоступен, повтор через {self.breaker.retry_after():.0f} сек")
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def probe(self):
+        """
+        Пробный запрос к API (список пайплайнов, в обход кеша), чтобы
+        проверить, восстановился ли сервис. Возвращает True, если цепь замкнута.
+        """
+        try:
+            self._request(
+                "GET",
+                "pipelines",
+                self.base_url + 'key/api/v1/pipelines',
+                headers=self.auth_headers
+            )
+        except Exception as e:
+            print(f"🔌 KANDINSKY DEBUG: Probe failed: {str(e)}")
+        return self.breaker.state == CircuitBreaker.CLOSED
+
+    def connection_stats(self):
+        """
+        Счётчики пулов соединений по хостам: сколько запросов отправлено
+        и сколько TCP/TLS соединений для этого открыто. reused - запросы,
+        обслуженные уже открытым keep-alive соединением.
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "requests": pool.num_requests,
+                    "connections": pool.num_connections,
+                    "reused": max(0, pool.num_requests - pool.num_connections),
+                }
+        return stats
 
     def get_pipeline(self):
-        """Получение доступного пайплайна (модели)"""
+        """Получение доступного пайплайна (модели) из кеша"""
+        return self._pipeline_cache.get(self._load_pipeline)
+
+    def invalidate_pipeline(self):
+        """Сбрасывает закешированный пайплайн - следующий вызов запросит его заново"""
+        self._pipeline_cache.invalidate()
+
+    def _load_pipeline(self):
         try:
-            response = requests.get(
-                self.base_url + 'key/api/v1/pipelines', 
-                headers=self.auth_headers,
-                timeout=10
+            response = self._request(
+                "GET",
+                "pipelines",
+                self.base_url + 'key/api/v1/pipelines',
+                headers=self.auth_headers
             )
             if response.status_code == 200:
                 data = response.json()
@@ -34,23 +291,32 @@ class KandinskyService:
             else:
                 logger.error(f"Pipeline request error: {response.status_code} - {response.text}")
                 return None
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"Pipeline error: {str(e)}")
             return None
     
-    def generate_image(self, prompt, width=1024, height=1024, style=None, negative_prompt=None):
+    def submit_generation(self, prompt, width=1024, height=1024, style=None, negative_prompt=None, wait=None):
         """
-        Генерация изображения через Kandinsky API с улучшенными параметрами качества
+        Отправляет задачу генерации в Kandinsky API без ожидания результата.
+        Возвращает {"success": True, "uuid": ...} или описание ошибки.
+        Запуск проходит через kandinsky_limiter: если токен не получен за wait
+        секунд, запрос не отправляется и возвращается "rate_limited": True.
         """
-        try:
-            # Получаем pipeline_id
-            pipeline_id = self.get_pipeline()
-            if not pipeline_id:
-                return {
-                    "success": False,
-                    "error": "Не удалось получить доступную модель для генерации"
-                }
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return self._circuit_open_result()
 
+        if wait is None:
+            wait = getattr(settings, 'KANDINSKY_RATE_LIMIT_WAIT', 60)
+        if not self.limiter.acquire(wait):
+            return {
+                "success": False,
+                "rate_limited": True,
+                "error": "Превышен лимит запросов к Kandinsky"
+            }
+
+        try:
             print(f"🎨 KANDINSKY DEBUG: Generating {width}x{height} image")
             print(f"🎨 KANDINSKY DEBUG: Prompt: {prompt[:100]}...")
 
@@ -76,28 +342,32 @@ class KandinskyService:
             
             params["negativePromptDecoder"] = enhanced_negative_prompt
 
-            # Подготавливаем данные для multipart/form-data
-            files = {
-                'pipeline_id': (None, pipeline_id),
-                'params': (None, json.dumps(params), 'application/json')
-            }
+            # Пайплайн берется из кеша; если сервер его отклонил - сбрасываем кеш
+            # и один раз повторяем запрос со свежим пайплайном
+            for attempt in range(2):
+                pipeline_id = self.get_pipeline()
+                if not pipeline_id:
+                    return {
+                        "success": False,
+                        "error": "Не удалось получить доступную модель для генерации"
+                    }
 
-            # Отправляем запрос на генерацию
-            response = requests.post(
-                self.base_url + 'key/api/v1/pipeline/run',
-                headers=self.auth_headers,
-                files=files,
-                timeout=60  # Увеличиваем таймаут для качественной генерации
-            )
+                response = self._run_pipeline(pipeline_id, params)
+                if attempt == 0 and self._is_pipeline_rejected(response):
+                    print(f"🎨 KANDINSKY DEBUG: Pipeline {pipeline_id} rejected, refreshing pipeline cache")
+                    self.invalidate_pipeline()
+                    continue
+                break
 
             if response.status_code in [200, 201]:
                 data = response.json()
                 task_id = data.get('uuid')
                 
                 if task_id:
-                    # Ждем завершения генерации
-                    result = self.check_generation_status(task_id, max_attempts=40, delay=7)
-                    return result
+                    return {
+                        "success": True,
+                        "uuid": task_id
+                    }
                 else:
                     return {
                         "success": False,
@@ -110,6 +380,8 @@ class KandinskyService:
                     "error": f"API error: {response.status_code} - {response.text}"
                 }
 
+        except CircuitOpenError:
+            return self._circuit_open_result()
         except Exception as e:
             logger.error(f"Kandinsky service error: {str(e)}")
             return {
@@ -117,6 +389,129 @@ class KandinskyService:
                 "error": str(e)
             }
 
+    def _circuit_open_result(self):
+        return {
+            "success": False,
+            "circuit_open": True,
+            "error": f"Kandinsky API временно недоступен (повтор через {self.breaker.retry_after():.0f} сек)"
+        }
+
+    def _run_pipeline(self, pipeline_id, params):
+        """Отправляет запрос на генерацию в указанный пайплайн"""
+        # Подготавливаем данные для multipart/form-data
+        files = {
+            'pipeline_id': (None, pipeline_id),
+            'params': (None, json.dumps(params), 'application/json')
+        }
+        return self._request(
+            "POST",
+            "run",
+            self.base_url + 'key/api/v1/pipeline/run',
+            headers=self.auth_headers,
+            files=files
+        )
+
+    def _is_pipeline_rejected(self, response):
+        """Сервер не принял pipeline_id: пайплайн удален или отключен"""
+        if response.status_code in (400, 404, 422):
+            return "pipeline" in response.text.lower()
+        if response.status_code in (200, 201):
+            try:
+                data = response.json()
+            except ValueError:
+                return False
+            return not data.get('uuid') and bool(data.get('pipeline_status') or data.get('model_status'))
+        return False
+
+    def generate_image(self, prompt, width=1024, height=1024, style=None, negative_prompt=None):
+        """
+        Генерация изображения через Kandinsky API с улучшенными параметрами качества.
+        Блокирует поток до завершения генерации - для фоновой обработки
+        многих задач используйте submit_generation + KandinskyPoller.
+        """
+        submitted = self.submit_generation(prompt, width, height, style, negative_prompt)
+        if not submitted["success"]:
+            return submitted
+
+        # Ждем завершения генерации по адаптивному расписанию
+        return self.wait_for_generation(submitted["uuid"], width, height)
+
+    def fetch_generation_status(self, task_id):
+        """
+        Один запрос статуса генерации без ожидания.
+        Возвращает {"state": "pending" | "done" | "error", "status": ..., "result": ...},
+        где result заполнен только для состояния "done" (в формате check_generation_status).
+        """
+        try:
+            response = self._request(
+                "GET",
+                "status",
+                self.base_url + 'key/api/v1/pipeline/status/' + task_id,
+                headers=self.auth_headers
+            )
+        except CircuitOpenError as e:
+            return {"state": "error", "status": None, "circuit_open": True, "error": str(e)}
+        except Exception as e:
+            print(f"🎨 KANDINSKY DEBUG: Status check exception: {str(e)}")
+            return {"state": "error", "status": None, "error": str(e)}
+
+        if response.status_code != 200:
+            print(f"🎨 KANDINSKY DEBUG: Status check error: {response.status_code} - {response.text}")
+            return {"state": "error", "status": None, "error": f"{response.status_code} - {response.text}"}
+
+        data = response.json()
+        status = data.get('status')
+
+        if status == 'DONE':
+            # Генерация завершена успешно
+            result = data.get('result', {})
+            files = result.get('files', [])
+            censored = result.get('censored', False)
+            
+            print(f"🎨 KANDINSKY DEBUG: Files count: {len(files) if files else 0}")
+            
+            if files and len(files) >= 1:
+                # Возвращаем первое изображение
+                print(f"🎨 KANDINSKY DEBUG: Generation completed successfully, received {len(files)} images")
+                return {
+                    "state": "done",
+                    "status": status,
+                    "result": {
+                        "success": True,
+                        "images_data": files[:1],
+                        "task_id": task_id,
+                        "censored": censored,
+                        "images_count": len(files[:1])
+                    }
+                }
+            else:
+                print(f"🎨 KANDINSKY DEBUG: No image data in response")
+                return {
+                    "state": "done",
+                    "status": status,
+                    "result": {
+                        "success": False,
+                        "error": "Нет данных изображения в ответе"
+                    }
+                }
+        
+        elif status == 'FAIL':
+            error_desc = data.get('errorDescription', 'Неизвестная ошибка')
+            print(f"🎨 KANDINSKY DEBUG: Generation failed: {error_desc}")
+            return {
+                "state": "done",
+                "status": status,
+                "result": {
+                    "success": False,
+                    "error": f"Ошибка генерации: {error_desc}"
+                }
+            }
+
+        elif status not in ['INITIAL', 'PROCESSING']:
+            # Неизвестный статус
+            print(f"🎨 KANDINSKY DEBUG: Unknown status: {status}")
+
+        return {"state": "pending", "status": status}
     
     def check_generation_status(self, task_id, max_attempts=30, delay=5):
         """
@@ -126,86 +521,15 @@ class KandinskyService:
         attempts = 0
         
         while attempts < max_attempts:
-            try:
-                response = requests.get(
-                    self.base_url + 'key/api/v1/pipeline/status/' + task_id,
-                    headers=self.auth_headers,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    status = data.get('status')
-                    
-                    print(f"🎨 KANDINSKY DEBUG: Status check attempt {attempts + 1}/{max_attempts}, status: {status}")
-                    
-                    if status == 'DONE':
-                        # Генерация завершена успешно
-                        result = data.get('result', {})
-                        files = result.get('files', [])
-                        censored = result.get('censored', False)
-                        
-                        print(f"🎨 KANDINSKY DEBUG: Generation DONE, files: {files}")
-                        print(f"🎨 KANDINSKY DEBUG: Files count: {len(files) if files else 0}")
-                        
-                        if files and len(files) >= 1:
-                            # Возвращаем все изображения
-                            print(f"🎨 KANDINSKY DEBUG: Generation completed successfully, received {len(files)} images")
-                            return {
-                                "success": True,
-                                "images_data": files[:1],
-                                "task_id": task_id,
-                                "censored": censored,
-                                "images_count": len(files[:1])
-                            }
-                        elif files and len(files) > 0:
-                            # Получили меньше изображений чем запрашивали
-                            print(f"🎨 KANDINSKY DEBUG: Requested 1 image but received {len(files)}")
-                            return {
-                                "success": True,
-                                "images_data": files,  # Все что получили
-                                "task_id": task_id,
-                                "censored": censored,
-                                "images_count": len(files),
-                                "warning": f"Requested 1 but received {len(files)} images"
-                            }
-                        else:
-                            print(f"🎨 KANDINSKY DEBUG: No image data in response")
-                            return {
-                                "success": False,
-                                "error": "Нет данных изображения в ответе"
-                            }
-                    
-                    elif status == 'FAIL':
-                        error_desc = data.get('errorDescription', 'Неизвестная ошибка')
-                        print(f"🎨 KANDINSKY DEBUG: Generation failed: {error_desc}")
-                        return {
-                            "success": False,
-                            "error": f"Ошибка генерации: {error_desc}"
-                        }
-                    
-                    elif status in ['INITIAL', 'PROCESSING']:
-                        # Ждем и пробуем снова
-                        attempts += 1
-                        time.sleep(delay)
-                        continue
-                    
-                    else:
-                        # Неизвестный статус
-                        print(f"🎨 KANDINSKY DEBUG: Unknown status: {status}")
-                        attempts += 1
-                        time.sleep(delay)
-                        continue
-                        
-                else:
-                    print(f"🎨 KANDINSKY DEBUG: Status check error: {response.status_code} - {response.text}")
-                    attempts += 1
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                print(f"🎨 KANDINSKY DEBUG: Status check exception: {str(e)}")
-                attempts += 1
-                time.sleep(delay)
+            status_info = self.fetch_generation_status(task_id)
+            print(f"🎨 KANDINSKY DEBUG: Status check attempt {attempts + 1}/{max_attempts}, status: {status_info['status']}")
+
+            if status_info["state"] == "done":
+                return status_info["result"]
+
+            # Ждем и пробуем снова
+            attempts += 1
+            time.sleep(delay)
 
         # Превышено количество попыток
         error_msg = f"Превышено время ожидания генерации ({max_attempts * delay} секунд)"
@@ -215,21 +539,70 @@ class KandinskyService:
             "error": error_msg
         }
 
+    def wait_for_generation(self, task_id, width, height, timeout=None):
+        """
+        Ожидание генерации по адаптивному расписанию: первая проверка - через
+        типичное время генерации для этого разрешения, дальше экспоненциальная
+        пауза с разбросом. Длительность успешной генерации добавляется в профиль.
+        """
+        from .kandinsky_latency import latency_tracker
+
+        timeout = timeout or getattr(settings, 'KANDINSKY_POLL_TIMEOUT', 280)
+        schedule = latency_tracker.schedule(width, height)
+        started = time.monotonic()
+        last_poll_at = started
+        print(f"🎨 KANDINSKY DEBUG: Waiting for task {task_id}, first check in {schedule.initial_delay:.1f}s")
+
+        circuit_open = False
+        while True:
+            delay = schedule.next_delay()
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+
+            status_info = self.fetch_generation_status(task_id)
+            print(f"🎨 KANDINSKY DEBUG: Status check {schedule.polls}, status: {status_info['status']}")
+            circuit_open = status_info.get("circuit_open", False)
+
+            if status_info["state"] == "done":
+                result = status_info["result"]
+                if result["success"]:
+                    # Генерация закончилась между двумя проверками - берём середину интервала
+                    finished_at = (last_poll_at + time.monotonic()) / 2
+                    latency_tracker.record(width, height, finished_at - started)
+                    latency_tracker.flush()
+                return result
+            last_poll_at = time.monotonic()
+
+        if circuit_open:
+            return self._circuit_open_result()
+        error_msg = f"Превышено время ожидания генерации ({timeout} секунд)"
+        print(f"🎨 KANDINSKY DEBUG: {error_msg}")
+        return {
+            "success": False,
+            "error": error_msg
+        }
+
     def get_available_styles(self):
-        """Получение списка доступных стилей"""
+        """Получение списка доступных стилей из кеша"""
+        return self._styles_cache.get(self._load_styles) or []
+
+    def _load_styles(self):
         try:
-            response = requests.get(
-                "https://cdn.fusionbrain.ai/static/styles/key",
-                timeout=10
+            response = self._request(
+                "GET",
+                "styles",
+                self.styles_url
             )
             if response.status_code == 200:
                 return response.json()
             else:
                 logger.error(f"Styles request error: {response.status_code}")
-                return []
+                return None
         except Exception as e:
             logger.error(f"Styles error: {str(e)}")
-            return []
+            return None
 
 # Синглтон экземпляр сервиса
 kandinsky_service = KandinskyService()
\ No newline at end of file
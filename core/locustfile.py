@@ -1,5 +1,6 @@
 from locust import HttpUser, task, between
 import random
+import time
 
 class ContentumLoadUser(HttpUser):
     """
@@ -88,6 +89,34 @@ class ContentumLoadUser(HttpUser):
                 "prompt_parameters_id": param_id
             }, headers=self.headers)
 
+    @task(1)
+    def generate_from_form(self):
+        # Генерация через форму: задача ставится в очередь, статус опрашивается до готовности.
+        # Для офлайн-прогона запустите manage.py run_fake_kandinsky и воркер с KANDINSKY_BASE_URL на него
+        self._ensure_auth()
+        resp = self.client.post("/api/form-generation/generate/", json={
+            "idea": "Нагрузочная генерация",
+            "visual_style": "минимализм",
+            "composition_focus": "центр",
+            "color_palette": "пастельная",
+            "visual_associations": "свет",
+            "platform": "VK",
+            "aspect_ratio": "1:1",
+            "enable_photo_check": False
+        }, headers=self.headers)
+        if resp.status_code != 201:
+            return
+        task_id = resp.json()["data"]["task_id"]
+        for _ in range(30):
+            status_resp = self.client.get(
+                f"/api/generation-tasks/{task_id}/",
+                headers=self.headers,
+                name="/api/generation-tasks/[id]/"
+            )
+            if status_resp.status_code != 200 or status_resp.json().get("status") in ("SUCCESS", "FAILED"):
+                break
+            time.sleep(1)
+
     @task(1)
     def send_message(self):
         self._ensure_auth()
@@ -100,4 +129,7 @@ class ContentumLoadUser(HttpUser):
             self.client.post("/api/messages/", json=msg_data, headers=self.headers)
 
 # Команды для запуска:
-# locust -f core/locustfile.py --host=http://localhost:8000
\ No newline at end of file
+# locust -f core/locustfile.py --host=http://localhost:8000
+# Без доступа к FusionBrain:
+# python manage.py run_fake_kandinsky --latency lognormal:12:0.35 --failure-rate 0.05
+# KANDINSKY_BASE_URL=http://127.0.0.1:8100/ python manage.py run_generation_worker
\ No newline at end of file
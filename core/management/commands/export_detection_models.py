@@ -0,0 +1,42 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = 'Export the YOLO pose and hand models to ONNX for CPU inference and check parity with PyTorch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runtime', choices=['onnx', 'onnx-int8'], default='onnx', help='Export format')
+        parser.add_argument('--imgsz', type=int, default=None, help='Model input size (default: DETECTION_INPUT_SIZE)')
+        parser.add_argument('--fixtures', default=None, help='Directory with images for the accuracy-parity check')
+        parser.add_argument('--tolerance', type=float, default=3.0, help='Allowed mean keypoint error in pixels')
+        parser.add_argument('--max-score-mismatches', type=int, default=0, help='Images allowed to get a different score')
+        parser.add_argument('--check-only', action='store_true', help='Skip export and only run the parity check')
+
+    def handle(self, *args, **options):
+        from core.detection import export
+
+        runtime = options['runtime']
+        if not options['check_only']:
+            self.stdout.write(f'📦 Exporting detection models to {runtime}...')
+            for path in export.export_models(runtime, imgsz=options['imgsz']):
+                self.stdout.write(self.style.SUCCESS(f'   {path}'))
+
+        if not options['fixtures']:
+            self.stdout.write(self.style.WARNING('⚠️ No --fixtures given, parity with PyTorch was not checked'))
+            return
+
+        images = export.fixture_images(options['fixtures'])
+        if not images:
+            raise CommandError(f'No images found in {options["fixtures"]}')
+
+        self.stdout.write(f'🔍 Comparing {runtime} with pytorch on {len(images)} images...')
+        report = export.parity_check(images, candidate=runtime)
+        errors = report['keypoint_errors']
+        self.stdout.write(
+            f'   count mismatches: {report["count_mismatches"]}, score mismatches: {report["score_mismatches"]}, '
+            f'keypoint error: mean {np.mean(errors) if errors else 0:.2f}px, max {max(errors, default=0):.2f}px'
+        )
+
+        if not export.parity_passed(report, options['tolerance'], options['max_score_mismatches']):
+            raise CommandError(f'{runtime} models differ from PyTorch, keep DETECTION_RUNTIME=pytorch')
+        self.stdout.write(self.style.SUCCESS(f'✅ Parity check passed, set DETECTION_RUNTIME={runtime} to use them'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from core.detection.service import DetectionServer
+
+class Command(BaseCommand):
+    help = 'Run the photo-check (YOLO detection) service that owns the models for all web and generation workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=None, help='host:port to listen on (default: DETECTION_SERVICE_ADDRESS)')
+        parser.add_argument('--processes', type=int, default=None, help='Number of inference processes')
+        parser.add_argument('--max-pending', type=int, default=None, help='Requests allowed to wait before clients get "busy"')
+
+    def handle(self, *args, **options):
+        server = DetectionServer(
+            address=options['address'],
+            processes=options['processes'],
+            max_pending=options['max_pending']
+        )
+        server.bind()
+        host, port = server.address
+
+        self.stdout.write(f'🔍 Detection service listening on {host}:{port}')
+        self.stdout.write(f'   processes={server.processes}, max_pending={server.max_pending}')
+        self.stdout.write(f'   Point web and generation workers at it with DETECTION_SERVICE_ADDRESS={host}:{port}')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+
+        stats = server.stats
+        self.stdout.write(
+            f'🛑 Stopped: {stats["requests"]} requests, {stats["images"]} images, '
+            f'{stats["busy"]} rejected as busy, {stats["errors"]} errors'
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from core.fake_kandinsky import FakeKandinskyServer
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Kandinsky (FusionBrain) API for load testing and CI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+        parser.add_argument('--port', type=int, default=8100, help='Port to listen on')
+        parser.add_argument(
+            '--latency',
+            default='lognormal:12:0.35',
+            help='Generation time distribution: fixed:<s>, uniform:<min>:<max> or lognormal:<median>:<sigma>'
+        )
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of generations finishing with FAIL')
+        parser.add_argument('--censor-rate', type=float, default=0.0, help='Share of images flagged as censored')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of run requests answered with 503')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        server = FakeKandinskyServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            censor_rate=options['censor_rate'],
+            error_rate=options['error_rate'],
+            seed=options['seed']
+        )
+
+        self.stdout.write(f'🧪 Fake Kandinsky API listening on {server.base_url}')
+        self.stdout.write(f'   latency={server.latency}, failure_rate={server.failure_rate}, '
+                          f'censor_rate={server.censor_rate}, error_rate={server.error_rate}')
+        self.stdout.write('   Point the backend at it with:')
+        self.stdout.write(f'   KANDINSKY_BASE_URL={server.base_url}')
+        self.stdout.write(f'   KANDINSKY_STYLES_URL={server.styles_url}')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
+
+        stats = server.stats
+        self.stdout.write(
+            f'🛑 Stopped: {stats["run"]} generations, {stats["status"]} status checks, '
+            f'{stats["pipelines"]} pipeline requests, {stats["styles"]} style requests'
+        )
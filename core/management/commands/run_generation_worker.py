@@ -0,0 +1,81 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.generation_queue import GenerationWorker, requeue_stale_tasks, resume_deferred_tasks, default_worker_id
+from core.generation_events import prune_events
+from core.kandinsky_service import kandinsky_service
+from core.detection.photo_checker import photo_checker
+
+class Command(BaseCommand):
+    help = 'Run background worker that processes queued image generation tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process all queued tasks and exit')
+        parser.add_argument('--worker-id', default=None, help='Worker identifier stored on claimed tasks')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'GENERATION_WORKER_CONCURRENCY', 4),
+            help='Maximum number of tasks generated at the same time'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'GENERATION_WORKER_POLL_INTERVAL', 2),
+            help='Seconds to sleep when the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        poll_interval = options['poll_interval']
+        worker = GenerationWorker(worker_id=worker_id, concurrency=options['concurrency'])
+        self.stdout.write(f'🛠️ Generation worker {worker_id} started (concurrency: {worker.concurrency})')
+
+        if getattr(settings, 'DETECTION_PRELOAD_MODELS', False):
+            # Модели грузятся до первой задачи, а не во время проверки первого фото
+            started = time.monotonic()
+            photo_checker.warm_up()
+            self.stdout.write(f'🔍 Detection models ready in {time.monotonic() - started:.1f}s')
+
+        worker.start()
+        last_prune = 0.0
+        try:
+            while True:
+                close_old_connections()
+                requeue_stale_tasks()
+                resume_deferred_tasks()
+                if time.monotonic() - last_prune > 3600:
+                    # Старые события генерации нужны только для переподключения SSE-клиентов
+                    pruned = prune_events()
+                    if pruned:
+                        self.stdout.write(f'🧹 Pruned {pruned} old generation events')
+                    last_prune = time.monotonic()
+
+                for task in worker.run_once(wait=poll_interval if worker.active else 0):
+                    if task.status == task.Status.SUCCESS:
+                        style = self.style.SUCCESS
+                    elif task.status == task.Status.DEFERRED:
+                        style = self.style.WARNING
+                    else:
+                        style = self.style.ERROR
+                    self.stdout.write(style(f'   Task {task.id}: {task.status} (attempts: {task.attempts})'))
+
+                if worker.active:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.stop()
+            close_old_connections()
+
+        for host, stats in kandinsky_service.connection_stats().items():
+            self.stdout.write(
+                f'🔌 {host}: {stats["requests"]} requests, '
+                f'{stats["connections"]} connections, {stats["reused"]} reused'
+            )
+
+        self.stdout.write(f'🛑 Generation worker {worker_id} stopped')
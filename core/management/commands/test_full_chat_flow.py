@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
-from core.models import User, Chat, Message, MessageType
+from core.models import User, Chat, Message, MessageType, MediaGenerationTask
 from core.utils import handle_user_message_and_advance
+from core.generation_queue import claim_next_task, run_generation_task
 from core.kandinsky_service import kandinsky_service
 import base64
 import os
@@ -93,19 +94,26 @@ class Command(BaseCommand):
                     if "generation_result" in result:
                         gen_result = result["generation_result"]
                         if gen_result["success"]:
-                            self.stdout.write(self.style.SUCCESS('✅ Automatic generation successful!'))
+                            self.stdout.write(self.style.SUCCESS('✅ Generation task queued!'))
                             self.stdout.write(f'   Task ID: {gen_result.get("task_id")}')
                             
-                            images_data = gen_result.get("images_data", [])
+                            # Выполняем задачу сразу, не дожидаясь отдельного воркера
+                            task = claim_next_task(task_id=gen_result["task_id"])
+                            if task is not None:
+                                task = run_generation_task(task)
+                            else:
+                                task = MediaGenerationTask.objects.get(id=gen_result["task_id"])
                             
                             # СОХРАНЕНИЕ ИЗОБРАЖЕНИЯ В ФАЙЛ
-                            if images_data:
+                            if task.status == MediaGenerationTask.Status.SUCCESS and task.has_image:
+                                self.stdout.write(self.style.SUCCESS('✅ Automatic generation successful!'))
                                 # Преобразуем task_id в строку для использования в имени файла
-                                task_id_str = str(gen_result.get("task_id"))
+                                task_id_str = str(task.id)
                                 variation_count = result["prompt_parameters"].data.get('variation_count', '1')
-                                self.save_generated_images(images_data, full_prompt, task_id_str, variation_count)
+                                image_base64 = base64.b64encode(task.read_image()).decode('ascii')
+                                self.save_generated_images([image_base64], full_prompt, task_id_str, variation_count)
                             else:
-                                self.stdout.write(self.style.WARNING('⚠️ No image data received'))
+                                self.stdout.write(self.style.WARNING(f'⚠️ No image data received: {task.last_error}'))
                                 
                         else:
                             self.stdout.write(self.style.ERROR(f'❌ Generation failed: {gen_result.get("error")}'))
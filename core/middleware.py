@@ -1,4 +1,5 @@
 # middleware.py
+import re
 from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -7,6 +8,11 @@ from rest_framework.exceptions import AuthenticationFailed
 class JWTAuthenticationMiddleware(MiddlewareMixin):
     """Middleware для JWT аутентификации"""
 
+    stream_patterns = [
+        r"^/api/generation-tasks/[0-9a-f-]{36}/events/$",
+        r"^/api/chats/[0-9a-f-]{36}/generation-events/$",
+    ]
+
     def process_request(self, request):
         public_paths = [
             "/api/auth/login/",
@@ -30,7 +36,9 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
             any(request.path.startswith(prefix) and 
                (request.path.endswith('/download/') or request.path.endswith('/image/') or request.path.endswith('/image-file/'))
                for prefix in public_prefixes) or
-            request.method == "OPTIONS"
+            request.method == "OPTIONS" or
+            # SSE-потоки проверяют токен сами: EventSource передает одноразовый токен параметром ?token=
+            any(re.match(pattern, request.path) for pattern in self.stream_patterns)
         )
 
         if is_public:
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_mediagenerationtask_result_image_base64'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='check_quality',
+            field=models.BooleanField(default=True, verbose_name='Проверка качества'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='finishedAt',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='height',
+            field=models.IntegerField(default=1024, verbose_name='Высота'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='max_attempts',
+            field=models.IntegerField(default=3, verbose_name='Максимум попыток'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='problems',
+            field=models.JSONField(blank=True, default=list, verbose_name='Найденные проблемы'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='startedAt',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата начала обработки'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='width',
+            field=models.IntegerField(default=1024, verbose_name='Ширина'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Воркер'),
+        ),
+        migrations.AddIndex(
+            model_name='mediagenerationtask',
+            index=models.Index(fields=['status', 'createdAt'], name='core_task_status_created_idx'),
+        ),
+    ]
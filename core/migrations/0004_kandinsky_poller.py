@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_generation_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='kandinsky_status',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='Статус Kandinsky'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='kandinsky_uuid',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='ID задачи Kandinsky'),
+        ),
+    ]
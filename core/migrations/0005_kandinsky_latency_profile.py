@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_kandinsky_poller'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KandinskyLatencyProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(max_length=20, unique=True, verbose_name='Разрешение')),
+                ('samples', models.JSONField(blank=True, default=list, verbose_name='Длительности генераций (сек)')),
+                ('updatedAt', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Профиль задержки Kandinsky',
+                'verbose_name_plural': 'Профили задержки Kandinsky',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_kandinsky_latency_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KandinskyRateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('tokens', models.FloatField(default=0, verbose_name='Доступные токены')),
+                ('updatedAt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата пополнения')),
+            ],
+            options={
+                'verbose_name': 'Лимит запросов Kandinsky',
+                'verbose_name_plural': 'Лимиты запросов Kandinsky',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_kandinsky_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediagenerationtask',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'В ожидании'), ('RUNNING', 'Выполняется'), ('SUCCESS', 'Успешно'), ('FAILED', 'Ошибка'), ('DEFERRED', 'Отложена')], default='PENDING', max_length=20, verbose_name='Статус'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_generation_task_deferred'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='image_key',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Ключ изображения в хранилище'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='image_mime',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='MIME тип изображения'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='image_sha256',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='SHA-256 изображения'),
+        ),
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='image_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Размер изображения (байт)'),
+        ),
+    ]
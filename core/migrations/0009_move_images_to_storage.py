@@ -0,0 +1,135 @@
+import base64
+import hashlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import migrations
+
+BATCH_SIZE = 100
+
+# Копия core.image_storage на момент миграции: правки модуля не должны
+# менять то, как уже выпущенная миграция раскладывает файлы
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF87a", "image/gif", "gif"),
+    (b"GIF89a", "image/gif", "gif"),
+]
+
+MIME_EXTENSIONS = {mime: ext for _, mime, ext in IMAGE_SIGNATURES}
+MIME_EXTENSIONS["image/webp"] = "webp"
+
+
+def get_image_storage():
+    return storages[getattr(settings, 'GENERATED_IMAGES_STORAGE', 'default')]
+
+
+def decode_image_payload(image_base64):
+    if 'base64,' in image_base64:
+        image_base64 = image_base64.split('base64,', 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def detect_mime(data):
+    for signature, mime, _ in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def store_image(data):
+    """Сохраняет байты в хранилище по SHA-256 и возвращает поля задачи"""
+    sha256 = hashlib.sha256(data).hexdigest()
+    mime = detect_mime(data)
+    prefix = getattr(settings, 'GENERATED_IMAGES_PREFIX', 'generated')
+    key = f"{prefix}/{sha256[:2]}/{sha256}.{MIME_EXTENSIONS.get(mime, 'bin')}"
+
+    storage = get_image_storage()
+    if not storage.exists(key):
+        saved_key = storage.save(key, ContentFile(data))
+        if saved_key != key:
+            storage.delete(saved_key)
+
+    return {
+        "image_key": key,
+        "image_size": len(data),
+        "image_sha256": sha256,
+        "image_mime": mime,
+    }
+
+
+def read_image(key):
+    with get_image_storage().open(key, "rb") as image_file:
+        return image_file.read()
+
+
+def move_images_to_storage(apps, schema_editor):
+    """
+    Переносит изображения из result_image_base64 в файловое хранилище пачками.
+    Любая строка, которую не удалось перенести, прерывает миграцию.
+    """
+    MediaGenerationTask = apps.get_model('core', 'MediaGenerationTask')
+    pending = (
+        MediaGenerationTask.objects
+        .filter(result_image_base64__isnull=False)
+        .exclude(result_image_base64="")
+    )
+    moved = 0
+    last_id = None
+
+    while True:
+        # Читаем пачками по id, чтобы не держать все изображения в памяти
+        batch_qs = pending.only("id", "result_image_base64").order_by("id")
+        if last_id is not None:
+            batch_qs = batch_qs.filter(id__gt=last_id)
+        batch = list(batch_qs[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        updated = []
+        for task in batch:
+            try:
+                fields = store_image(decode_image_payload(task.result_image_base64))
+            except Exception as e:
+                # Следующая миграция удаляет result_image_base64 - пропуск строки
+                # означал бы потерю изображения, поэтому миграция прерывается
+                raise RuntimeError(
+                    f"Task {task.id}: не удалось перенести изображение ({e}). "
+                    f"Исправьте или очистите result_image_base64 этой задачи и повторите migrate"
+                ) from e
+            for name, value in fields.items():
+                setattr(task, name, value)
+            task.result_image_base64 = None
+            updated.append(task)
+
+        MediaGenerationTask.objects.bulk_update(
+            updated, ["image_key", "image_size", "image_sha256", "image_mime", "result_image_base64"]
+        )
+        moved += len(updated)
+
+    if moved:
+        print(f"   Перенесено изображений: {moved}")
+
+
+def move_images_back(apps, schema_editor):
+    MediaGenerationTask = apps.get_model('core', 'MediaGenerationTask')
+    stored = MediaGenerationTask.objects.exclude(image_key="").only("id", "image_key")
+
+    for task in stored.iterator(chunk_size=BATCH_SIZE):
+        task.result_image_base64 = base64.b64encode(read_image(task.image_key)).decode("ascii")
+        task.save(update_fields=["result_image_base64"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_generation_task_image_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_images_to_storage, move_images_back),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_move_images_to_storage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='mediagenerationtask',
+            name='result_image_base64',
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_remove_result_image_base64'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoCheckResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=160, unique=True, verbose_name='Ключ (SHA-256 изображения и версия детектора)')),
+                ('image_sha256', models.CharField(max_length=64, verbose_name='SHA-256 изображения')),
+                ('detector_version', models.CharField(max_length=90, verbose_name='Версия детектора')),
+                ('score', models.IntegerField(verbose_name='Оценка')),
+                ('checks', models.JSONField(blank=True, default=dict, verbose_name='Результаты проверок')),
+                ('reason', models.TextField(blank=True, default='', verbose_name='Причина')),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Результат проверки фото',
+                'verbose_name_plural': 'Результаты проверки фото',
+            },
+        ),
+    ]
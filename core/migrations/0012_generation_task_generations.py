@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_photo_check_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediagenerationtask',
+            name='generations',
+            field=models.PositiveIntegerField(default=0, verbose_name='Запущено генераций'),
+        ),
+    ]
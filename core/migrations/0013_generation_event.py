@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_generation_task_generations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('queued', 'В очереди'), ('submitted', 'Отправлена в Kandinsky'), ('kandinsky_status', 'Статус Kandinsky'), ('checking', 'Проверка качества'), ('regenerating', 'Перегенерация'), ('deferred', 'Отложена'), ('done', 'Готово'), ('failed', 'Ошибка')], max_length=20, verbose_name='Событие')),
+                ('data', models.JSONField(blank=True, default=dict, verbose_name='Данные события')),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата создания')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='core.mediagenerationtask', verbose_name='Задача')),
+            ],
+            options={
+                'verbose_name': 'Событие генерации',
+                'verbose_name_plural': 'События генерации',
+                'indexes': [models.Index(fields=['createdAt'], name='core_genevent_created_idx')],
+            },
+        ),
+    ]
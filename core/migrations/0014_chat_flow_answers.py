@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:52
+
+import json
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+# Ключи шагов flow на момент миграции (core.utils.QUESTIONS_FLOW)
+FLOW_KEYS = [
+    "idea", "event_name", "event_genre", "visual_style", "composition_focus",
+    "color_palette", "visual_associations", "platform", "aspect_ratio",
+]
+
+
+def answer_text(content):
+    """Текст ответа из content сообщения (как core.utils.extract_text_from_content)"""
+    try:
+        data = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        return content.strip()
+    if not isinstance(data, dict) or 'info' not in data:
+        return str(data)
+    info = data['info']
+    if isinstance(info, str):
+        return info.strip()
+    if isinstance(info, dict):
+        return info.get('prompt', str(info))
+    return str(info)
+
+
+def backfill_flow_answers(apps, schema_editor):
+    """
+    Заполняет flow_answers начатых чатов: как и прежний
+    build_parameters_from_chat_messages, i-е USER сообщение чата считается
+    ответом на i-й вопрос (только для уже пройденных шагов).
+    """
+    Chat = apps.get_model('core', 'Chat')
+    Message = apps.get_model('core', 'Message')
+    chats = Chat.objects.filter(flow_step__gt=0).only("id", "flow_step", "flow_answers").order_by("id")
+
+    batch = []
+    filled = 0
+    for chat in chats.iterator(chunk_size=BATCH_SIZE):
+        steps = min(chat.flow_step, len(FLOW_KEYS))
+        contents = (
+            Message.objects.filter(chat_id=chat.id, messageType="USER")
+            .order_by("createdAt")
+            .values_list("content", flat=True)[:steps]
+        )
+        chat.flow_answers = {key: answer_text(content) for key, content in zip(FLOW_KEYS, contents)}
+        batch.append(chat)
+        if len(batch) >= BATCH_SIZE:
+            Chat.objects.bulk_update(batch, ["flow_answers"])
+            filled += len(batch)
+            batch = []
+
+    Chat.objects.bulk_update(batch, ["flow_answers"])
+    filled += len(batch)
+    if filled:
+        print(f"   Заполнены ответы flow: {filled} чатов")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_generation_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='flow_answers',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Ответы flow'),
+        ),
+        migrations.RunPython(backfill_flow_answers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_chat_flow_answers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Ключ идемпотентности'),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('chat', 'idempotency_key'), name='message_chat_idempotency_key'),
+        ),
+    ]
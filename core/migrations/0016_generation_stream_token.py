@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_message_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationStreamToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 токена')),
+                ('stream', models.CharField(max_length=50, verbose_name='Поток (task:<id> или chat:<id>)')),
+                ('expiresAt', models.DateTimeField(verbose_name='Действует до')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stream_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Токен потока событий',
+                'verbose_name_plural': 'Токены потоков событий',
+            },
+        ),
+    ]
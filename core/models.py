@@ -1,6 +1,7 @@
 # models.py
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 import uuid
 import json
@@ -59,6 +60,40 @@ class User(AbstractBaseUser, PermissionsMixin):
     def is_admin(self):
         return self.role == UserRole.ADMIN
 
+class ChatQuerySet(models.QuerySet):
+    def for_list(self, include_messages=False):
+        """
+        Чаты для списка за постоянное число запросов: количество сообщений
+        считается аннотацией, последнее сообщение каждого чата подгружается одним
+        запросом в last_messages. Все сообщения загружаются только по запросу.
+        """
+        counts = (
+            Message.objects.filter(chat=models.OuterRef("pk"))
+            .order_by()
+            .values("chat")
+            .annotate(count=models.Count("id"))
+            .values("count")
+        )
+        latest = (
+            Message.objects.filter(chat=models.OuterRef("chat"))
+            .order_by("-createdAt")
+            .values("id")[:1]
+        )
+        # Подзапрос, а не JOIN + GROUP BY: COUNT(*) пагинации остается простым
+        qs = self.annotate(
+            message_count=Coalesce(models.Subquery(counts, output_field=models.IntegerField()), 0)
+        ).prefetch_related(
+            models.Prefetch(
+                "messages",
+                queryset=Message.objects.filter(id=models.Subquery(latest)),
+                to_attr="last_messages",
+            )
+        )
+        if include_messages:
+            qs = qs.prefetch_related("messages")
+        return qs
+
+
 class Chat(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chats", verbose_name="Пользователь")
@@ -69,6 +104,10 @@ class Chat(models.Model):
     is_temporary = models.BooleanField(default=False, verbose_name="Временный")
     temp_created_at = models.DateTimeField(null=True, blank=True, verbose_name="Время создания временного чата")
     flow_step = models.IntegerField(default=0, verbose_name="Текущий шаг flow")
+    # Ответы на вопросы flow по ключам шагов, пишутся вместе с flow_step
+    flow_answers = models.JSONField(default=dict, blank=True, verbose_name="Ответы flow")
+    
+    objects = ChatQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Чат"
@@ -84,11 +123,20 @@ class Message(models.Model):
     content = models.TextField(verbose_name="Содержание")
     messageType = models.CharField(max_length=20, choices=MessageType.choices, default=MessageType.USER, verbose_name="Тип сообщения")
     createdAt = models.DateTimeField(default=timezone.now, verbose_name="Дата создания")
+    # Idempotency-Key запроса POST /api/messages/: повторная отправка не создает второе сообщение
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, verbose_name="Ключ идемпотентности")
     
     class Meta:
         verbose_name = "Сообщение"
         verbose_name_plural = "Сообщения"
         ordering = ["createdAt"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat", "idempotency_key"],
+                condition=models.Q(idempotency_key__isnull=False),
+                name="message_chat_idempotency_key",
+            ),
+        ]
     
     def __str__(self):
         return f"{self.messageType}: {self.content[:50]}..."
@@ -157,12 +205,39 @@ class PromptHistory(models.Model):
     def __str__(self):
         return f"Промпт {self.user.email}"
 
+class MediaGenerationTaskQuerySet(models.QuerySet):
+    """
+    Запросы задач генерации без лишних колонок: для опроса статуса и списков
+    не нужны текст промпта, найденные проблемы и тем более байты изображения
+    (они лежат в хранилище и читаются только эндпоинтами изображения).
+    """
+
+    # Поля, которых достаточно для ответа о статусе генерации
+    STATUS_FIELDS = (
+        "id", "user_id", "chat_id", "status", "image_key", "image_size", "image_mime",
+        "attempts", "last_error", "createdAt", "updatedAt",
+    )
+
+    def status_only(self):
+        return self.only(*self.STATUS_FIELDS)
+
+    def for_list(self):
+        return self.defer("problems", "kandinsky_uuid", "kandinsky_status", "worker_id")
+
+    def with_image_info(self):
+        """Аннотация image_ready считается в SQL по image_key, файл не открывается"""
+        return self.annotate(
+            image_ready=models.ExpressionWrapper(~models.Q(image_key=""), output_field=models.BooleanField())
+        )
+
+
 class MediaGenerationTask(models.Model):
     class Status(models.TextChoices):
         PENDING = "PENDING", "В ожидании"
         RUNNING = "RUNNING", "Выполняется" 
         SUCCESS = "SUCCESS", "Успешно"
         FAILED = "FAILED", "Ошибка"
+        DEFERRED = "DEFERRED", "Отложена"  # Kandinsky API недоступен, задача вернется в очередь
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="generation_tasks", verbose_name="Пользователь")
@@ -171,19 +246,156 @@ class MediaGenerationTask(models.Model):
     prompt_text = models.TextField(verbose_name="Текст промпта")
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name="Статус")
     result_url = models.URLField(blank=True, null=True, verbose_name="URL результата")
-    result_image_base64 = models.TextField(blank=True, null=True, verbose_name="Изображение (Base64)")  # НОВОЕ ПОЛЕ
+    image_key = models.CharField(max_length=255, blank=True, default="", verbose_name="Ключ изображения в хранилище")
+    image_size = models.PositiveIntegerField(null=True, blank=True, verbose_name="Размер изображения (байт)")
+    image_sha256 = models.CharField(max_length=64, blank=True, default="", verbose_name="SHA-256 изображения")
+    image_mime = models.CharField(max_length=50, blank=True, default="", verbose_name="MIME тип изображения")
     attempts = models.IntegerField(default=0, verbose_name="Попытки")
+    max_attempts = models.IntegerField(default=3, verbose_name="Максимум попыток")
+    # Все запуски генерации в Kandinsky, включая параллельных кандидатов одной попытки
+    generations = models.PositiveIntegerField(default=0, verbose_name="Запущено генераций")
+    width = models.IntegerField(default=1024, verbose_name="Ширина")
+    height = models.IntegerField(default=1024, verbose_name="Высота")
+    check_quality = models.BooleanField(default=True, verbose_name="Проверка качества")
+    problems = models.JSONField(default=list, blank=True, verbose_name="Найденные проблемы")
     last_error = models.TextField(blank=True, null=True, verbose_name="Последняя ошибка")
+    worker_id = models.CharField(max_length=255, blank=True, default="", verbose_name="Воркер")
+    kandinsky_uuid = models.CharField(max_length=64, blank=True, default="", verbose_name="ID задачи Kandinsky")
+    kandinsky_status = models.CharField(max_length=20, blank=True, default="", verbose_name="Статус Kandinsky")
     createdAt = models.DateTimeField(default=timezone.now, verbose_name="Дата создания")
     updatedAt = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    startedAt = models.DateTimeField(null=True, blank=True, verbose_name="Дата начала обработки")
+    finishedAt = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+
+    objects = MediaGenerationTaskQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Задача генерации"
         verbose_name_plural = "Задачи генерации"
+        indexes = [
+            # Воркер выбирает задачи очереди по статусу в порядке создания
+            models.Index(fields=["status", "createdAt"], name="core_task_status_created_idx"),
+        ]
     
     def __str__(self):
         return f"Задача {self.user.email}"
 
+    @property
+    def has_image(self):
+        return bool(self.image_key)
+
+    def set_image(self, image_base64):
+        """Декодирует base64 от Kandinsky и сохраняет байты в хранилище изображений"""
+        from .image_storage import decode_image_payload, store_image
+        for name, value in store_image(decode_image_payload(image_base64)).items():
+            setattr(self, name, value)
+
+    def open_image(self):
+        from .image_storage import open_image
+        return open_image(self.image_key)
+
+    def read_image(self):
+        from .image_storage import read_image
+        return read_image(self.image_key)
+
+    @property
+    def image_filename(self):
+        from .image_storage import image_extension
+        return f"generated_image_{self.id}.{image_extension(self.image_mime)}"
+
+class KandinskyLatencyProfile(models.Model):
+    """Последние наблюдаемые длительности генерации Kandinsky для одного разрешения"""
+    resolution = models.CharField(max_length=20, unique=True, verbose_name="Разрешение")
+    samples = models.JSONField(default=list, blank=True, verbose_name="Длительности генераций (сек)")
+    updatedAt = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    
+    class Meta:
+        verbose_name = "Профиль задержки Kandinsky"
+        verbose_name_plural = "Профили задержки Kandinsky"
+    
+    def __str__(self):
+        return f"{self.resolution} ({len(self.samples)} замеров)"
+
+class KandinskyRateLimitBucket(models.Model):
+    """Общий для всех процессов token bucket запросов генерации к Kandinsky"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Название")
+    tokens = models.FloatField(default=0, verbose_name="Доступные токены")
+    updatedAt = models.DateTimeField(default=timezone.now, verbose_name="Дата пополнения")
+    
+    class Meta:
+        verbose_name = "Лимит запросов Kandinsky"
+        verbose_name_plural = "Лимиты запросов Kandinsky"
+    
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f}"
+
+class PhotoCheckResult(models.Model):
+    """Сохраненный результат проверки фото для изображения и версии детектора"""
+    key = models.CharField(max_length=160, unique=True, verbose_name="Ключ (SHA-256 изображения и версия детектора)")
+    image_sha256 = models.CharField(max_length=64, verbose_name="SHA-256 изображения")
+    detector_version = models.CharField(max_length=90, verbose_name="Версия детектора")
+    score = models.IntegerField(verbose_name="Оценка")
+    checks = models.JSONField(default=dict, blank=True, verbose_name="Результаты проверок")
+    reason = models.TextField(blank=True, default="", verbose_name="Причина")
+    createdAt = models.DateTimeField(default=timezone.now, verbose_name="Дата создания")
+    
+    class Meta:
+        verbose_name = "Результат проверки фото"
+        verbose_name_plural = "Результаты проверки фото"
+    
+    def __str__(self):
+        return f"{self.image_sha256[:12]} ({self.detector_version}): {self.score}"
+
+class GenerationEvent(models.Model):
+    """
+    Переход задачи генерации из одного состояния в другое.
+    Воркер и поллер записывают события, SSE-эндпоинты отдают их клиентам
+    (общая лента для процессов воркера и веб-сервера).
+    """
+    class Event(models.TextChoices):
+        QUEUED = "queued", "В очереди"
+        SUBMITTED = "submitted", "Отправлена в Kandinsky"
+        KANDINSKY_STATUS = "kandinsky_status", "Статус Kandinsky"
+        CHECKING = "checking", "Проверка качества"
+        REGENERATING = "regenerating", "Перегенерация"
+        DEFERRED = "deferred", "Отложена"
+        DONE = "done", "Готово"
+        FAILED = "failed", "Ошибка"
+
+    task = models.ForeignKey(MediaGenerationTask, on_delete=models.CASCADE, related_name="events", verbose_name="Задача")
+    event = models.CharField(max_length=20, choices=Event.choices, verbose_name="Событие")
+    data = models.JSONField(default=dict, blank=True, verbose_name="Данные события")
+    createdAt = models.DateTimeField(default=timezone.now, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Событие генерации"
+        verbose_name_plural = "События генерации"
+        indexes = [
+            # Устаревшие события удаляются по дате
+            models.Index(fields=["createdAt"], name="core_genevent_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task_id}: {self.event}"
+
+class GenerationStreamToken(models.Model):
+    """
+    Короткоживущий одноразовый токен SSE-потока. EventSource не умеет передавать
+    заголовки, поэтому токен передается в URL (?token=) - вместо JWT access токена
+    туда попадает токен, который открывает только один поток и только один раз.
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name="SHA-256 токена")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="stream_tokens", verbose_name="Пользователь")
+    stream = models.CharField(max_length=50, verbose_name="Поток (task:<id> или chat:<id>)")
+    expiresAt = models.DateTimeField(verbose_name="Действует до")
+
+    class Meta:
+        verbose_name = "Токен потока событий"
+        verbose_name_plural = "Токены потоков событий"
+
+    def __str__(self):
+        return f"{self.user_id}: {self.stream}"
+
 class AuditLog(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
@@ -1,5 +1,6 @@
 # serializers.py
 import json
+import base64
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.core.exceptions import ValidationError
@@ -152,14 +153,28 @@ class ChatSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "user", "createdAt", "updatedAt", "messages", "messageCount", "lastMessage", "flow_step", "is_temporary"]
 
     def get_messageCount(self, obj):
+        # В списке количество приходит аннотацией (ChatViewSet.get_queryset)
+        count = getattr(obj, "message_count", None)
+        if count is not None:
+            return count
         return obj.messages.count()
 
     def get_lastMessage(self, obj):
-        last = obj.messages.order_by("-createdAt").first()
+        # В списке последнее сообщение уже загружено через Prefetch в last_messages
+        if hasattr(obj, "last_messages"):
+            last = obj.last_messages[0] if obj.last_messages else None
+        else:
+            last = obj.messages.order_by("-createdAt").first()
         if not last:
             return None
         return MessageSerializer(last).data
 
+class ChatListSerializer(ChatSerializer):
+    """Чат для списка: без вложенных сообщений, только messageCount и lastMessage"""
+
+    class Meta(ChatSerializer.Meta):
+        fields = [field for field in ChatSerializer.Meta.fields if field != "messages"]
+
 class ChatCreateSerializer(serializers.ModelSerializer):
     initialMessage = serializers.CharField(write_only=True, required=False)
 
@@ -223,6 +238,13 @@ class AdminChatSerializer(ChatSerializer):
     class Meta(ChatSerializer.Meta):
         fields = ChatSerializer.Meta.fields + ['user_email', 'user_fullName']
 
+class AdminChatListSerializer(ChatListSerializer):
+    user_email = serializers.EmailField(source='user.email', read_only=True)
+    user_fullName = serializers.CharField(source='user.fullName', read_only=True)
+
+    class Meta(ChatListSerializer.Meta):
+        fields = ChatListSerializer.Meta.fields + ['user_email', 'user_fullName']
+
 class PromptTemplateSerializer(serializers.ModelSerializer):
     class Meta:
         model = PromptTemplate
@@ -254,17 +276,53 @@ class PromptHistorySerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "user", "createdAt"]
 
 class MediaGenerationTaskSerializer(serializers.ModelSerializer):
-    result_image_base64 = serializers.CharField(read_only=True, allow_null=True)
+    # Изображение хранится файлом и отдается через image-file/ и download/.
+    # base64 собирается из файла только по ?include=image (совместимость API):
+    # статус задачи опрашивают часто, и каждый опрос не должен читать картинку
+    result_image_base64 = serializers.SerializerMethodField()
+    has_image = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = MediaGenerationTask
         fields = [
             "id", "user", "chat", "prompt_history", "prompt_text", 
-            "status", "result_url", "result_image_base64",
+            "status", "result_url", "has_image", "result_image_base64",
+            "image_size", "image_sha256", "image_mime",
             "attempts", "last_error", "createdAt", "updatedAt"
         ]
         read_only_fields = ["id", "user", "createdAt", "updatedAt"]
 
+    def _include_image(self):
+        request = self.context.get("request")
+        if request is None:
+            return False
+        return "image" in request.query_params.get("include", "").split(",")
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if not self._include_image():
+            data.pop("result_image_base64", None)
+        return data
+
+    def get_result_image_base64(self, obj):
+        if not obj.has_image or not self._include_image():
+            return None
+        return base64.b64encode(obj.read_image()).decode("ascii")
+
+class MediaGenerationTaskListSerializer(serializers.ModelSerializer):
+    """Список задач: только метаданные изображения, без байтов (их отдает image-file)"""
+    has_image = serializers.BooleanField(source="image_ready", read_only=True)
+
+    class Meta:
+        model = MediaGenerationTask
+        fields = [
+            "id", "user", "chat", "prompt_history", "prompt_text",
+            "status", "result_url", "has_image",
+            "image_size", "image_sha256", "image_mime",
+            "attempts", "last_error", "createdAt", "updatedAt"
+        ]
+        read_only_fields = fields
+
 class FormGenerationSerializer(serializers.Serializer):
     """Сериализатор для формы с полным набором параметров"""
     
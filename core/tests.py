@@ -1,7 +1,9 @@
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from .models import User, Chat, Message, PromptParameters, PromptTemplate, UserRole, PromptHistory, MediaGenerationTask
+import io
 import json
 import base64
 import os
@@ -74,6 +76,133 @@ class ChatFlowTests(APITestCase):
         params_resp = self.client.get(params_url, **self.auth_headers)
         self.assertGreaterEqual(params_resp.data['count'], 1)
 
+    def test_flow_answers_are_stored_per_step(self):
+        """Ожидаемый результат: ответы копятся в чате по шагам, завершение flow не перечитывает сообщения"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .utils import QUESTIONS_FLOW
+        chat = Chat.objects.create(user=self.user, title='Чат')
+        messages_url = reverse('message-list')
+
+        for step, (key, _, _) in enumerate(QUESTIONS_FLOW[:-1]):
+            self.client.post(messages_url, {'chat': chat.id, 'content': f'Ответ {key}'}, format='json', **self.auth_headers)
+        chat.refresh_from_db()
+        self.assertEqual(chat.flow_step, len(QUESTIONS_FLOW) - 1)
+        self.assertEqual(chat.flow_answers['idea'], 'Ответ idea')
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(messages_url, {'chat': chat.id, 'content': '16:9'}, format='json', **self.auth_headers)
+        self.assertEqual(resp.data['data']['status'], 'generating')
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'core_message' in q['sql']])
+
+        params = PromptParameters.objects.get(id=resp.data['data']['prompt_parameters_id']).data
+        self.assertEqual(params['visual_style'], 'Ответ visual_style')
+        self.assertEqual(params['aspect_ratio'], '16:9')
+        task = MediaGenerationTask.objects.get(id=resp.data['data']['generation_task_id'])
+        self.assertEqual((task.width, task.height), (1920, 1080))
+
+    def test_duplicate_final_answer_starts_one_generation(self):
+        """Ожидаемый результат: дубль последнего ответа (тот же Idempotency-Key или без ключа) не запускает вторую генерацию"""
+        from .utils import QUESTIONS_FLOW
+        chat = Chat.objects.create(user=self.user, title='Чат', flow_step=len(QUESTIONS_FLOW) - 1)
+        messages_url = reverse('message-list')
+        headers = dict(self.auth_headers, HTTP_IDEMPOTENCY_KEY='answer-9')
+
+        first = self.client.post(messages_url, {'chat': chat.id, 'content': '1:1'}, format='json', **headers)
+        again = self.client.post(messages_url, {'chat': chat.id, 'content': '1:1'}, format='json', **headers)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertTrue(again.data['data']['duplicate'])
+        self.assertEqual(again.data['data']['user_message']['id'], first.data['data']['user_message']['id'])
+        self.assertEqual(again.data['data']['generation_task_id'], first.data['data']['generation_task_id'])
+        self.assertEqual(Message.objects.filter(chat=chat, messageType='USER').count(), 1)
+
+        # Дубль без ключа отклоняется, другой ответ после завершения flow только сохраняется
+        again = self.client.post(messages_url, {'chat': chat.id, 'content': '1:1'}, format='json', **self.auth_headers)
+        self.assertEqual(again.status_code, status.HTTP_409_CONFLICT)
+        late = self.client.post(messages_url, {'chat': chat.id, 'content': 'Спасибо'}, format='json', **self.auth_headers)
+        self.assertEqual(late.status_code, status.HTTP_201_CREATED)
+        chat.refresh_from_db()
+        self.assertEqual(chat.flow_step, len(QUESTIONS_FLOW))
+        self.assertEqual(MediaGenerationTask.objects.filter(chat=chat).count(), 1)
+
+    def test_keyless_double_submit_does_not_answer_next_question(self):
+        """Ожидаемый результат: повтор ответа без ключа или ответ на устаревший шаг не сдвигает flow"""
+        chat = Chat.objects.create(user=self.user, title='Чат')
+        messages_url = reverse('message-list')
+
+        first = self.client.post(messages_url, {'chat': chat.id, 'content': 'Концерт'}, format='json', **self.auth_headers)
+        double = self.client.post(messages_url, {'chat': chat.id, 'content': 'Концерт'}, format='json', **self.auth_headers)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(double.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(double.data['data']['flow_step'], 1)
+
+        # Клиент указывает шаг: ответ на уже отвеченный вопрос отклоняется даже с другим текстом
+        stale = self.client.post(messages_url, {'chat': chat.id, 'content': 'Гамлет', 'flow_step': 0}, format='json', **self.auth_headers)
+        self.assertEqual(stale.status_code, status.HTTP_409_CONFLICT)
+        current = self.client.post(messages_url, {'chat': chat.id, 'content': 'Гамлет', 'flow_step': 1}, format='json', **self.auth_headers)
+        self.assertEqual(current.status_code, status.HTTP_201_CREATED)
+
+        chat.refresh_from_db()
+        self.assertEqual(chat.flow_step, 2)
+        self.assertEqual(chat.flow_answers, {'idea': 'Концерт', 'event_name': 'Гамлет'})
+        self.assertEqual(Message.objects.filter(chat=chat, messageType='USER').count(), 2)
+
+    def test_failed_advance_rolls_back_message_for_retry(self):
+        """Ожидаемый результат: если flow не продвинулся, ответ откатывается и повтор с тем же ключом обрабатывается заново"""
+        from unittest import mock
+        from . import utils
+        from .utils import QUESTIONS_FLOW
+        chat = Chat.objects.create(user=self.user, title='Чат', flow_step=len(QUESTIONS_FLOW) - 1)
+        messages_url = reverse('message-list')
+        headers = dict(self.auth_headers, HTTP_IDEMPOTENCY_KEY='answer-9')
+
+        with mock.patch.object(utils, 'enqueue_generation_task', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(messages_url, {'chat': chat.id, 'content': '1:1'}, format='json', **headers)
+        chat.refresh_from_db()
+        self.assertEqual(chat.flow_step, len(QUESTIONS_FLOW) - 1)
+        self.assertFalse(Message.objects.filter(chat=chat, idempotency_key='answer-9').exists())
+
+        retry = self.client.post(messages_url, {'chat': chat.id, 'content': '1:1'}, format='json', **headers)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['data']['status'], 'generating')
+        self.assertEqual(MediaGenerationTask.objects.filter(chat=chat).count(), 1)
+
+    def test_chat_list_queries_do_not_grow_with_chats(self):
+        """Ожидаемый результат: список чатов отдает messageCount и lastMessage за постоянное число запросов"""
+        url = reverse('chat-list')
+        for i in range(15):
+            chat = Chat.objects.create(user=self.user, title=f'Чат {i}')
+            for text in ('Вопрос', 'Ответ', f'Последнее {i}'):
+                Message.objects.create(chat=chat, content=json.dumps({'type': 'text', 'info': text}), messageType='USER')
+
+        # 2 запроса аутентификации + COUNT пагинации + чаты + последние сообщения
+        with self.assertNumQueries(5):
+            resp = self.client.get(url, **self.auth_headers)
+        self.assertEqual(resp.data['count'], 15)
+        first = resp.data['results'][0]
+        self.assertNotIn('messages', first)
+        self.assertEqual(first['messageCount'], 3)
+        self.assertEqual(first['lastMessage']['content']['info'], 'Последнее 14')
+
+        with self.assertNumQueries(6):
+            resp = self.client.get(f'{url}?include=messages', **self.auth_headers)
+        self.assertEqual(len(resp.data['results'][0]['messages']), 3)
+
+    def test_flow_answers_backfill_from_messages(self):
+        """Ожидаемый результат: миграция заполняет ответы уже начатых чатов из их сообщений"""
+        from importlib import import_module
+        from django.apps import apps
+        migration = import_module('core.migrations.0014_chat_flow_answers')
+        chat = Chat.objects.create(user=self.user, title='Старый чат', flow_step=2)
+        for text in ('Концерт', 'Гамлет', 'Лишнее'):
+            Message.objects.create(chat=chat, content=json.dumps({'type': 'text', 'info': text}), messageType='USER')
+
+        migration.backfill_flow_answers(apps, None)
+        chat.refresh_from_db()
+        self.assertEqual(chat.flow_answers, {'idea': 'Концерт', 'event_name': 'Гамлет'})
+
 class PromptAssembleTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -128,6 +257,877 @@ class MediaGenerationTests(APITestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertTrue('task_id' in resp.data['data'] or 'result_url' in resp.data['data'])
 
+class GenerationQueueTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.email = 'queue@gmail.com'
+        self.password = 'StrongPass123'
+        self.user = User.objects.create_user(
+            email=self.email,
+            password=self.password,
+            fullName='Queue User'
+        )
+        self.auth_headers = get_auth_headers(self.email, self.password, self.client)
+        self.prompt_history = PromptHistory.objects.create(user=self.user, assembled_prompt='Тестовый промпт')
+
+    def test_claim_next_task_takes_oldest_pending_once(self):
+        """Ожидаемый результат: воркер забирает задачи по порядку, одна задача не выдаётся дважды"""
+        from .generation_queue import enqueue_generation_task, claim_next_task
+        first = enqueue_generation_task(self.user, self.prompt_history, 'Первый')
+        second = enqueue_generation_task(self.user, self.prompt_history, 'Второй')
+
+        claimed = claim_next_task(worker_id='worker-1')
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, MediaGenerationTask.Status.RUNNING)
+        self.assertEqual(claimed.worker_id, 'worker-1')
+
+        self.assertEqual(claim_next_task(worker_id='worker-2').id, second.id)
+        self.assertIsNone(claim_next_task(worker_id='worker-3'))
+
+    def test_claim_is_fair_between_users(self):
+        """Ожидаемый результат: пачка задач одного пользователя не задерживает задачу другого"""
+        from .generation_queue import enqueue_generation_task, claim_next_task
+        other = User.objects.create_user(email='other@gmail.com', password=self.password, fullName='Other User')
+        other_history = PromptHistory.objects.create(user=other, assembled_prompt='Другой промпт')
+
+        batch = [enqueue_generation_task(self.user, self.prompt_history, f'Пачка {i}') for i in range(3)]
+        single = enqueue_generation_task(other, other_history, 'Одна задача')
+
+        self.assertEqual(claim_next_task().id, batch[0].id)
+        self.assertEqual(claim_next_task().id, single.id)
+        self.assertEqual(claim_next_task().id, batch[1].id)
+
+    def test_completed_image_is_stored_once_as_file(self):
+        """Ожидаемый результат: изображение хранится файлом по хешу содержимого и отдаётся без base64"""
+        import hashlib
+        import tempfile
+        from .generation_queue import enqueue_generation_task, complete_task
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        image_base64 = base64.b64encode(png).decode()
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            first = complete_task(enqueue_generation_task(self.user, self.prompt_history, 'Первый'), image_base64)
+            second = complete_task(enqueue_generation_task(self.user, self.prompt_history, 'Второй'), image_base64)
+
+            self.assertEqual(first.image_key, second.image_key)
+            self.assertEqual(first.image_sha256, hashlib.sha256(png).hexdigest())
+            self.assertEqual((first.image_size, first.image_mime), (len(png), 'image/png'))
+            self.assertEqual(os.listdir(os.path.join(media_root, 'generated', first.image_sha256[:2])), [
+                f'{first.image_sha256}.png'
+            ])
+
+            resp = self.client.get(reverse('generationtask-image-file', args=[first.id]), **self.auth_headers)
+            self.assertEqual(resp['Content-Type'], 'image/png')
+            self.assertEqual(b''.join(resp.streaming_content), png)
+
+            resp = self.client.get(reverse('generationtask-download-image', args=[first.id]), **self.auth_headers)
+            self.assertIn('attachment', resp['Content-Disposition'])
+
+    def test_task_list_and_status_skip_image_payloads(self):
+        """Ожидаемый результат: список задач и статус чата не читают изображение и текст промпта"""
+        import tempfile
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .generation_queue import enqueue_generation_task, complete_task
+        chat = Chat.objects.create(user=self.user, title='Чат')
+        png = b'\x89PNG\r\n\x1a\n' + b'\x01' * 32
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            task = complete_task(
+                enqueue_generation_task(self.user, self.prompt_history, 'Промпт', chat=chat),
+                base64.b64encode(png).decode()
+            )
+
+            resp = self.client.get(reverse('generationtask-list'), **self.auth_headers)
+            items = resp.data['results'] if isinstance(resp.data, dict) else resp.data
+            self.assertNotIn('result_image_base64', items[0])
+            self.assertTrue(items[0]['has_image'])
+            self.assertEqual(items[0]['image_size'], len(png))
+
+            # Детальный статус задачи не читает файл изображения без ?include=image
+            detail_url = reverse('generationtask-detail', args=[task.id])
+            with mock.patch.object(MediaGenerationTask, 'read_image', side_effect=AssertionError('image read')):
+                resp = self.client.get(detail_url, **self.auth_headers)
+            self.assertNotIn('result_image_base64', resp.data)
+            self.assertTrue(resp.data['has_image'])
+            self.assertEqual(resp.data['image_sha256'], task.image_sha256)
+            resp = self.client.get(f'{detail_url}?include=image', **self.auth_headers)
+            self.assertEqual(base64.b64decode(resp.data['result_image_base64']), png)
+
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(reverse('chat-generation-status', args=[chat.id]), **self.auth_headers)
+            self.assertEqual(resp.data['data']['task_id'], str(task.id))
+            self.assertTrue(resp.data['data']['has_image'])
+            task_queries = [q['sql'] for q in ctx.captured_queries if 'core_mediagenerationtask' in q['sql']]
+            self.assertEqual(len(task_queries), 1)
+            self.assertNotIn('prompt_text', task_queries[0])
+
+    def test_rate_limit_bucket_is_shared_through_database(self):
+        """Ожидаемый результат: токены расходуются из общего для процессов bucket"""
+        from .kandinsky_limiter import DatabaseTokenBucket, TokenBucket
+        first_process = DatabaseTokenBucket('pipeline_run', rate=1 / 60, capacity=2)
+        second_process = DatabaseTokenBucket('pipeline_run', rate=1 / 60, capacity=2)
+
+        self.assertEqual(first_process.try_acquire(), 0)
+        self.assertEqual(second_process.try_acquire(), 0)
+        self.assertGreater(first_process.try_acquire(), 50)
+
+        local = TokenBucket(rate=1 / 60, capacity=1)
+        self.assertEqual(local.try_acquire(), 0)
+        self.assertGreater(local.try_acquire(), 50)
+
+    def test_form_generation_returns_queued_task(self):
+        """Ожидаемый результат: форма сразу возвращает ID задачи в статусе PENDING"""
+        url = reverse('formgeneration-generate')
+        form_data = {
+            'idea': 'Театральная сцена',
+            'visual_style': 'неон',
+            'composition_focus': 'сцена',
+            'color_palette': 'тёплая',
+            'visual_associations': 'огни, свет',
+            'platform': 'VK',
+            'aspect_ratio': '16:9'
+        }
+        resp = self.client.post(url, form_data, format='json', **self.auth_headers)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.data['data']['status'], MediaGenerationTask.Status.PENDING)
+
+        task = MediaGenerationTask.objects.get(id=resp.data['data']['task_id'])
+        self.assertEqual((task.width, task.height), (1920, 1080))
+
+    def test_poller_checks_all_generations_in_one_pass(self):
+        """Ожидаемый результат: один проход поллера опрашивает все генерации и пишет их статусы"""
+        from .generation_queue import enqueue_generation_task
+        from .kandinsky_poller import KandinskyPoller
+
+        class FakeService:
+            statuses = {'uuid-1': 'PROCESSING', 'uuid-2': 'DONE'}
+
+            def fetch_generation_status(self, kandinsky_uuid):
+                status_value = self.statuses[kandinsky_uuid]
+                if status_value == 'DONE':
+                    return {'state': 'done', 'status': 'DONE', 'result': {'success': True, 'images_data': ['aW1n']}}
+                return {'state': 'pending', 'status': status_value}
+
+        first = enqueue_generation_task(self.user, self.prompt_history, 'Первый')
+        second = enqueue_generation_task(self.user, self.prompt_history, 'Второй')
+        finished = []
+        poller = KandinskyPoller(service=FakeService(), interval=60)
+        poller.track('uuid-1', first.id, lambda *args: finished.append(args))
+        poller.track('uuid-2', second.id, lambda *args: finished.append(args))
+
+        self.assertEqual(poller.poll_once(), 2)
+        self.assertEqual(poller.in_flight(), 1)
+        self.assertEqual(finished, [('uuid-2', {'success': True, 'images_data': ['aW1n']}, second.id)])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.kandinsky_status, 'PROCESSING')
+        self.assertEqual(second.kandinsky_status, 'DONE')
+        # До наступления интервала повторного опроса не происходит
+        self.assertEqual(poller.poll_once(), 0)
+
+    def test_task_events_stream_over_sse(self):
+        """Ожидаемый результат: поток задачи отдает её события и закрывается после финального"""
+        from asgiref.sync import async_to_sync
+        from .generation_queue import enqueue_generation_task, fail_task
+
+        async def read(resp):
+            return b''.join([chunk async for chunk in resp.streaming_content])
+
+        # События записываются после коммита транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            task = enqueue_generation_task(self.user, self.prompt_history, 'Промпт')
+            fail_task(task, 'API недоступен')
+        url = reverse('generationtask-events', args=[task.id])
+
+        resp = self.client.get(url, **self.auth_headers)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        body = async_to_sync(read)(resp).decode()
+        self.assertIn('event: queued', body)
+        self.assertIn('"error": "API недоступен"', body)
+        self.assertTrue(body.rstrip().endswith('}'))
+
+        # EventSource передает в URL одноразовый токен потока, а не JWT access токен
+        access_token = self.auth_headers['HTTP_AUTHORIZATION'].split()[1]
+        self.assertEqual(self.client.get(f'{url}?token={access_token}').status_code, 401)
+        token_url = reverse('generationtask-events-token', args=[task.id])
+        token = self.client.post(token_url, **self.auth_headers).data['data']['token']
+        last_id = task.events.get(event='queued').id
+        resp = self.client.get(f'{url}?token={token}', HTTP_LAST_EVENT_ID=str(last_id))
+        body = async_to_sync(read)(resp)
+        self.assertNotIn(b'event: queued', body)
+        self.assertIn(b'event: failed', body)
+        self.assertEqual(self.client.get(f'{url}?token={token}').status_code, 401)
+
+        # Токен открывает только свой поток
+        chat = Chat.objects.create(user=self.user, title='Чат')
+        token = self.client.post(token_url, **self.auth_headers).data['data']['token']
+        chat_url = reverse('chat-generation-events', args=[chat.id])
+        self.assertEqual(self.client.get(f'{chat_url}?token={token}').status_code, 401)
+
+        self.assertEqual(self.client.get(url).status_code, 401)
+        User.objects.create_user(email='stranger@gmail.com', password=self.password, fullName='Stranger')
+        stranger = get_auth_headers('stranger@gmail.com', self.password, self.client)
+        self.assertEqual(self.client.get(url, **stranger).status_code, 404)
+        self.assertEqual(self.client.post(token_url, **stranger).status_code, 404)
+
+    @override_settings(GENERATION_EVENTS_TOKEN_TTL=0)
+    def test_expired_stream_token_is_rejected(self):
+        """Ожидаемый результат: просроченный токен потока не открывает поток"""
+        task = MediaGenerationTask.objects.create(user=self.user, prompt_history=self.prompt_history, prompt_text='П')
+        token = self.client.post(reverse('generationtask-events-token', args=[task.id]), **self.auth_headers).data['data']['token']
+        url = reverse('generationtask-events', args=[task.id])
+        self.assertEqual(self.client.get(f'{url}?token={token}').status_code, 401)
+
+    def test_only_stream_routes_skip_jwt_middleware(self):
+        """Ожидаемый результат: без JWT пропускаются только два SSE-маршрута, а не любой путь на /events/"""
+        import uuid
+        from django.test import RequestFactory
+        from .middleware import JWTAuthenticationMiddleware
+        middleware = JWTAuthenticationMiddleware(lambda request: None)
+        factory = RequestFactory()
+        object_id = uuid.uuid4()
+
+        self.assertIsNone(middleware.process_request(factory.get(f'/api/generation-tasks/{object_id}/events/')))
+        self.assertIsNone(middleware.process_request(factory.get(f'/api/chats/{object_id}/generation-events/')))
+        for path in ['/api/messages/events/', f'/api/chats/{object_id}/events/',
+                     f'/api/generation-tasks/{object_id}/events/extra/events/']:
+            self.assertEqual(middleware.process_request(factory.get(path)).status_code, 401)
+
+    def test_event_hub_fans_out_one_read_to_all_subscribers(self):
+        """Ожидаемый результат: одно чтение новых событий доставляет их всем ждущим клиентам"""
+        import asyncio
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .generation_events import GenerationEventHub, publish
+        task = MediaGenerationTask.objects.create(user=self.user, prompt_history=self.prompt_history, prompt_text='П')
+        hub = GenerationEventHub(interval=3600)
+
+        def publish_committed():
+            with self.captureOnCommitCallbacks(execute=True):
+                publish(task, 'checking', attempt=1)
+
+        async def scenario():
+            queues = [await hub.subscribe(f'task:{task.id}') for _ in range(20)]
+            await sync_to_async(publish_committed)()
+            self.assertEqual(await hub.poll_once(), 1)
+            events = [queue.get_nowait() for queue in queues]
+            for queue in queues:
+                hub.unsubscribe(f'task:{task.id}', queue)
+            hub._runner.cancel()
+            return events
+
+        with CaptureQueriesContext(connection) as ctx:
+            events = async_to_sync(scenario)()
+        reads = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'core_generationevent' in q['sql']]
+        # Последний id при запуске хаба и одно чтение новых событий на всех подписчиков
+        self.assertEqual(len(reads), 2)
+        self.assertEqual({event['event'] for event in events}, {'checking'})
+        self.assertEqual(hub.subscribers(), 0)
+
+    def test_event_is_written_only_after_commit(self):
+        """Ожидаемый результат: событие из транзакции не получает id, пока транзакция не закоммичена"""
+        from django.db import transaction
+        from .generation_events import latest_event_id, publish
+        task = MediaGenerationTask.objects.create(user=self.user, prompt_history=self.prompt_history, prompt_text='П')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                publish(task, 'queued')
+                self.assertFalse(task.events.exists())
+            self.assertFalse(task.events.exists())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(task.events.values_list('id', flat=True)), [latest_event_id()])
+
+    @override_settings(GENERATION_SPECULATIVE_CANDIDATES=3, GENERATION_USER_DAILY_GENERATIONS=5)
+    def test_first_passing_candidate_wins_within_user_cap(self):
+        """Ожидаемый результат: попытка запускает несколько кандидатов, первый прошедший проверку завершает задачу"""
+        import tempfile
+        from unittest import mock
+        from .detection.photo_checker import photo_checker
+        from .generation_queue import GenerationWorker, enqueue_generation_task, kandinsky_service
+
+        class FakePoller:
+            def __init__(self):
+                self.tracked = []
+
+            def track(self, kandinsky_uuid, task_id, callback, **kwargs):
+                self.tracked.append(kandinsky_uuid)
+                self.callback = callback
+
+            def untrack(self, kandinsky_uuid):
+                self.tracked.remove(kandinsky_uuid)
+
+            def finish(self, kandinsky_uuid, result, task_id):
+                self.untrack(kandinsky_uuid)
+                self.callback(kandinsky_uuid, result, task_id)
+
+        submitted = []
+
+        def submit_generation(prompt, **kwargs):
+            submitted.append(prompt)
+            return {'success': True, 'uuid': f'uuid-{len(submitted)}'}
+
+        good = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\x02' * 32).decode()
+        patches = [
+            mock.patch.object(kandinsky_service, 'submit_generation', side_effect=submit_generation),
+            mock.patch.object(photo_checker, 'check_photo', side_effect=lambda image: {'passed': image == good}),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        poller = FakePoller()
+        worker = GenerationWorker(worker_id='worker-1', concurrency=1, poller=poller)
+        task = enqueue_generation_task(self.user, self.prompt_history, 'Портрет')
+        worker.run_once()
+        self.assertEqual(poller.tracked, ['uuid-1', 'uuid-2', 'uuid-3'])
+        self.assertEqual(submitted[0], 'Портрет')
+        self.assertNotEqual(submitted[1], submitted[0])
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            poller.finish('uuid-1', {'success': True, 'images_data': ['YmFk']}, task.id)
+            self.assertEqual(worker.run_once(), [])
+            poller.finish('uuid-3', {'success': True, 'images_data': [good]}, task.id)
+            finished = worker.run_once()
+
+        self.assertEqual([t.id for t in finished], [task.id])
+        task.refresh_from_db()
+        self.assertEqual(task.status, MediaGenerationTask.Status.SUCCESS)
+        self.assertEqual((task.attempts, task.generations), (1, 3))
+        self.assertEqual(task.prompt_text, submitted[2])
+        self.assertEqual(poller.tracked, [])
+
+        # Из дневного лимита в 5 генераций после основного кандидата осталась одна - кандидатов двое
+        enqueue_generation_task(self.user, self.prompt_history, 'Пейзаж')
+        worker.run_once()
+        self.assertEqual(len(poller.tracked), 2)
+
+class KandinskyClientTests(APITestCase):
+    def setUp(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import threading
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = json.dumps({'uuid': 'abc', 'status': 'PROCESSING'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_status_polls_reuse_keep_alive_connection(self):
+        """Ожидаемый результат: повторные запросы статуса идут через одно keep-alive соединение"""
+        from .kandinsky_service import KandinskyService
+        service = KandinskyService()
+        service.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+
+        for _ in range(5):
+            self.assertEqual(service.fetch_generation_status('abc')['state'], 'pending')
+
+        stats = service.connection_stats()[f'http://127.0.0.1:{self.server.server_port}']
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 4)
+
+    def test_pipeline_is_cached_until_invalidated(self):
+        """Ожидаемый результат: пайплайн запрашивается один раз, после сброса кеша - заново"""
+        from .kandinsky_service import KandinskyService
+        service = KandinskyService()
+        loads = []
+
+        def load_pipeline():
+            loads.append(1)
+            return f'pipeline-{len(loads)}'
+
+        service._load_pipeline = load_pipeline
+        self.assertEqual(service.get_pipeline(), 'pipeline-1')
+        self.assertEqual(service.get_pipeline(), 'pipeline-1')
+        self.assertEqual(len(loads), 1)
+
+        service.invalidate_pipeline()
+        self.assertEqual(service.get_pipeline(), 'pipeline-2')
+        self.assertEqual(len(loads), 2)
+
+    def test_stale_value_is_served_while_refreshing(self):
+        """Ожидаемый результат: устаревшее значение отдаётся сразу, а обновляется в фоне"""
+        import threading
+        from .kandinsky_service import CachedValue
+        cache = CachedValue('styles', ttl=0, stale_ttl=60)
+        refreshed = threading.Event()
+        values = iter([['DEFAULT'], ['DEFAULT', 'ANIME']])
+
+        def load_styles():
+            value = next(values)
+            if len(value) == 2:
+                refreshed.set()
+            return value
+
+        self.assertEqual(cache.get(load_styles), ['DEFAULT'])
+        self.assertEqual(cache.get(load_styles), ['DEFAULT'])
+        self.assertTrue(refreshed.wait(5))
+
+    def test_latency_profile_drives_initial_poll_delay(self):
+        """Ожидаемый результат: первая проверка - по медиане замеров, профиль переживает перезапуск"""
+        from .kandinsky_latency import LatencyTracker
+        tracker = LatencyTracker(window=10, min_samples=3, percentile=50)
+        for seconds in (12, 14, 30, 13, 15):
+            tracker.record(1024, 1024, seconds)
+        tracker.flush()
+
+        restarted = LatencyTracker(window=10, min_samples=3, percentile=50)
+        self.assertEqual(restarted.initial_delay(1024, 1024), 14)
+
+        schedule = restarted.schedule(1024, 1024)
+        schedule.jitter = 0
+        delays = [schedule.next_delay() for _ in range(8)]
+        self.assertEqual(delays[0], 14)
+        self.assertEqual(delays[1:4], [2, 3, 4.5])
+        self.assertEqual(max(delays[1:]), 15)
+
+    @override_settings(KANDINSKY_POLL_INITIAL_DELAY=0.1, KANDINSKY_POLL_BACKOFF_BASE=0.1)
+    def test_generation_against_fake_kandinsky_server(self):
+        """Ожидаемый результат: полный цикл генерации проходит через локальный fake-сервер"""
+        from PIL import Image
+        from .fake_kandinsky import FakeKandinskyServer
+        from .kandinsky_service import KandinskyService
+
+        server = FakeKandinskyServer(port=0, latency='fixed:0.3', censor_rate=1.0, seed=1).start()
+        self.addCleanup(server.stop)
+        service = KandinskyService()
+        service.base_url = server.base_url
+        service.styles_url = server.styles_url
+
+        result = service.generate_image('красивый закат над морем', width=640, height=384)
+        self.assertTrue(result['success'])
+        self.assertTrue(result['censored'])
+        image = Image.open(io.BytesIO(base64.b64decode(result['images_data'][0])))
+        self.assertEqual(image.size, (640, 384))
+
+        self.assertEqual(len(service.get_available_styles()), 4)
+        self.assertEqual(server.stats['pipelines'], 1)
+        self.assertGreaterEqual(server.stats['status'], 1)
+
+    @override_settings(KANDINSKY_MAX_RETRIES=0, KANDINSKY_BREAKER_FAILURES=2, KANDINSKY_BREAKER_RESET_TIMEOUT=0.2)
+    def test_circuit_breaker_fails_fast_and_recovers_through_probe(self):
+        """Ожидаемый результат: после ошибок подряд запросы отклоняются сразу, пробный запрос замыкает цепь"""
+        import socket
+        import time
+        from .fake_kandinsky import FakeKandinskyServer
+        from .kandinsky_service import KandinskyService, CircuitBreaker
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            dead_port = sock.getsockname()[1]
+        service = KandinskyService()
+        service.base_url = f'http://127.0.0.1:{dead_port}/'
+
+        service.fetch_generation_status('abc')
+        service.fetch_generation_status('abc')
+        self.assertEqual(service.breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(service.fetch_generation_status('abc')['circuit_open'])
+        self.assertTrue(service.submit_generation('промпт')['circuit_open'])
+
+        server = FakeKandinskyServer(port=0).start()
+        self.addCleanup(server.stop)
+        service.base_url = server.base_url
+        time.sleep(0.25)
+        self.assertEqual(service.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(service.probe())
+        self.assertEqual(service.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_deferred_tasks_resume_when_breaker_closes(self):
+        """Ожидаемый результат: отложенная задача возвращается в очередь только при доступном API"""
+        from .generation_queue import enqueue_generation_task, defer_task, resume_deferred_tasks
+        from .kandinsky_service import kandinsky_service
+        user = User.objects.create_user(email='breaker@gmail.com', password='StrongPass123', fullName='Breaker User')
+        history = PromptHistory.objects.create(user=user, assembled_prompt='Промпт')
+        task = defer_task(enqueue_generation_task(user, history, 'Промпт'), 'API недоступен')
+        self.assertEqual(task.status, MediaGenerationTask.Status.DEFERRED)
+
+        self.addCleanup(kandinsky_service.breaker.record_success)
+        for _ in range(kandinsky_service.breaker.failure_threshold):
+            kandinsky_service.breaker.record_failure()
+        self.assertEqual(resume_deferred_tasks(), 0)
+
+        kandinsky_service.breaker.record_success()
+        self.assertEqual(resume_deferred_tasks(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, MediaGenerationTask.Status.PENDING)
+
+    def test_breaker_opening_after_submit_keeps_the_running_generation(self):
+        """Ожидаемый результат: отложенная после отправки задача продолжает опрос той же генерации, а не запускает новую"""
+        import tempfile
+        from unittest import mock
+        from .generation_queue import enqueue_generation_task, run_generation_task
+        from .kandinsky_service import kandinsky_service
+        user = User.objects.create_user(email='resume@gmail.com', password='StrongPass123', fullName='Resume User')
+        history = PromptHistory.objects.create(user=user, assembled_prompt='Промпт')
+        task = enqueue_generation_task(user, history, 'Промпт', check_quality=False)
+        png = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64).decode()
+
+        submit = mock.patch.object(kandinsky_service, 'submit_generation', return_value={'success': True, 'uuid': 'run-1'})
+        wait = mock.patch.object(kandinsky_service, 'wait_for_generation', side_effect=[
+            {'success': False, 'circuit_open': True, 'error': 'API недоступен'},
+            {'success': True, 'images_data': [png]},
+        ])
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                submit as submitted, wait as waited:
+            task = run_generation_task(task)
+            self.assertEqual(task.status, MediaGenerationTask.Status.DEFERRED)
+            self.assertEqual((task.kandinsky_uuid, task.attempts), ('run-1', 1))
+
+            task = run_generation_task(MediaGenerationTask.objects.get(id=task.id))
+            self.assertEqual(task.status, MediaGenerationTask.Status.SUCCESS)
+            self.assertEqual(task.attempts, 1)
+            self.assertEqual(submitted.call_count, 1)
+            self.assertEqual([call.args[0] for call in waited.call_args_list], ['run-1', 'run-1'])
+
+    def test_rejected_submit_defers_without_spending_an_attempt(self):
+        """Ожидаемый результат: если отправку отклонил circuit breaker, попытка не засчитывается"""
+        from unittest import mock
+        from .generation_queue import enqueue_generation_task, run_generation_task
+        from .kandinsky_service import kandinsky_service
+        user = User.objects.create_user(email='rejected@gmail.com', password='StrongPass123', fullName='Rejected User')
+        history = PromptHistory.objects.create(user=user, assembled_prompt='Промпт')
+        task = enqueue_generation_task(user, history, 'Промпт', check_quality=False)
+
+        with mock.patch.object(kandinsky_service, 'submit_generation', return_value={
+            'success': False, 'circuit_open': True, 'error': 'API недоступен'
+        }):
+            task = run_generation_task(task)
+        self.assertEqual(task.status, MediaGenerationTask.Status.DEFERRED)
+        self.assertEqual((task.kandinsky_uuid, task.attempts, task.generations), ('', 0, 0))
+
+class FakeTensor:
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class RecordingYOLO:
+    """Подмена модели YOLO в тестах: запоминает входы и находит объекты в рамках boxes (по умолчанию ничего)"""
+
+    def __init__(self, boxes=(), points=17):
+        self.calls = []
+        self.boxes = boxes
+        self.points = points
+
+    def detections(self):
+        from types import SimpleNamespace
+        import numpy as np
+        found = []
+        for x1, y1, x2, y2 in self.boxes:
+            kps = np.stack([np.linspace(x1, x2, self.points), np.linspace(y1, y2, self.points)], axis=1)
+            found.append(SimpleNamespace(
+                keypoints=SimpleNamespace(xy=FakeTensor(kps[None].astype(np.float32)),
+                                          conf=FakeTensor(np.full((1, self.points), 0.9, dtype=np.float32))),
+                boxes=SimpleNamespace(xyxy=FakeTensor(np.array([[x1, y1, x2, y2]], dtype=np.float32))),
+            ))
+        return found
+
+    def __call__(self, source, **kwargs):
+        self.calls.append(source)
+        return [self.detections() for _ in source] if isinstance(source, list) else [self.detections()]
+
+
+class PhotoCheckerTests(APITestCase):
+    def setUp(self):
+        import cv2
+        import numpy as np
+        from unittest import mock
+        from .detection import detection
+        from .detection.cache import photo_check_cache
+        photo_check_cache.clear()
+        self.addCleanup(photo_check_cache.clear)
+        image = np.full((48, 64, 3), 200, dtype=np.uint8)
+        self.image_base64 = base64.b64encode(cv2.imencode('.png', image)[1].tobytes()).decode()
+        self.pose_model, self.hands_model = RecordingYOLO(), RecordingYOLO()
+        for name, model in (('pose_model', self.pose_model), ('hands_model', self.hands_model)):
+            patcher = mock.patch.object(detection, name, model)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_check_photo_decodes_once_in_memory(self):
+        """Ожидаемый результат: pose модель получает декодированный массив, временных файлов нет"""
+        import tempfile
+        from unittest import mock
+        from .detection.photo_checker import photo_checker
+
+        with mock.patch.object(tempfile, 'NamedTemporaryFile', side_effect=AssertionError('temp file')):
+            result = photo_checker.check_photo(self.image_base64)
+
+        self.assertTrue(result['passed'])
+        self.assertEqual(self.pose_model.calls[0][0].shape, (48, 64, 3))
+        # Людей нет - hands модель не нужна
+        self.assertEqual(self.hands_model.calls, [])
+
+    def test_broken_image_fails_check(self):
+        """Ожидаемый результат: битые байты дают неуспешную проверку без вызова моделей"""
+        from .detection.photo_checker import photo_checker
+        result = photo_checker.check_photo(base64.b64encode(b'not an image').decode())
+        self.assertFalse(result['passed'])
+        self.assertEqual(self.pose_model.calls, [])
+
+    def test_check_photos_runs_models_once_per_batch(self):
+        """Ожидаемый результат: несколько изображений проходят pose модель одним вызовом"""
+        from .detection.photo_checker import photo_checker
+        broken = base64.b64encode(b'not an image').decode()
+
+        results = photo_checker.check_photos([self.image_base64, broken, self.image_base64])
+
+        self.assertEqual([r['passed'] for r in results], [True, False, True])
+        self.assertFalse(results[1]['success'])
+        self.assertEqual(len(self.pose_model.calls), 1)
+        self.assertEqual(len(self.pose_model.calls[0]), 2)
+        self.assertEqual(self.hands_model.calls, [])
+
+    def test_detection_service_checks_photos_and_rejects_when_busy(self):
+        """Ожидаемый результат: проверка идет через сервис детекции, переполненный сервис отвечает отказом"""
+        from .detection.photo_checker import photo_checker
+        from .detection.cache import photo_check_cache
+        from .detection.service import DetectionServer
+        server = DetectionServer(address=('127.0.0.1', 0), processes=0, max_pending=1,
+                                 queue_timeout=0, authkey=b'test').start()
+        self.addCleanup(server.stop)
+        host, port = server.address
+
+        with override_settings(DETECTION_SERVICE_ADDRESS=f'{host}:{port}', DETECTION_SERVICE_AUTHKEY='test'):
+            results = photo_checker.check_photos([self.image_base64, self.image_base64])
+            self.assertEqual([r['passed'] for r in results], [True, True])
+            self.assertEqual(len(self.pose_model.calls[-1]), 2)
+
+            photo_check_cache.clear()
+            server._slots.acquire()
+            result = photo_checker.check_photo(self.image_base64)
+            server._slots.release()
+
+        self.assertFalse(result['success'])
+        self.assertEqual(server.stats['busy'], 1)
+
+    def test_large_image_is_downscaled_and_keypoints_mapped_back(self):
+        """Ожидаемый результат: модель получает уменьшенный кадр, keypoints возвращаются в исходные координаты"""
+        import cv2
+        import numpy as np
+        from .detection.detection import evaluate_pose, prepare_image, rescale_keypoints, input_size
+        image = np.zeros((1800, 1200, 3), dtype=np.uint8)
+
+        evaluate_pose(cv2.imencode('.png', image)[1].tobytes())
+        self.assertEqual(self.pose_model.calls[0][0].shape[:2], (input_size(), round(1200 * input_size() / 1800)))
+        # Размер входа берется из settings в момент проверки
+        with override_settings(DETECTION_INPUT_SIZE=320):
+            evaluate_pose(image)
+        self.assertEqual(self.pose_model.calls[1][0].shape[:2], (320, 213))
+
+        resized, scale = prepare_image(image)
+        point = np.array([[resized.shape[1] / 2, resized.shape[0] / 4]], dtype=np.float32)
+        mapped = rescale_keypoints([{"kps": point, "conf": np.ones(1)}], scale)[0]["kps"]
+        np.testing.assert_allclose(mapped, [[600, 450]], rtol=1e-3)
+
+    def test_hands_model_runs_only_on_person_crops(self):
+        """Ожидаемый результат: hands модель получает рамку человека, руки возвращаются в координаты кадра"""
+        import numpy as np
+        from .detection import detection
+        self.pose_model.boxes = [(100, 100, 300, 500)]
+        self.hands_model.boxes = [(10, 20, 40, 60)]
+        self.hands_model.points = 21
+
+        people, hands, timings = detection.run_stages([np.zeros((640, 480, 3), dtype=np.uint8)], plan="crops")
+
+        self.assertEqual(len(self.hands_model.calls), 1)
+        self.assertEqual(self.hands_model.calls[0][0].shape, (520, 260, 3))
+        np.testing.assert_allclose(hands[0][0]["box"], [80, 60, 110, 100])
+        self.assertEqual(set(timings), {"pose", "hands"})
+        self.assertIn("timings", detection.evaluate_pose(np.zeros((640, 480, 3), dtype=np.uint8)))
+
+    def test_person_crops_are_cut_from_full_resolution_image(self):
+        """Ожидаемый результат: pose модель видит уменьшенный кадр, а hands модель - рамку из исходного"""
+        import numpy as np
+        from .detection import detection
+        self.pose_model.boxes = [(100, 100, 300, 500)]
+        self.hands_model.boxes = [(10, 20, 40, 60)]
+        self.hands_model.points = 21
+        original = np.zeros((1280, 960, 3), dtype=np.uint8)
+        image, _ = detection.prepare_image(original, size=640)
+
+        people, hands, _ = detection.run_stages([image], plan="crops", originals=[original])
+
+        self.assertEqual(self.pose_model.calls[0][0].shape, (640, 480, 3))
+        self.assertEqual(self.hands_model.calls[0][0].shape, (1040, 520, 3))
+        np.testing.assert_allclose(people[0][0]["box"], [200, 200, 600, 1000])
+        np.testing.assert_allclose(hands[0][0]["box"], [150, 100, 180, 140])
+
+        with override_settings(DETECTION_INPUT_SIZE=640):
+            detection.evaluate_pose(original)
+        self.assertEqual(self.hands_model.calls[1][0].shape, (1040, 520, 3))
+
+    def test_pose_and_hand_checks_on_known_poses(self):
+        """Ожидаемый результат: проверки поз и рук дают известные вердикты на заданных позах"""
+        import numpy as np
+        from .detection import detection as d
+        skeleton = np.array([
+            (0, -60), (-5, -65), (5, -65), (-10, -62), (10, -62), (-20, -40), (20, -40), (-30, -10), (30, -10),
+            (-45, 10), (45, 10), (-15, 30), (15, 30), (-15, 70), (15, 70), (-15, 110), (15, 110),
+        ], dtype=np.float32)
+        kps = np.repeat(skeleton[None], 5, axis=0)
+        kps[1, 9] = kps[1, 7]          # нулевое левое предплечье
+        kps[2, 9] = (-40, 20)          # левая рука выпрямлена (180 градусов в локте)
+        kps[3, 15] = (-15, 300)        # левая нога втрое длиннее правой
+        kps[4, 8] = kps[4, 6]          # нулевое правое плечо
+
+        def pairs(ok, degenerate):
+            return [(bool(o), bool(dg)) for o, dg in zip(ok, degenerate)]
+
+        self.assertEqual(pairs(*d.limb_length_check_batch(kps)),
+                         [(True, False), (False, True), (True, False), (True, False), (False, False)])
+        self.assertEqual([bool(v) for v in d.elbow_angle_ok_batch(kps)], [True, True, False, True, True])
+        self.assertEqual(pairs(*d.symmetry_check_batch(kps)),
+                         [(True, False), (False, False), (True, False), (False, False), (False, True)])
+
+        conf = np.full((3, 17), 0.9, dtype=np.float32)
+        conf[1, 9] = 0.1               # лицо видно, левого запястья нет
+        conf[2] = 0.1                  # лица не видно - конечности не требуются
+        self.assertEqual([bool(v) for v in d.has_all_limbs_batch(conf)], [True, False, True])
+
+        # Рука веером: пальцы - прямые лучи от запястья, кончики далеко друг от друга
+        directions = np.radians([30, 60, 90, 120, 150])
+        fingers = np.stack([np.cos(directions), np.sin(directions)], axis=1)[:, None, :] * np.array([10, 20, 30, 40])[None, :, None]
+        hand = np.concatenate([np.zeros((1, 2)), fingers.reshape(20, 2)]).astype(np.float32)
+        hands = np.repeat(hand[None], 4, axis=0)
+        hands[1, 8] = hands[1, 12]     # слипшиеся кончики указательного и среднего
+        hands[2, 3] = hands[2, 1]      # сломанный сустав большого пальца
+        hands[3, 8] = hands[3, 12]     # слипшиеся, но рука найдена неуверенно
+        hand_conf = np.full((4, 21), 0.9, dtype=np.float32)
+        hand_conf[3] = 0.1
+        self.assertEqual([bool(v) for v in d.hands_ok_batch(hands, hand_conf)], [True, False, False, True])
+
+    def test_people_are_scored_with_their_own_hands_by_policy(self):
+        """Ожидаемый результат: каждый человек оценивается со своими руками, итог зависит от политики"""
+        import numpy as np
+        from .detection.detection import score_detections
+        skeleton = np.array([
+            (0, -60), (-5, -65), (5, -65), (-10, -62), (10, -62), (-20, -40), (20, -40), (-30, -10), (30, -10),
+            (-45, 10), (45, 10), (-15, 30), (15, 30), (-15, 70), (15, 70), (-15, 110), (15, 110),
+        ], dtype=np.float32)
+
+        def person(center, scale, broken_forearm=False):
+            kps = skeleton * scale + np.array(center, dtype=np.float32)
+            if broken_forearm:
+                kps[9] = kps[7]
+            return {"kps": kps, "conf": np.full(17, 0.9, dtype=np.float32), "box": None}
+
+        big = person((200, 200), 2)
+        small = person((500, 200), 1, broken_forearm=True)
+        fused_hand = {"kps": np.repeat(small["kps"][9][None], 21, axis=0), "conf": np.full(21, 0.9, dtype=np.float32)}
+
+        scores = {policy: score_detections([big, small], [fused_hand], policy)
+                  for policy in ('first', 'worst', 'largest', 'area_weighted')}
+
+        # first: оценивается только первый человек, но с чужой деформированной рукой
+        self.assertEqual(scores['first']['score'], 1)
+        self.assertEqual((scores['worst']['person'], scores['worst']['score']), (1, 0))
+        self.assertIs(scores['worst']['checks']['руки_нормальные'], False)
+        self.assertEqual((scores['largest']['person'], scores['largest']['score']), (0, 3))
+        self.assertEqual(scores['area_weighted']['score'], 2)
+
+    def test_parity_report_flags_runtime_drift(self):
+        """Ожидаемый результат: сравнение форматов моделей ловит расхождение keypoints и числа объектов"""
+        import numpy as np
+        from .detection.export import compare_outputs, new_report, parity_passed
+        rng = np.random.default_rng(3)
+
+        def item():
+            kps = rng.uniform(100, 300, size=(17, 2)).astype(np.float32)
+            return {"kps": kps, "conf": np.full(17, 0.9, dtype=np.float32), "box": None}
+
+        people = [item()]
+        close = [{**people[0], "kps": people[0]["kps"] + 0.5}]
+        far = [{**people[0], "kps": people[0]["kps"] + 12}]
+
+        report = compare_outputs(new_report(), (people, []), (close, []))
+        self.assertTrue(parity_passed(report))
+        self.assertAlmostEqual(report['keypoint_errors'][0], 0.5 * np.sqrt(2), places=4)
+
+        self.assertFalse(parity_passed(compare_outputs(new_report(), (people, []), (far, []))))
+        self.assertFalse(parity_passed(compare_outputs(new_report(), (people, []), (people + [item()], []))))
+
+    def test_repeated_image_is_served_from_cache(self):
+        """Ожидаемый результат: повторная проверка тех же байтов не запускает модели, результат сохраняется в БД"""
+        from .detection.cache import photo_check_cache
+        from .detection.photo_checker import photo_checker
+        from .models import PhotoCheckResult
+
+        with override_settings(PHOTO_CHECK_CACHE_PERSISTENT=True):
+            first = photo_checker.check_photo(self.image_base64)
+            second = photo_checker.check_photo(self.image_base64)
+            self.assertEqual(first, second)
+            self.assertEqual(len(self.pose_model.calls), 1)
+
+            # Другой процесс: память пуста, результат берется из таблицы
+            photo_check_cache.clear()
+            self.assertEqual(photo_checker.check_photos([self.image_base64])[0], first)
+            self.assertEqual(len(self.pose_model.calls), 1)
+
+            # Настройки, влияющие на вердикт, входят в версию детектора
+            for name, value in (('DETECTION_INPUT_SIZE', 320), ('DETECTION_MIN_PERSON_AREA', 0.5), ('DETECTION_CROP_MARGIN', 0.3)):
+                with self.subTest(setting=name), override_settings(**{name: value}):
+                    calls = len(self.pose_model.calls)
+                    photo_checker.check_photo(self.image_base64)
+                    self.assertEqual(len(self.pose_model.calls), calls + 1)
+
+        self.assertEqual(PhotoCheckResult.objects.count(), 4)
+
+    def test_cached_checks_match_fresh_checks(self):
+        """Ожидаемый результат: свежий результат и результат из БД дают одинаковые checks и промпт исправления"""
+        import numpy as np
+        from .detection.cache import PhotoCheckCache
+        from .detection.photo_checker import photo_checker
+        cache = PhotoCheckCache(persistent=True)
+        # Оценка посчитана до приведения типов: np.False_ в ней не учитывался
+        evaluation = {"score": 2, "reason": "все проверки пройдены",
+                      "checks": {"наличие_конечностей": True, "углы": np.False_, "руки_нормальные": True}}
+
+        fresh = cache.set('sha:v', evaluation)
+        cache.clear()
+        stored = cache.get('sha:v')
+
+        self.assertEqual(fresh, stored)
+        self.assertEqual(fresh['score'], 2)
+        self.assertIs(stored['checks']['углы'], False)
+        self.assertEqual(photo_checker.generate_fix_prompt('Промпт', photo_checker.build_result(fresh)),
+                         photo_checker.generate_fix_prompt('Промпт', photo_checker.build_result(stored)))
+
+    def test_importing_views_does_not_load_detection_models(self):
+        """Ожидаемый результат: import core.views не импортирует torch, ultralytics и модуль детекции"""
+        import subprocess
+        import sys
+        code = (
+            "import sys, django; django.setup(); import core.views; "
+            "print(sorted(m for m in ('torch', 'ultralytics', 'core.detection.detection') if m in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True, env=os.environ.copy()
+        ).stdout
+        self.assertEqual(output.strip().splitlines()[-1], '[]')
+
 class SecurityValidationTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -497,16 +1497,16 @@ class CompleteFlowTest(APITestCase):
                 
                 # ДИАГНОСТИКА: проверим все поля задачи
                 print(f"🔍 ДИАГНОСТИКА ЗАДАЧИ:")
-                print(f"   result_image_base64: {'ЕСТЬ' if task.result_image_base64 else 'ПУСТО'}")
+                print(f"   image_key: {task.image_key or 'ПУСТО'}")
                 print(f"   result_url: {task.result_url}")
                 print(f"   last_error: {task.last_error}")
                 print(f"   attempts: {task.attempts}")
                 
-                if task.result_image_base64:
-                    print("✅ Изображение найдено в базе данных")
+                if task.has_image:
+                    print("✅ Изображение найдено в хранилище")
                     # Сохраняем с дополнительной диагностикой
                     self.save_test_image_with_diagnostics(
-                        task.result_image_base64, 
+                        base64.b64encode(task.read_image()).decode('ascii'), 
                         prompt_history.assembled_prompt, 
                         str(task.id)
                     )
@@ -4,7 +4,8 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UserViewSet, ChatViewSet, MessageViewSet, CustomTokenObtainPairView,
     PromptTemplateViewSet, PromptParametersViewSet, PromptActionsViewSet,
-    MediaGenerationTaskViewSet, FormGenerationViewSet
+    MediaGenerationTaskViewSet, FormGenerationViewSet,
+    generation_task_events, chat_generation_events
 )
 
 router = DefaultRouter()
@@ -18,6 +19,9 @@ router.register(r"generation-tasks", MediaGenerationTaskViewSet, basename="gener
 router.register(r"form-generation", FormGenerationViewSet, basename="formgeneration")
 
 urlpatterns = [
+    # SSE-потоки событий генерации (асинхронные представления, нужен ASGI сервер)
+    path("generation-tasks/<uuid:pk>/events/", generation_task_events, name="generationtask-events"),
+    path("chats/<uuid:pk>/generation-events/", chat_generation_events, name="chat-generation-events"),
     path("", include(router.urls)),
     path("auth/login/", CustomTokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("auth/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
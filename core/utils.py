@@ -3,9 +3,8 @@ import json
 from django.core.serializers.json import DjangoJSONEncoder
 from .models import Message, Chat, PromptParameters, PromptHistory, MessageType
 from string import Formatter
-from .kandinsky_service import kandinsky_service
 from .models import Message, MediaGenerationTask
-from .detection.photo_checker import photo_checker
+from .generation_queue import enqueue_generation_task
 
 QUESTIONS_FLOW = [
     #("content_type", "Что нужно создать — фото или видео? (content_type)", False),
@@ -28,6 +27,14 @@ QUESTIONS_FLOW = [
 
 FLOW_KEYS = [k for k, _, _ in QUESTIONS_FLOW]
 
+
+class FlowStepConflict(Exception):
+    """Ответ не относится к текущему шагу flow (устаревший flow_step или повторная отправка)"""
+
+    def __init__(self, message, flow_step):
+        super().__init__(message)
+        self.flow_step = flow_step
+
 class CustomJSONEncoder(DjangoJSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -131,25 +138,66 @@ def next_question_for_chat(chat: Chat):
         return key, text, optional
     return None, None, None
 
-def build_parameters_from_chat_messages(chat: Chat) -> dict:
+def build_parameters_from_flow(chat: Chat) -> dict:
     """
-    Собирает параметры из сообщений чата
+    Собирает параметры из ответов flow, сохраненных в чате (без чтения сообщений)
     """
-    user_msgs = list(chat.messages.filter(messageType=MessageType.USER).order_by("createdAt"))
+    answers = chat.flow_answers or {}
     params = {}
     
-    for idx, (key, _, optional) in enumerate(QUESTIONS_FLOW):
-        if idx < len(user_msgs):
-            content_value = extract_text_from_content(user_msgs[idx].content)
-            
-            if content_value and content_value != "None":
-                params[key] = content_value
-        elif not optional:
+    for key, _, optional in QUESTIONS_FLOW:
+        content_value = answers.get(key)
+        if content_value and content_value != "None":
+            params[key] = content_value
+        elif not optional and key not in answers:
             # Для обязательных полей без ответа ставим пустую строку
             params[key] = ""
     
     return params
 
+def record_flow_answer(chat: Chat, message: Message, expected_step=None):
+    """
+    Сохраняет ответ на текущий вопрос в flow_answers и переходит к следующему шагу.
+    Ответ и flow_step пишутся одним UPDATE под блокировкой строки чата,
+    поэтому два одновременных сообщения не ответят на один и тот же шаг.
+    expected_step - шаг, на который отвечает клиент: при расхождении (вопрос
+    уже отвечен) поднимается FlowStepConflict. Без него повтор предыдущего ответа
+    в течение FLOW_DUPLICATE_ANSWER_WINDOW_SECONDS тоже считается дублем.
+    Возвращает номер шага, на который ответило сообщение, или None,
+    если flow уже завершен (шаг не меняется).
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from django.utils import timezone
+    
+    answer = extract_text_from_content(message.content)
+    with transaction.atomic():
+        current = Chat.objects.select_for_update().only("flow_step", "flow_answers", "updatedAt").get(pk=chat.pk)
+        step = current.flow_step or 0
+        chat.flow_step = step
+        chat.flow_answers = current.flow_answers
+        
+        if expected_step is not None:
+            if expected_step != step:
+                raise FlowStepConflict("Ответ на этот вопрос уже принят", step)
+        elif 0 < step <= len(QUESTIONS_FLOW):
+            window = getattr(settings, 'FLOW_DUPLICATE_ANSWER_WINDOW_SECONDS', 5)
+            previous = (current.flow_answers or {}).get(QUESTIONS_FLOW[step - 1][0])
+            if previous == answer and timezone.now() - current.updatedAt < timedelta(seconds=window):
+                raise FlowStepConflict("Такой же ответ только что принят", step)
+        
+        if step >= len(QUESTIONS_FLOW):
+            return None
+        
+        answers = dict(current.flow_answers or {})
+        answers[QUESTIONS_FLOW[step][0]] = answer
+        
+        chat.flow_step = step + 1
+        chat.flow_answers = answers
+        chat.updatedAt = timezone.now()
+        chat.save(update_fields=["flow_step", "flow_answers", "updatedAt"])
+    return step
+
 def assemble_optimized_prompt(parameters: dict) -> str:
     # Очищаем параметры от JSON структур
     clean_params = {}
@@ -263,94 +311,57 @@ def optimize_prompt_for_kandinsky(prompt_text, max_length=800):
     return optimized
 
 def complete_chat_and_generate(chat, prompt_history):
+    """
+    Ставит генерацию изображения для завершенного чата в очередь.
+    Результат (ссылки и IMAGE сообщение) воркер добавит в чат после генерации.
+    """
     # Получаем параметры для определения aspect ratio
-    parameters = build_parameters_from_chat_messages(chat)
+    parameters = build_parameters_from_flow(chat)
     aspect_ratio = parameters.get('aspect_ratio', '1:1')
     
     # Рассчитываем размеры
     width, height = calculate_dimensions(aspect_ratio)
+    
+    task = enqueue_generation_task(
+        user=chat.user,
+        prompt_history=prompt_history,
+        prompt_text=prompt_history.assembled_prompt,
+        chat=chat,
+        width=width,
+        height=height,
+        check_quality=True,
+        max_attempts=3
+    )
         
     # Отправляем системное сообщение с информацией о размерах
     import json
-    Message.objects.create(
+    sys_msg = Message.objects.create(
         chat=chat,
         content=json.dumps({
             "type": "text",
-            "info": f"🎨 Запускаю генерацию изображения ({width}x{height}) с автоматической проверкой качества..."
+            "info": f"🎨 Генерация изображения ({width}x{height}) с автоматической проверкой качества поставлена в очередь..."
         }, ensure_ascii=False),
         messageType=MessageType.SYSTEM
     )
     
-    # Используем новую функцию с проверкой
-    generation_result = check_and_regenerate_image(
-        chat=chat,
-        prompt_history=prompt_history,
-        original_prompt=prompt_history.assembled_prompt,
-        width=width,
-        height=height,
-        max_retries=3
-    )
-    
-    if generation_result["success"]:
-        task = generation_result["task"]
-        
-        # ✅ ОБНОВЛЕНО: Сообщение со ссылками для скачивания
-        base_url = "http://localhost:8000"  # В реальном коде должен быть из настроек
-        download_url = f"{base_url}/api/generation-tasks/{task.id}/download/"
-        preview_url = f"{base_url}/api/generation-tasks/{task.id}/image-file/"
-        
-        attempts_info = ""
-        regeneration_attempts = max(0, generation_result.get("attempts", 1) - 1)
-        if regeneration_attempts > 0:
-            attempts_info = f" (перегенераций: {regeneration_attempts})"
-        
-        preview_msg = f"✅ Генерация завершена{attempts_info}!\n\n"
-        preview_msg += f"📥 Скачайте фото по ссылке:\n{download_url}\n\n"
-        preview_msg += f"👀 Или просмотрите:\n{preview_url}"
-        
-        Message.objects.create(
-            chat=chat,
-            content=json.dumps({
-                "type": "text",
-                "info": preview_msg
-            }, ensure_ascii=False),
-            messageType=MessageType.SYSTEM
-        )
-       
-        return {
-            "success": True,
-            "task_id": task.id,
-            "attempts": generation_result["attempts"],
-            "regeneration_attempts": regeneration_attempts,  # ⬅️ добавляем перегенерации
-            "problems": generation_result.get("problems", [])
-        }
-    else:
-        return {
-            "success": False,
-            "error": generation_result.get("error", "Unknown error"),
-            "attempts": generation_result.get("attempts", 0),
-            "regeneration_attempts": max(0, generation_result.get("attempts", 0) - 1)
-        }
+    return {
+        "success": True,
+        "task_id": task.id,
+        "status": task.status,
+        "message": sys_msg
+    }
 
 
-def handle_user_message_and_advance(chat: Chat, message: Message):
+def handle_user_message_and_advance(chat: Chat, message: Message, expected_step=None):
     """
     Обработчик пользовательского сообщения с автоматической генерацией после завершения
     """
-    from django.utils import timezone
-    
-    # Получаем оригинальный текст из content
-    try:
-        import json
-        content_data = json.loads(message.content)
-        original_text = content_data.get('info', content_data.get('content', ''))
-    except (json.JSONDecodeError, TypeError):
-        original_text = message.content
-    
-    # Увеличиваем шаг
-    chat.flow_step = (chat.flow_step or 0) + 1
-    chat.updatedAt = timezone.now()
-    chat.save(update_fields=["flow_step", "updatedAt"])
+    # Сохраняем ответ и увеличиваем шаг
+    step = record_flow_answer(chat, message, expected_step)
+    if step is None:
+        # Flow уже завершен (например, параллельный дубль последнего ответа):
+        # сообщение сохранено, но вторая генерация не запускается
+        return {"type": "message"}
 
     # Проверяем, есть ли следующий вопрос
     next_key, next_text, optional = next_question_for_chat(chat)
@@ -366,15 +377,8 @@ def handle_user_message_and_advance(chat: Chat, message: Message):
         )
         return {"type": "question", "message": sys_msg}
 
-    # Flow завершён — собираем параметры
-    params = build_parameters_from_chat_messages(chat)
-    
-    # ВОТ ОСНОВНАЯ ПРОБЛЕМА - обновляем последний параметр
-    # Нужно добавить последний ответ пользователя в params
-    step = (chat.flow_step or 0) - 1
-    if step < len(QUESTIONS_FLOW):
-        key = QUESTIONS_FLOW[step][0]
-        params[key] = original_text
+    # Flow завершён — параметры уже собраны в chat.flow_answers
+    params = build_parameters_from_flow(chat)
     
     # Сохраняем параметры
     pp = PromptParameters.objects.create(
@@ -543,247 +547,6 @@ def paraphrase_prompt(prompt_text):
     return prompt_text + paraphrases[index]
 
 
-def check_and_regenerate_image(chat, prompt_history, original_prompt, width=1024, height=1024, max_retries=3):
-    """
-    Проверяет сгенерированное фото и при необходимости перегенерирует
-    Сохраняет только задачи со статусом SUCCESS
-    """
-    attempts = 0
-    problems_history = []
-    
-    while attempts < max_retries:
-        attempts += 1
-        
-        current_prompt = original_prompt if attempts == 1 else prompt_history.assembled_prompt
-        
-        # Генерируем изображение
-        generation_result = kandinsky_service.generate_image(
-            prompt=current_prompt,
-            width=width,
-            height=height,
-            style="DEFAULT",
-            negative_prompt="низкое качество, размытое, watermark, deformed, distorted, bad anatomy, extra fingers, missing fingers"
-        )
-        
-        if not generation_result["success"]:
-            continue
-        
-        images_data = generation_result.get("images_data", [])
-        if not images_data:
-            continue
-        
-        image_base64 = images_data[0]
-        
-        # Проверяем фото
-        check_result = photo_checker.check_photo(image_base64)
-        
-        if check_result["passed"]:
-            # Фото прошло проверку - сохраняем в БД
-            task = MediaGenerationTask.objects.create(
-                user=chat.user,
-                chat=chat,
-                prompt_history=prompt_history,
-                prompt_text=current_prompt,
-                status=MediaGenerationTask.Status.SUCCESS,
-                result_image_base64=image_base64,
-                attempts=attempts
-            )
-            
-            # Удаляем все FAILED задачи для этого чата и промпта
-            MediaGenerationTask.objects.filter(
-                chat=chat,
-                prompt_history=prompt_history,
-                status=MediaGenerationTask.Status.FAILED
-            ).delete()
-            
-            return {
-                "success": True,
-                "task": task,
-                "attempts": attempts,
-                "regeneration_attempts": attempts - 1,
-                "problems": problems_history,
-                "image_base64": image_base64
-            }
-        else:
-            # Фото не прошло проверку - не сохраняем в БД
-            reason = check_result.get('reason', 'проверка не пройдена')
-            problems_history.append(f"попытка {attempts}: {reason}")
-            
-            # Генерируем исправленный промпт
-            fix_prompt, problems_text = photo_checker.generate_fix_prompt(
-                current_prompt,
-                check_result
-            )
-            
-            # Создаем новую историю промпта с исправлениями
-            prompt_history = PromptHistory.objects.create(
-                user=chat.user,
-                prompt_template=prompt_history.prompt_template,
-                parameters=prompt_history.parameters,
-                assembled_prompt=fix_prompt
-            )
-    
-    # Все попытки исчерпаны
-    return {
-        "success": False,
-        "attempts": attempts,
-        "regeneration_attempts": max(0, attempts - 1),
-        "problems": problems_history,
-        "error": "Превышено количество попыток перегенерации"
-    }
-
-def generate_image_with_quality_check(user, prompt_history, prompt_text, width=1024, height=1024, max_retries=3):
-    """
-    Генерация изображения с проверкой качества
-    (похожа на check_and_regenerate_image, но для формы)
-    """
-    attempts = 0
-    problems_history = []
-    current_prompt = prompt_text
-    
-    while attempts < max_retries:
-        attempts += 1
-        
-        # Создаем задачу генерации (без привязки к чату)
-        task = MediaGenerationTask.objects.create(
-            user=user,
-            chat=None,
-            prompt_history=prompt_history,
-            prompt_text=current_prompt,
-            status=MediaGenerationTask.Status.PENDING
-        )
-        
-        # Генерируем изображение
-        generation_result = kandinsky_service.generate_image(
-            prompt=current_prompt,
-            width=width,
-            height=height,
-            style="DEFAULT",
-            negative_prompt="низкое качество, размытое, watermark, deformed, distorted, bad anatomy, extra fingers, missing fingers"
-        )
-        
-        if not generation_result["success"]:
-            task.status = MediaGenerationTask.Status.FAILED
-            task.last_error = generation_result["error"]
-            task.save()
-            continue
-        
-        # Получаем сгенерированное изображение
-        images_data = generation_result.get("images_data", [])
-        if not images_data:
-            task.status = MediaGenerationTask.Status.FAILED
-            task.last_error = "Нет данных изображения"
-            task.save()
-            continue
-        
-        image_base64 = images_data[0]
-        
-        # Проверяем фото если включена проверка
-        check_result = photo_checker.check_photo(image_base64)
-        
-        if check_result["passed"]:
-            # Фото прошло проверку
-            task.status = MediaGenerationTask.Status.SUCCESS
-            task.result_image_base64 = image_base64
-            task.attempts = attempts
-            task.save()
-            
-            return {
-                "success": True,
-                "task_id": task.id,
-                "status": "SUCCESS",
-                "attempts": attempts,
-                "regeneration_attempts": attempts - 1,
-                "problems": problems_history,
-                "image_base64": image_base64
-            }
-        else:
-            # Фото не прошло проверку
-            task.status = MediaGenerationTask.Status.FAILED
-            task.last_error = f"Проверка не пройдена: {check_result.get('reason', '')}"
-            task.save()
-            
-            # Генерируем исправленный промпт
-            fix_prompt, problems_text = photo_checker.generate_fix_prompt(
-                current_prompt,
-                check_result
-            )
-            
-            problems_history.append(f"попытка {attempts}: {problems_text}")
-            current_prompt = fix_prompt
-            
-            # Создаем новую историю промпта с исправлениями
-            prompt_history = PromptHistory.objects.create(
-                user=user,
-                prompt_template=prompt_history.prompt_template,
-                parameters=prompt_history.parameters,
-                assembled_prompt=current_prompt
-            )
-    
-    # Все попытки исчерпаны
-    return {
-        "success": False,
-        "task_id": None,
-        "status": "FAILED",
-        "attempts": attempts,
-        "regeneration_attempts": max(0, attempts - 1),
-        "problems": problems_history,
-        "error": "Превышено количество попыток перегенерации"
-    }
-
-def generate_image_without_check(user, prompt_history, prompt_text, width=1024, height=1024):
-    """
-    Генерация изображения без проверки качества
-    """
-    # Создаем задачу генерации
-    task = MediaGenerationTask.objects.create(
-        user=user,
-        chat=None,
-        prompt_history=prompt_history,
-        prompt_text=prompt_text,
-        status=MediaGenerationTask.Status.PENDING
-    )
-    
-    # Генерируем изображение
-    generation_result = kandinsky_service.generate_image(
-        prompt=prompt_text,
-        width=width,
-        height=height,
-        style="DEFAULT",
-        negative_prompt="низкое качество, размытое, watermark"
-    )
-    
-    if generation_result["success"]:
-        images_data = generation_result.get("images_data", [])
-        if images_data:
-            task.status = MediaGenerationTask.Status.SUCCESS
-            task.result_image_base64 = images_data[0]
-            task.attempts = 1
-            task.save()
-            
-            return {
-                "success": True,
-                "task_id": task.id,
-                "status": "SUCCESS",
-                "attempts": 1,
-                "regeneration_attempts": 0,
-                "image_base64": images_data[0]
-            }
-    
-    # Ошибка генерации
-    task.status = MediaGenerationTask.Status.FAILED
-    task.last_error = generation_result.get("error", "Неизвестная ошибка")
-    task.save()
-    
-    return {
-        "success": False,
-        "task_id": task.id,
-        "status": "FAILED",
-        "attempts": 1,
-        "regeneration_attempts": 0,
-        "error": generation_result.get("error", "Неизвестная ошибка")
-    }
-
 def extract_text_from_content(content_str):
     """
     Извлекает текст из content (поддерживает оба формата)
@@ -11,19 +11,20 @@ from .models import User, Chat, Message, UserRole, MessageType, PromptTemplate,
 from .serializers import (
     UserSerializer, UserRegistrationSerializer, UserUpdateSerializer,
     CustomTokenObtainPairSerializer, ChatSerializer, MessageSerializer,
-    ChatCreateSerializer, AdminChatSerializer,
-    PromptTemplateSerializer, PromptParametersSerializer, PromptAssembleSerializer, MediaGenerationTaskSerializer,
+    ChatCreateSerializer, AdminChatSerializer, ChatListSerializer, AdminChatListSerializer,
+    PromptTemplateSerializer, PromptParametersSerializer, PromptAssembleSerializer, MediaGenerationTaskSerializer, MediaGenerationTaskListSerializer,
     FormGenerationSerializer, FormGenerationResponseSerializer
 )
 from .utils import (
     assemble_prompt_from_template, simple_semantic_vector_from_params, 
     enrich_prompt_with_gigachat, quality_check_generated, 
     handle_user_message_and_advance, paraphrase_prompt, get_default_prompt_template,
-    get_empty_chat, optimize_prompt_for_kandinsky, calculate_dimensions,
-    generate_image_with_quality_check, generate_image_without_check
+    get_empty_chat, optimize_prompt_for_kandinsky, calculate_dimensions, FlowStepConflict
 )
+from .generation_queue import enqueue_generation_task
 from . import docs
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse
+from django.db import IntegrityError, transaction
 import base64
 import json
 
@@ -135,9 +136,17 @@ class ChatViewSet(viewsets.ModelViewSet):
             return Chat.objects.none()
             
         user = self.request.user
+        chats = Chat.objects.all()
+        if self.action == "list":
+            # messageCount и lastMessage без запросов на каждый чат
+            chats = chats.for_list(include_messages=self._include_messages())
         if user.role == UserRole.ADMIN:
-            return Chat.objects.all()
-        return Chat.objects.filter(user=user, isActive=True)
+            return chats.select_related("user")
+        return chats.filter(user=user, isActive=True)
+
+    def _include_messages(self):
+        """Список отдает все сообщения чатов только по ?include=messages"""
+        return "messages" in self.request.query_params.get("include", "").split(",")
 
     def get_serializer_class(self):
         if getattr(self, 'swagger_fake_view', False):
@@ -145,7 +154,10 @@ class ChatViewSet(viewsets.ModelViewSet):
             
         if self.action == "create":
             return ChatCreateSerializer
-        if self.request.user.role == UserRole.ADMIN:
+        is_admin = self.request.user.role == UserRole.ADMIN
+        if self.action == "list" and not self._include_messages():
+            return AdminChatListSerializer if is_admin else ChatListSerializer
+        if is_admin:
             return AdminChatSerializer
         return ChatSerializer
 
@@ -234,7 +246,7 @@ class ChatViewSet(viewsets.ModelViewSet):
         chat = self.get_object()
         
         # Ищем последнюю задачу генерации для этого чата
-        task = MediaGenerationTask.objects.filter(chat=chat).order_by('-createdAt').first()
+        task = MediaGenerationTask.objects.filter(chat=chat).status_only().order_by('-createdAt').first()
         
         if not task:
             return Response({
@@ -250,13 +262,20 @@ class ChatViewSet(viewsets.ModelViewSet):
             "data": {
                 "generation_status": task.status,
                 "task_id": str(task.id),
-                "has_image": bool(task.result_image_base64),
+                "has_image": task.has_image,
                 "last_error": task.last_error,
                 "created_at": task.createdAt,
                 "updated_at": task.updatedAt
             }
         })
     
+    @docs.generation_events_token_schema
+    @action(detail=True, methods=['post'], url_path='generation-events-token')
+    def generation_events_token(self, request, pk=None):
+        """Одноразовый токен для SSE-потока событий генерации чата"""
+        chat = self.get_object()
+        return _stream_token_response(request.user, f"chat:{chat.id}")
+
     @docs.chat_generated_images_schema
     @action(detail=True, methods=['get'])
     def generated_images(self, request, pk=None):
@@ -366,12 +385,54 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         print(serializer.is_valid())
         serializer.is_valid(raise_exception=True)
-        msg = serializer.save()
 
-        if msg.messageType == MessageType.USER:
-            chat = msg.chat
-            result = handle_user_message_and_advance(chat, msg)
-            
+        # Повторная отправка с тем же Idempotency-Key (двойной клик, ретрай клиента)
+        # возвращает уже принятое сообщение и не продвигает flow повторно
+        idempotency_key = request.headers.get("Idempotency-Key") or None
+        if idempotency_key and len(idempotency_key) > 255:
+            return Response({
+                "status": "error",
+                "message": "Idempotency-Key не должен быть длиннее 255 символов"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # Шаг flow, на который отвечает клиент: ответ на уже отвеченный вопрос отклоняется
+        expected_step = request.data.get("flow_step")
+        if expected_step is not None:
+            try:
+                expected_step = int(expected_step)
+            except (TypeError, ValueError):
+                return Response({
+                    "status": "error",
+                    "message": "flow_step должен быть целым числом"
+                }, status=status.HTTP_400_BAD_REQUEST)
+        chat = serializer.validated_data["chat"]
+        if idempotency_key:
+            duplicate = Message.objects.filter(chat=chat, idempotency_key=idempotency_key).first()
+            if duplicate:
+                return self._duplicate_response(duplicate)
+        try:
+            # Сообщение и переход flow фиксируются вместе: если продвинуть flow
+            # не удалось, сообщение откатывается и повтор с тем же ключом
+            # обработается заново, а не вернется как уже принятый
+            with transaction.atomic():
+                msg = serializer.save(idempotency_key=idempotency_key)
+                result = None
+                if msg.messageType == MessageType.USER:
+                    result = handle_user_message_and_advance(msg.chat, msg, expected_step)
+        except FlowStepConflict as e:
+            # Сообщение откатилось вместе с транзакцией - второй ответ не сохранен
+            return Response({
+                "status": "error",
+                "message": str(e),
+                "data": {"flow_step": e.flow_step}
+            }, status=status.HTTP_409_CONFLICT)
+        except IntegrityError:
+            # Параллельный запрос с тем же ключом успел сохранить сообщение первым
+            duplicate = Message.objects.filter(chat=chat, idempotency_key=idempotency_key).first()
+            if duplicate is None:
+                raise
+            return self._duplicate_response(duplicate)
+
+        if result is not None:
             if result["type"] == "question":
                 sys_msg = result["message"]
                 return Response({
@@ -388,71 +449,23 @@ class MessageViewSet(viewsets.ModelViewSet):
                 ph = result.get("prompt_history")
                 generation_result = result.get("generation_result", {})
                 
-                # Получаем задачу генерации (только успешную)
-                task = MediaGenerationTask.objects.filter(
-                    prompt_history=ph, 
-                    chat=msg.chat,
-                    status=MediaGenerationTask.Status.SUCCESS
-                ).order_by('-createdAt').first()
-                
-                base_url = f"http://{request.get_host()}"
+                # Генерация выполняется воркером в фоне: сразу возвращаем ID задачи,
+                # готовое изображение появится в чате отдельным IMAGE сообщением
+                task_id = generation_result.get("task_id")
+                sys_msg = generation_result.get("message")
                 
-                if task and task.result_image_base64:
-                    # Создаем сообщение с типом IMAGE
-                    image_message_content = json.dumps({
-                        "type": "image",
-                        "info": {
-                            "task_id": str(task.id),
-                            "prompt": task.prompt_text,
-                            "image_url": f"{base_url}/api/generation-tasks/{task.id}/image-file/",
-                            "download_url": f"{base_url}/api/generation-tasks/{task.id}/download/",
-                            "regeneration_attempts": generation_result.get("regeneration_attempts", 0),
-                            "total_attempts": generation_result.get("attempts", 1)
-                        }
-                    }, ensure_ascii=False)
-                    
-                    # Создаем SYSTEM сообщение с изображением
-                    image_msg = Message.objects.create(
-                        chat=msg.chat,
-                        content=image_message_content,  # Это уже JSON строка
-                        messageType=MessageType.SYSTEM
-                    )
-                    
-                    return Response({
-                        "status": "success", 
-                        "message": "Flow завершён, изображение сгенерировано", 
-                        "data": {
-                            "user_message": MessageSerializer(msg).data,
-                            "system_message": MessageSerializer(image_msg).data,
-                            "prompt_parameters_id": str(pp.id) if pp else None,
-                            "prompt_history_id": str(ph.id) if ph else None,
-                        }
-                    }, status=status.HTTP_201_CREATED)
-                else:
-                    # Если изображение еще не готово, создаем сообщение о процессе
-                    processing_content = {
-                        "type": "text",
-                        "info": "🔄 Генерация изображения в процессе..."
+                return Response({
+                    "status": "success", 
+                    "message": "Flow завершён, генерация поставлена в очередь", 
+                    "data": {
+                        "user_message": MessageSerializer(msg).data,
+                        "system_message": MessageSerializer(sys_msg).data if sys_msg else None,
+                        "prompt_parameters_id": str(pp.id) if pp else None,
+                        "prompt_history_id": str(ph.id) if ph else None,
+                        "generation_task_id": str(task_id) if task_id else None,
+                        "status": "generating"
                     }
-                    
-                    processing_msg = Message.objects.create(
-                        chat=msg.chat,
-                        content=processing_content,
-                        messageType=MessageType.SYSTEM
-                    )
-                    
-                    return Response({
-                        "status": "success", 
-                        "message": "Flow завершён, генерация запущена", 
-                        "data": {
-                            "user_message": MessageSerializer(msg).data,
-                            "system_message": MessageSerializer(processing_msg).data,
-                            "prompt_parameters_id": str(pp.id) if pp else None,
-                            "prompt_history_id": str(ph.id) if ph else None,
-                            "generation_task_id": str(task.id) if task else None,
-                            "status": "generating"
-                        }
-                    }, status=status.HTTP_201_CREATED)
+                }, status=status.HTTP_201_CREATED)
         
         return Response({
             "status": "success", 
@@ -460,6 +473,27 @@ class MessageViewSet(viewsets.ModelViewSet):
             "data": MessageSerializer(msg).data
         }, status=status.HTTP_201_CREATED)
 
+    def _duplicate_response(self, msg):
+        print(f"🔁 IDEMPOTENCY DEBUG: повторный запрос для сообщения {msg.id}")
+        # Задача генерации, которую запустило это сообщение (до следующего ответа пользователя)
+        tasks = MediaGenerationTask.objects.filter(chat_id=msg.chat_id, createdAt__gte=msg.createdAt)
+        next_answer = (
+            Message.objects.filter(chat_id=msg.chat_id, messageType=MessageType.USER, createdAt__gt=msg.createdAt)
+            .order_by("createdAt").values_list("createdAt", flat=True).first()
+        )
+        if next_answer:
+            tasks = tasks.filter(createdAt__lt=next_answer)
+        task_id = tasks.order_by("createdAt").values_list("id", flat=True).first()
+        return Response({
+            "status": "success",
+            "message": "Сообщение уже принято",
+            "data": {
+                "user_message": MessageSerializer(msg).data,
+                "generation_task_id": str(task_id) if task_id else None,
+                "duplicate": True
+            }
+        }, status=status.HTTP_200_OK)
+
 
     @action(detail=False, methods=["get"])
     def recent(self, request):
@@ -688,14 +722,23 @@ class MediaGenerationTaskViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = MediaGenerationTaskSerializer
     permission_classes = [PublicDownloadPermission]
 
+    def get_serializer_class(self):
+        if self.action == "list":
+            return MediaGenerationTaskListSerializer
+        return MediaGenerationTaskSerializer
+
     def get_queryset(self):
         user = self.request.user
         
         # Если пользователь авторизован - стандартная логика
         if user.is_authenticated:
+            tasks = MediaGenerationTask.objects.all()
+            if self.action == "list":
+                # В списке нет байтов изображения - только флаг и метаданные
+                tasks = tasks.for_list().with_image_info()
             if hasattr(user, 'role') and user.role == UserRole.ADMIN:
-                return MediaGenerationTask.objects.all()
-            return MediaGenerationTask.objects.filter(user=user)
+                return tasks
+            return tasks.filter(user=user)
         
         # Если пользователь не авторизован - проверяем URL
         else:
@@ -722,7 +765,7 @@ class MediaGenerationTaskViewSet(viewsets.ReadOnlyModelViewSet):
         """Получение изображения в формате JSON с Base64"""
         task = self.get_object()
         
-        if not task.result_image_base64:
+        if not task.has_image:
             return Response({
                 "status": "error",
                 "message": "Изображение еще не готово или произошла ошибка генерации"
@@ -732,7 +775,9 @@ class MediaGenerationTaskViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({
             "status": "success",
             "data": {
-                "image_base64": task.result_image_base64,
+                "image_base64": base64.b64encode(task.read_image()).decode("ascii"),
+                "image_mime": task.image_mime,
+                "image_size": task.image_size,
                 "task_id": str(task.id),
                 "prompt": task.prompt_text,
                 "created_at": task.createdAt,
@@ -747,54 +792,55 @@ class MediaGenerationTaskViewSet(viewsets.ReadOnlyModelViewSet):
         """Получение изображения как файла для мгновенного показа"""
         task = self.get_object()
         
-        if not task.result_image_base64:
+        if not task.has_image:
             return Response({
                 "status": "error",
                 "message": "Изображение еще не готово или произошла ошибка генерации"
             }, status=status.HTTP_404_NOT_FOUND)
         
-        import base64
         try:
-            image_data = task.result_image_base64
-            if 'base64,' in image_data:
-                image_data = image_data.split('base64,')[1]
-            
-            image_binary = base64.b64decode(image_data)
-            response = HttpResponse(image_binary, content_type='image/png')
-            # ✅ 'inline' для показа в браузере
-            response['Content-Disposition'] = f'inline; filename="generated_image_{task.id}.png"'
-            return response
+            # ✅ 'inline' для показа в браузере, файл отдается потоком из хранилища
+            return FileResponse(
+                task.open_image(),
+                content_type=task.image_mime,
+                filename=task.image_filename
+            )
         except Exception as e:
             return Response({
                 "status": "error",
-                "message": f"Ошибка декодирования изображения: {str(e)}"
+                "message": f"Ошибка чтения изображения: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @docs.generation_events_token_schema
+    @action(detail=True, methods=['post'], url_path='events-token')
+    def events_token(self, request, pk=None):
+        """Одноразовый токен для SSE-потока событий задачи"""
+        task = self.get_object()
+        return _stream_token_response(request.user, f"task:{task.id}")
+
     @docs.generation_task_download_schema
     @action(detail=True, methods=['get'], url_path='download')
     def download_image(self, request, pk=None):
         """Скачивание изображения как файла"""
         task = self.get_object()
         
-        if not task.result_image_base64:
+        if not task.has_image:
             return Response({
                 "status": "error",
                 "message": "Изображение не найдено"
             }, status=status.HTTP_404_NOT_FOUND)
         
         try:
-            image_data = task.result_image_base64
-            if 'base64,' in image_data:
-                image_data = image_data.split('base64,')[1]
-            
-            image_binary = base64.b64decode(image_data)
-            response = HttpResponse(image_binary, content_type='image/png')
-            response['Content-Disposition'] = f'attachment; filename="generated_image_{task.id}.png"'
-            return response
+            return FileResponse(
+                task.open_image(),
+                content_type=task.image_mime,
+                as_attachment=True,
+                filename=task.image_filename
+            )
         except Exception as e:
             return Response({
                 "status": "error",
-                "message": f"Ошибка декодирования изображения: {str(e)}"
+                "message": f"Ошибка чтения изображения: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class FormGenerationViewSet(viewsets.ViewSet):
@@ -809,10 +855,9 @@ class FormGenerationViewSet(viewsets.ViewSet):
         
         Принимает все параметры формы одним запросом:
         - Выполняет сборку промпта
-        - Запускает генерацию через Kandinsky
-        - Проверяет качество фото
-        - При необходимости перегенерирует
-        - Возвращает готовое изображение
+        - Ставит задачу генерации через Kandinsky в очередь
+        - Воркер генерирует, проверяет качество фото и при необходимости перегенерирует
+        - Возвращает ID задачи и ссылки на будущее изображение
         """
         serializer = FormGenerationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -855,66 +900,51 @@ class FormGenerationViewSet(viewsets.ViewSet):
         # 3. Рассчитываем размеры
         width, height = calculate_dimensions(params['aspect_ratio'])
         
-        # 4. Запускаем генерацию с проверкой
+        # 4. Ставим генерацию в очередь (выполняет воркер)
         enable_check = params.get('enable_photo_check', True)
         max_retries = params.get('max_regeneration_attempts', 3)
         
-        if enable_check:
-            # С проверкой качества
-            generation_result = generate_image_with_quality_check(
-                user=request.user,
-                prompt_history=prompt_history,
-                prompt_text=assembled_prompt,
-                width=width,
-                height=height,
-                max_retries=max_retries
-            )
-        else:
-            # Без проверки качества
-            generation_result = generate_image_without_check(
-                user=request.user,
-                prompt_history=prompt_history,
-                prompt_text=assembled_prompt,
-                width=width,
-                height=height
-            )
+        task = enqueue_generation_task(
+            user=request.user,
+            prompt_history=prompt_history,
+            prompt_text=assembled_prompt,
+            width=width,
+            height=height,
+            check_quality=enable_check,
+            max_attempts=max_retries if enable_check else 1
+        )
         
         # 5. Создаем ответ
         base_url = f"http://{request.get_host()}"
         response_data = {
-            'task_id': generation_result['task_id'],
-            'status': generation_result['status'],
+            'task_id': task.id,
+            'status': task.status,
             'assembled_prompt': assembled_prompt,
-            'generation_attempts': generation_result.get('attempts', 1),
-            'regeneration_attempts': generation_result.get('regeneration_attempts', 0),
-            'problems_fixed': generation_result.get('problems', []),
-            'estimated_time_seconds': 60  # Примерное время
+            'generation_attempts': task.attempts,
+            'regeneration_attempts': 0,
+            'problems_fixed': [],
+            'estimated_time_seconds': 60,  # Примерное время
+            # Ссылки начнут отдавать изображение после статуса SUCCESS
+            'image_url': f"{base_url}/api/generation-tasks/{task.id}/image-file/",
+            'download_url': f"{base_url}/api/generation-tasks/{task.id}/download/",
         }
         
-        # Добавляем URLs если изображение готово
-        if generation_result['status'] == 'SUCCESS':
-            task_id = generation_result['task_id']
-            response_data.update({
-                'image_url': f"{base_url}/api/generation-tasks/{task_id}/image-file/",
-                'download_url': f"{base_url}/api/generation-tasks/{task_id}/download/",
-            })
-        
         # Аудит
         AuditLog.objects.create(
             user=request.user,
             action="form_generation",
             model_name="FormGeneration",
-            object_id=str(generation_result['task_id']),
+            object_id=str(task.id),
             details={
                 'parameters': {k: v for k, v in params.items() if k != 'enable_photo_check'},
-                'result_status': generation_result['status'],
-                'attempts': generation_result.get('attempts', 1)
+                'result_status': task.status,
+                'attempts': task.attempts
             }
         )
         
         return Response({
             "status": "success",
-            "message": "Генерация запущена",
+            "message": "Генерация поставлена в очередь",
             "data": response_data
         }, status=status.HTTP_201_CREATED)
     
@@ -946,4 +976,93 @@ class FormGenerationViewSet(viewsets.ViewSet):
         return Response({
             "status": "success",
             "data": styles
-        })
\ No newline at end of file
+        })
+
+def _stream_user(request, key):
+    """
+    Пользователь SSE-запроса. Клиенты, умеющие передавать заголовки, используют
+    JWT в Authorization. EventSource в браузере заголовки не передает, поэтому
+    ему выдается одноразовый токен потока (events-token), который передается
+    параметром ?token= - JWT access токен в URL не попадает.
+    """
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    from .generation_events import consume_stream_token
+
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        authentication = JWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(header.split(" ", 1)[1]))
+        except (InvalidToken, TokenError, AuthenticationFailed):
+            return None
+
+    raw_token = request.GET.get("token")
+    if not raw_token:
+        return None
+    return consume_stream_token(raw_token, key)
+
+
+def _stream_token_response(user, key):
+    from .generation_events import issue_stream_token
+
+    token, expires_in = issue_stream_token(user, key)
+    return Response({
+        "status": "success",
+        "data": {"token": token, "expires_in": expires_in}
+    })
+
+
+def _stream_allowed(user, kind, object_id):
+    """Доступ к потоку - как к самой задаче или чату: владелец или администратор"""
+    objects = MediaGenerationTask.objects.filter(id=object_id) if kind == "task" else Chat.objects.filter(id=object_id)
+    if user.role != UserRole.ADMIN:
+        objects = objects.filter(user=user) if kind == "task" else objects.filter(user=user, isActive=True)
+    return objects.exists()
+
+
+async def _generation_event_stream(request, kind, object_id):
+    from asgiref.sync import sync_to_async
+    from django.http import JsonResponse, StreamingHttpResponse
+    from .generation_events import stream_events
+
+    user = await sync_to_async(_stream_user)(request, f"{kind}:{object_id}")
+    if user is None:
+        return JsonResponse({
+            "status": "error",
+            "message": "Требуется аутентификация"
+        }, status=401, json_dumps_params={'ensure_ascii': False})
+    if not await sync_to_async(_stream_allowed)(user, kind, object_id):
+        return JsonResponse({
+            "status": "error",
+            "message": "Задача или чат не найдены"
+        }, status=404, json_dumps_params={'ensure_ascii': False})
+
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.GET.get("last_event_id") or 0)
+    except ValueError:
+        last_id = 0
+
+    response = StreamingHttpResponse(
+        stream_events(f"{kind}:{object_id}", last_id, close_on_final=kind == "task"),
+        content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def generation_task_events(request, pk):
+    """
+    SSE-поток событий задачи генерации: queued, submitted, kandinsky_status,
+    checking, regenerating, deferred, done (со ссылками на изображение) или failed.
+    Поток закрывается после done/failed.
+    """
+    return await _generation_event_stream(request, "task", pk)
+
+
+async def chat_generation_events(request, pk):
+    """SSE-поток событий всех задач генерации чата"""
+    return await _generation_event_stream(request, "chat", pk)